@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(ROOT, 'src'))
+
+from database import connect_db, release_db
+
+# 📌 1️⃣ CNPJs para a carga: amostra da Gold, com alguns inexistentes
+def sample_cnpjs(size, missing_share, seed):
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        # 🔹 TABLESAMPLE evita varrer a Gold inteira só para sortear CNPJs
+        cursor.execute("SELECT DISTINCT cnpj FROM gold.empresas TABLESAMPLE SYSTEM (10) LIMIT %s;", (size,))
+        cnpjs = [row[0] for row in cursor.fetchall()]
+        if len(cnpjs) < size:
+            cursor.execute("SELECT DISTINCT cnpj FROM gold.empresas LIMIT %s;", (size,))
+            cnpjs = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        release_db(conn)
+
+    if not cnpjs:
+        raise RuntimeError("❌ gold.empresas está vazia: rode o pipeline antes do teste de carga.")
+
+    rng = np.random.default_rng(seed)
+    missing = int(len(cnpjs) * missing_share)
+    cnpjs += [f"9{value:07d}" for value in rng.integers(0, 10**7, missing)]  # 🔹 Prefixo 9: fora do gerador sintético
+    rng.shuffle(cnpjs)
+    return cnpjs
+
+# 📌 2️⃣ Sequência de chaves com distribuição Zipf: poucas chaves quentes, cauda longa
+def key_sequence(cnpjs, requests, skew, seed):
+    rng = np.random.default_rng(seed)
+    if skew <= 0:
+        return [cnpjs[i] for i in rng.integers(0, len(cnpjs), requests)]
+    ranks = np.arange(1, len(cnpjs) + 1)
+    weights = 1 / ranks ** skew
+    return [cnpjs[i] for i in rng.choice(len(cnpjs), requests, p=weights / weights.sum())]
+
+# 📌 3️⃣ Uma requisição HTTP/1.1 numa conexão keep-alive
+async def request(reader, writer, method, path, host, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    data = await reader.readexactly(length)
+    return status, data
+
+# 📌 4️⃣ Um cliente: consome a fila de requisições medindo a latência de cada uma
+async def client(url, queue, latencies, statuses, batch):
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    try:
+        while queue:
+            keys = [queue.pop() for _ in range(min(batch or 1, len(queue)))]
+            start = time.perf_counter()
+            if batch:
+                status, _ = await request(reader, writer, "POST", "/cnpj", url.netloc, {"cnpjs": keys})
+            else:
+                status, _ = await request(reader, writer, "GET", f"/cnpj/{keys[0]}", url.netloc)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def cache_stats(url):
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    try:
+        _, data = await request(reader, writer, "GET", "/health", url.netloc)
+        return json.loads(data)["cache"]
+    finally:
+        writer.close()
+
+# 📌 5️⃣ Disparar a carga com N clientes simultâneos
+async def run_load(url, keys, concurrency, batch):
+    queue = list(reversed(keys))
+    latencies = []
+    statuses = {}
+    before = await cache_stats(url)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(url, queue, latencies, statuses, batch) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = await cache_stats(url)
+    return latencies, statuses, elapsed, before, after
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+# 📌 6️⃣ Executar o teste de carga
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da API de consulta de CNPJ (src/api.py).")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--requests", type=int, default=20_000, help="Quantidade de requisições")
+    parser.add_argument("--concurrency", type=int, default=32, help="Conexões keep-alive simultâneas")
+    parser.add_argument("--batch", type=int, default=0, help="CNPJs por requisição em lote (0: GET /cnpj/{cnpj})")
+    parser.add_argument("--keys", type=int, default=50_000, help="CNPJs distintos sorteados da Gold")
+    parser.add_argument("--skew", type=float, default=1.1, help="Expoente Zipf das chaves (0: uniforme)")
+    parser.add_argument("--missing-share", type=float, default=0.05, help="Fração de CNPJs inexistentes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Arquivo JSON Lines para acrescentar o resultado")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    cnpjs = sample_cnpjs(args.keys, args.missing_share, args.seed)
+    total_keys = args.requests * (args.batch or 1)
+    keys = key_sequence(cnpjs, total_keys, args.skew, args.seed)
+    print(f"🚀 {args.requests} requisições, {args.concurrency} conexões, {len(cnpjs)} CNPJs distintos (Zipf {args.skew})")
+
+    latencies, statuses, elapsed, before, after = asyncio.run(run_load(url, keys, args.concurrency, args.batch))
+    ordered = sorted(latencies)
+    hits = after["acertos"] - before["acertos"]
+    lookups = hits + after["falhas"] - before["falhas"]
+    result = {
+        "executado_em": datetime.now().isoformat(timespec="seconds"),
+        "requisicoes": len(latencies),
+        "concorrencia": args.concurrency,
+        "lote": args.batch,
+        "skew": args.skew,
+        "segundos": round(elapsed, 3),
+        "requisicoes_por_segundo": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "status": statuses,
+        "taxa_acerto_cache": round(hits / lookups, 4) if lookups else None,
+    }
+
+    print(f"⏱️ {result['requisicoes_por_segundo']:,.0f} req/s | p50 {result['p50_ms']:.2f} ms | "
+          f"p95 {result['p95_ms']:.2f} ms | p99 {result['p99_ms']:.2f} ms | max {result['max_ms']:.2f} ms")
+    print(f"📊 Status: {statuses} | acerto do cache: {result['taxa_acerto_cache']}")
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
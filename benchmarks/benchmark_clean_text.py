@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import ingestion_bronze_empresas
+import ingestion_bronze_socios
+import ingestion_silver_socios
+from transform import clean_text_columns, clean_utf8_strip, clean_printable_ascii
+
+# 🔹 Caracteres usados para "sujar" os textos sintéticos
+DIRTY_CHARS = ["\x00", "\x01", "\x1f", "\x7f", "\x85", "\xa0", "Ç", "ã", "é", "*", "\t", " "]
+
+# 📌 1️⃣ Gerar uma coluna de textos sintéticos com caracteres sujos
+def synthetic_column(rows, rng, dirty_share=0.2, null_share=0.05):
+    base = pd.Series(rng.integers(0, 10**9, rows)).map(lambda n: f" SOCIO {n} ")
+    dirty = rng.random(rows) < dirty_share
+    noise = pd.Series(rng.choice(DIRTY_CHARS, rows))
+    base[dirty] = base[dirty] + noise[dirty] + "*" + noise[dirty]
+    base[rng.random(rows) < null_share] = np.nan
+    return base.astype(object)
+
+# 📌 2️⃣ Medir o tempo de uma função
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+# 📌 3️⃣ Comparar a versão antiga (por célula) com a vetorizada
+def compare(name, df, reference, vectorized):
+    expected, t_ref = timed(lambda d: d.applymap(reference), df.copy())
+    result, t_vec = timed(vectorized, df.copy())
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"✅ {name}: saídas idênticas | por célula {t_ref:.2f}s | vetorizada {t_vec:.2f}s | {t_ref / t_vec:.1f}x")
+
+# 📌 4️⃣ Executar o benchmark
+def main():
+    parser = argparse.ArgumentParser(description="Equivalência e benchmark da limpeza vetorizada de texto.")
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    df = pd.DataFrame({"nome_socio": synthetic_column(args.rows, rng),
+                       "documento_socio": synthetic_column(args.rows, rng),
+                       "pais": synthetic_column(args.rows, rng)})
+    print(f"📊 {args.rows} linhas sintéticas x {len(df.columns)} colunas")
+
+    compare("bronze empresas", df, ingestion_bronze_empresas.clean_text,
+            lambda d: clean_text_columns(d, clean_utf8_strip))
+    compare("bronze socios", df, ingestion_bronze_socios.clean_text,
+            lambda d: clean_text_columns(d, clean_printable_ascii))
+    compare("silver socios", df, ingestion_silver_socios.clean_text,
+            lambda d: clean_text_columns(d, lambda s: clean_printable_ascii(s, remove_chars='*')))
+
+if __name__ == "__main__":
+    main()
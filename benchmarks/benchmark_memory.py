@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import ingestion_bronze_empresas
+import ingestion_bronze_socios
+from database import build_copy_buffer
+from transform import clean_text_columns, clean_utf8_strip, clean_printable_ascii
+
+PORTES = ["00", "01", "03", "05"]
+PAISES = ["", "BRASIL", "ARGENTINA", "ALEMANHA", "PORTUGAL", "ESTADOS UNIDOS"]
+
+# 📌 1️⃣ CSVs sintéticos no layout da Receita (latin1, ';', sem cabeçalho)
+def synthetic_empresas(rows, rng):
+    cnpj = pd.Series(np.arange(rows)).map(lambda n: f"{n:08d}")
+    df = pd.DataFrame({
+        "cnpj": cnpj,
+        "razao_social": "EMPRESA " + cnpj + " LTDA",
+        "natureza_juridica": rng.choice([2062, 2135, 2305, 2240, 4014], rows),
+        "qualificacao_responsavel": rng.choice([5, 10, 16, 49, 65], rows),
+        "capital_social": pd.Series(rng.integers(0, 10**7, rows)).map(lambda n: f"{n},00"),
+        "cod_porte": rng.choice(PORTES, rows),
+        "ignore": "",
+    })
+    return df.to_csv(sep=";", header=False, index=False).encode("latin1")
+
+def synthetic_socios(rows, rng):
+    cnpj = pd.Series(rng.integers(0, rows // 2 + 1, rows)).map(lambda n: f"{n:08d}")
+    df = pd.DataFrame({
+        "cnpj": cnpj,
+        "tipo_socio": rng.choice(["1", "2", "3"], rows),
+        "nome_socio": "SÓCIO " + pd.Series(np.arange(rows)).astype(str),
+        "documento_socio": pd.Series(rng.integers(0, 10**6, rows)).map(lambda n: f"***{n:06d}**"),
+        "codigo_qualificacao_socio": rng.choice(["22", "49", "05", "16"], rows),
+        "data_entrada_sociedade": pd.Series(rng.integers(0, 9000, rows)).map(
+            lambda n: (pd.Timestamp("2000-01-01") + pd.Timedelta(days=int(n))).strftime("%Y%m%d")),
+        "faixa_etaria": rng.choice(["0", "2", "4", "6", "8"], rows),
+        "pais": rng.choice(PAISES, rows),
+        "representante_legal": "***000000**",
+        "nome_representante": "",
+        "qualificacao_representante": "00",
+    })
+    return df.to_csv(sep=";", header=False, index=False).encode("latin1")
+
+# 📌 2️⃣ Leitura antiga: tudo como texto em objetos Python
+def legacy_empresas(raw):
+    df = pd.read_csv(io.BytesIO(raw), sep=";", header=None, dtype=str, encoding="latin1")
+    df.columns = ingestion_bronze_empresas.CSV_COLUMNS
+    df.drop(columns=["ignore"], inplace=True)
+    df["capital_social"] = df["capital_social"].str.replace(",", ".").astype(float)
+    return clean_text_columns(df, clean_utf8_strip)
+
+def legacy_socios(raw):
+    df = pd.read_csv(io.BytesIO(raw), sep=";", header=None, dtype=str, encoding="latin1")
+    df.columns = ingestion_bronze_socios.CSV_COLUMNS
+    df["data_entrada_sociedade"] = pd.to_datetime(df["data_entrada_sociedade"], errors='coerce')
+    return clean_text_columns(df, clean_printable_ascii)
+
+# 📌 3️⃣ Leitura atual: mesmos parâmetros do stream_csv de cada módulo
+def typed_frame(module, raw):
+    df = pd.read_csv(io.BytesIO(raw), sep=";", header=None, names=module.CSV_COLUMNS,
+                     dtype=module.CSV_DTYPES, encoding="latin1")
+    return module.transform_chunk(df)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+# 📌 4️⃣ Comparar memória por coluna e garantir que o COPY enviado é o mesmo
+def compare(name, raw, legacy, typed):
+    old, t_old = timed(legacy, raw)
+    new, t_new = timed(typed, raw)
+
+    old_bytes = old.memory_usage(deep=True, index=False)
+    new_bytes = new.memory_usage(deep=True, index=False)
+    print(f"\n📊 {name}: {len(new)} linhas, CSV de {len(raw) / 1024 / 1024:.1f} MB")
+    print(f"   {'coluna':<28}{'antes':>10}{'depois':>10}  tipo")
+    for col in new.columns:
+        print(f"   {col:<28}{old_bytes[col] / 1024 / 1024:>8.1f}MB{new_bytes[col] / 1024 / 1024:>8.1f}MB  {new[col].dtype}")
+    print(f"   {'total':<28}{old_bytes.sum() / 1024 / 1024:>8.1f}MB{new_bytes.sum() / 1024 / 1024:>8.1f}MB"
+          f"  ({old_bytes.sum() / new_bytes.sum():.1f}x menor)")
+    print(f"   leitura + tratamento: antes {t_old:.2f}s | depois {t_new:.2f}s")
+
+    # 🔹 O que importa para o banco é o texto do COPY: precisa ser idêntico byte a byte
+    columns = list(new.columns)
+    assert build_copy_buffer(old, columns).getvalue() == build_copy_buffer(new, columns).getvalue()
+    print(f"✅ {name}: buffer do COPY idêntico")
+
+# 📌 5️⃣ Executar o benchmark
+def main():
+    parser = argparse.ArgumentParser(description="Memória dos blocos com tipos compactos vs. tudo como texto.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    compare("bronze empresas", synthetic_empresas(args.rows, rng), legacy_empresas,
+            lambda raw: typed_frame(ingestion_bronze_empresas, raw))
+    compare("bronze socios", synthetic_socios(args.rows, rng), legacy_socios,
+            lambda raw: typed_frame(ingestion_bronze_socios, raw))
+
+if __name__ == "__main__":
+    main()
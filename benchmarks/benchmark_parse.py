@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import zipfile
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import ingestion_bronze_socios
+import parallel_csv
+from benchmark_memory import synthetic_socios
+
+MEMBER = "K3241.K03200Y0.D00000.SOCIOCSV"
+
+# 📌 1️⃣ ZIP sintético de sócios, com alguns nomes entre aspas contendo ';' e quebra de linha
+def build_zip(path, rows, rng):
+    raw = synthetic_socios(rows, rng).decode("latin1").splitlines(keepends=True)
+    for i in rng.choice(len(raw), max(1, rows // 1000), replace=False):
+        fields = raw[i].split(";")
+        fields[2] = f'"{fields[2]};\nFILIAL ""NORTE"""'
+        raw[i] = ";".join(fields)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(MEMBER, "".join(raw).encode("latin1"))
+
+# 📌 2️⃣ Leitura sequencial de hoje: um stream do ZIP, tratado bloco a bloco no mesmo processo
+def serial(zip_path, chunk_size):
+    for chunk in ingestion_bronze_socios.stream_csv(zip_path, MEMBER, chunk_size):
+        yield ingestion_bronze_socios.transform_chunk(chunk)
+
+def parallel(zip_path, chunk_size, workers):
+    return parallel_csv.parse_parallel(zip_path, MEMBER, chunk_size, ingestion_bronze_socios.CSV_READ_OPTIONS,
+                                       ingestion_bronze_socios.transform_chunk, workers=workers)
+
+# 🔹 Hash de cada linha, na ordem: o tamanho dos blocos pode variar, o conteúdo não
+def consume(chunks):
+    start = time.perf_counter()
+    hashes = [pd.util.hash_pandas_object(chunk.astype(str), index=False).to_numpy() for chunk in chunks]
+    return np.concatenate(hashes), time.perf_counter() - start
+
+# 📌 3️⃣ Executar o benchmark
+def main():
+    parser = argparse.ArgumentParser(description="Parse sequencial x parse paralelo por faixas de bytes de um membro CSV.")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--chunk-size", type=int, default=200_000)
+    parser.add_argument("--workers", default="2,4", help="Quantidades de processos, separadas por vírgula")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parallel_csv.EXTRACT_PATH = os.path.join(tmp, "extraido")
+        zip_path = os.path.join(tmp, "Socios0.zip")
+        build_zip(zip_path, args.rows, np.random.default_rng(args.seed))
+        print(f"📊 {args.rows} linhas sintéticas | {os.cpu_count()} núcleo(s) disponível(is)")
+
+        expected, t_serial = consume(serial(zip_path, args.chunk_size))
+        print(f"⏱️ sequencial: {t_serial:.2f}s ({len(expected) / t_serial:,.0f} linhas/s)")
+
+        # 🔹 Extração fora da medição: nas cargas seguintes do mesmo ZIP ela é reaproveitada
+        parallel_csv.extract_member(zip_path, MEMBER, parallel_csv.EXTRACT_PATH)
+        for workers in [int(value) for value in args.workers.split(",")]:
+            result, seconds = consume(parallel(zip_path, args.chunk_size, workers))
+            same = np.array_equal(result, expected)
+            print(f"{'✅' if same else '❌'} {workers} processo(s): {seconds:.2f}s "
+                  f"({len(result) / seconds:,.0f} linhas/s) | {t_serial / seconds:.2f}x | saída idêntica: {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.dirname(__file__))
+
+import generate_dataset
+from main import STAGES
+from database import connect_db, release_db
+
+SCHEMAS = ["bronze", "silver", "gold", "controle"]
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), 'results.jsonl')
+
+# 🔹 Código executado no processo filho: uma etapa, do mesmo jeito que o main.py a executa.
+#    O relatório da etapa (src/metrics.py) traz o pico de memória medido lá dentro, incluindo
+#    os shards da Bronze; o ru_maxrss visto pelo pai herdaria o RSS do próprio benchmark.
+STAGE_RUNNER = """
+import sys, json
+sys.path.insert(0, sys.argv[1])
+import main
+report = main.run_stage(sys.argv[2], json.loads(sys.argv[3]))
+with open(sys.argv[4], 'w') as f:
+    json.dump(report, f)
+sys.exit(0 if report['status'] == 'sucesso' else 1)
+"""
+
+# 📌 1️⃣ "100k", "1M", "10M" -> quantidade de empresas
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+# 📌 2️⃣ Commit atual, para comparar resultados entre versões
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD", "--", "src"], cwd=ROOT).returncode != 0
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+# 📌 3️⃣ Gerar (ou reaproveitar) o conjunto sintético de um tamanho
+def ensure_dataset(rows, args):
+    out = os.path.join(args.data_dir, f"{rows}")
+    gen_args = generate_dataset.parse_args([
+        "--rows", str(rows), "--shards", str(args.shards), "--socios-dist", args.socios_dist,
+        "--socios-mean", str(args.socios_mean), "--foreign-share", str(args.foreign_share),
+        "--dirty-share", str(args.dirty_share), "--seed", str(args.seed), "--out", out,
+    ])
+
+    manifest_path = os.path.join(out, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if all(manifest.get(key) == value for key, value in vars(gen_args).items()):
+            print(f"📦 Reaproveitando {out} ({manifest['empresas']} empresas, {manifest['socios']} sócios)")
+            return manifest
+
+    print(f"📦 Gerando {rows} empresas em {out}...")
+    return generate_dataset.generate(gen_args)
+
+# 📌 4️⃣ Recriar os schemas a partir do db.sql (benchmark sempre parte do banco vazio)
+def reset_database():
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("".join(f"DROP SCHEMA IF EXISTS {schema} CASCADE;" for schema in SCHEMAS))
+        with open(os.path.join(ROOT, "db.sql")) as f:
+            cursor.execute(f.read())
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db(conn)
+
+# 📌 5️⃣ Registros na tabela de destino de uma etapa
+def count_rows(table):
+    if table is None:
+        return 0  # 🔹 Etapa sem tabela única de destino (ex.: dimensões)
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {table};")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.rollback()
+        release_db(conn)
+
+# 📌 6️⃣ Executar uma etapa num processo filho, medindo tempo e pico de memória
+def run_stage(name, options, env, log_path):
+    stage = STAGES[name]
+    kwargs = {key: options[key] for key in stage["options"]}
+    table = getattr(importlib.import_module(stage["module"]), "TABLE", None)
+    before = count_rows(table)
+
+    report_path = f"{log_path}.json"
+    if os.path.exists(report_path):
+        os.remove(report_path)
+
+    # 🔹 Saída da etapa vai para um log, para não misturar com a tabela de resultados
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        returncode = subprocess.call([sys.executable, "-c", STAGE_RUNNER, os.path.join(ROOT, "src"),
+                                      stage["module"], json.dumps(kwargs), report_path],
+                                     env=env, stdout=log, stderr=log)
+        elapsed = time.perf_counter() - start
+
+    report = {}
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+
+    rows = count_rows(table) - before
+    return {
+        "etapa": name,
+        "tabela": table,
+        "sucesso": returncode == 0,
+        "registros": rows,
+        "segundos": round(elapsed, 3),
+        "registros_por_segundo": round(rows / elapsed, 1) if elapsed > 0 else None,
+        "pico_rss_mb": report.get("pico_memoria_mb"),
+        "segundos_por_fase": report.get("segundos_por_fase"),
+    }
+
+# 📌 7️⃣ Rodar o pipeline inteiro para um tamanho e gravar uma linha por etapa
+def benchmark_size(rows, args, commit):
+    manifest = ensure_dataset(rows, args)
+    reset_database()
+
+    env = dict(os.environ,
+               EMPRESAS_ZIP_PATTERN=os.path.join(manifest["out"], "Empresas*.zip"),
+               SOCIOS_ZIP_PATTERN=os.path.join(manifest["out"], "Socios*.zip"),
+               REFERENCE_DIR=manifest["out"],
+               BRONZE_CACHE="1" if args.cache else "0")
+    options = {"full_refresh": False, "mode": args.silver_mode, "load_mode": args.load_mode, "cdc": args.cdc}
+
+    results = []
+    for name in STAGES:  # 🔹 Ordem do dicionário já respeita as dependências
+        log_path = os.path.join(manifest["out"], f"{name}.log")
+        result = run_stage(name, options, env, log_path)
+        result.update({
+            "commit": commit,
+            "executado_em": datetime.now().isoformat(timespec="seconds"),
+            "tamanho": rows,
+            "empresas": manifest["empresas"],
+            "socios": manifest["socios"],
+            "opcoes": options,
+        })
+        results.append(result)
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+        state = "✅" if result["sucesso"] else "❌"
+        print(f"{state} {rows:>10} | {name:<16} {result['segundos']:>8.1f}s "
+              f"{result['registros_por_segundo'] or 0:>12,.0f} reg/s {result['pico_rss_mb'] or 0:>8.1f} MB")
+        if not result["sucesso"]:
+            print(f"⏭️ Etapas seguintes de {rows} ignoradas. Detalhes em {log_path}")
+            break
+    return results
+
+# 📌 8️⃣ Comparar o último resultado de cada commit (tamanho x etapa)
+def compare(path, commits=2):
+    with open(path) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+
+    order = list(dict.fromkeys(result["commit"] for result in results))[-commits:]
+    latest = {(r["commit"], r["tamanho"], r["etapa"]): r for r in results if r["commit"] in order}
+    print(f"📊 Comparando commits: {' -> '.join(order)} (registros/s)")
+    for size in sorted({key[1] for key in latest}):
+        for name in STAGES:
+            values = [latest.get((commit, size, name), {}).get("registros_por_segundo") for commit in order]
+            if not any(values):
+                continue
+            change = ""
+            if len(values) > 1 and values[0] and values[-1]:
+                change = f"{(values[-1] / values[0] - 1) * 100:+.1f}%"
+            cells = " ".join(f"{value or 0:>12,.0f}" for value in values)
+            print(f"   {size:>10} {name:<16} {cells} {change}")
+
+# 📌 9️⃣ Executar o benchmark
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do pipeline com dados sintéticos.")
+    parser.add_argument("--sizes", default="100k,1M,10M", help="Tamanhos em empresas, separados por vírgula")
+    parser.add_argument("--data-dir", default="/tmp/stone-bench/data")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Arquivo JSON Lines com os resultados")
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--socios-dist", choices=["poisson", "geometric", "fixed"], default="poisson")
+    parser.add_argument("--socios-mean", type=float, default=1.5)
+    parser.add_argument("--foreign-share", type=float, default=0.05)
+    parser.add_argument("--dirty-share", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--silver-mode", choices=["python", "sql"], default=None)
+    parser.add_argument("--load-mode", choices=["insert", "staging"], default=None)
+    parser.add_argument("--cdc", action="store_true", default=None)
+    parser.add_argument("--cache", action="store_true", help="Mantém o cache Parquet da Bronze (desligado por padrão)")
+    parser.add_argument("--compare", action="store_true", help="Só compara os resultados já gravados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.output)
+        return
+
+    commit = git_commit()
+    print(f"🚀 Benchmark do commit {commit}: {args.sizes}")
+    for size in args.sizes.split(","):
+        benchmark_size(parse_size(size), args, commit)
+    print(f"✅ Resultados em {args.output}")
+
+if __name__ == "__main__":
+    main()
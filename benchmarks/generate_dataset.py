@@ -0,0 +1,148 @@
+import os
+import json
+import zipfile
+import argparse
+import numpy as np
+import pandas as pd
+
+# 🔹 Valores usados nos campos sintéticos (mesmos formatos dos arquivos da Receita)
+NATUREZAS = {"2062": "Sociedade Empresária Limitada", "2135": "Empresário (Individual)",
+             "2305": "Empresa Individual de Responsabilidade Limitada (de Natureza Empresária)",
+             "2240": "Sociedade Simples Limitada", "4014": "Empresa Individual Imobiliária",
+             "2046": "Sociedade Anônima Aberta"}
+QUALIFICACOES = {"00": "Não informada", "05": "Administrador", "10": "Diretor", "16": "Presidente",
+                 "22": "Sócio", "49": "Sócio-Administrador", "65": "Titular Pessoa Física Residente ou Domiciliado no Brasil"}
+PORTES = ["00", "01", "03", "05"]
+FAIXAS = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"]
+# 🔹 Código de país da Receita (105 = Brasil; vazio também é sócio brasileiro)
+PAISES = {"105": "BRASIL", "023": "ALEMANHA", "063": "ARGENTINA", "607": "PORTUGAL",
+          "249": "ESTADOS UNIDOS", "386": "ITALIA", "399": "JAPAO"}
+PAISES_BRASIL = ["", "105"]
+PAISES_EXTERIOR = [codigo for codigo in PAISES if codigo != "105"]
+# 🔹 Caracteres "sujos" que a limpeza da Bronze/Silver precisa tratar (todos existem em latin1)
+DIRTY_CHARS = ["\x01", "\x1f", "\x7f", "\x85", "\xa0", "Ç", "ã", "é", "*", "\t", "  "]
+
+BLOCK_ROWS = 250_000  # 🔹 Empresas geradas por vez, para não montar o arquivo inteiro em memória
+
+# 📌 1️⃣ Parâmetros do gerador
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gera ZIPs sintéticos no layout EMPRECSV/SOCIOCSV da Receita.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Quantidade de empresas (CNPJs básicos)")
+    parser.add_argument("--shards", type=int, default=3, help="Quantidade de ZIPs de cada tipo (Empresas0..N, Socios0..N)")
+    parser.add_argument("--socios-dist", choices=["poisson", "geometric", "fixed"], default="poisson",
+                        help="Distribuição da quantidade de sócios por empresa")
+    parser.add_argument("--socios-mean", type=float, default=1.5, help="Média de sócios por empresa")
+    parser.add_argument("--foreign-share", type=float, default=0.05, help="Fração de sócios estrangeiros")
+    parser.add_argument("--dirty-share", type=float, default=0.1, help="Fração de textos com caracteres sujos")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="/tmp/stone-bench/data", help="Diretório de saída")
+    return parser.parse_args(argv)
+
+# 📌 2️⃣ Sujar uma fração dos textos com caracteres fora do ASCII imprimível
+def dirty(text, rng, share):
+    mask = rng.random(len(text)) < share
+    if mask.any():
+        noise = pd.Series(rng.choice(DIRTY_CHARS, len(text)), index=text.index)
+        text = text.where(~mask, noise + text + noise)
+    return text
+
+# 📌 3️⃣ Quantidade de sócios de cada empresa
+def socios_per_company(rows, rng, dist, mean):
+    if dist == "fixed":
+        return np.full(rows, int(round(mean)))
+    if dist == "geometric":
+        # 🔹 Cauda longa: poucas empresas com muitos sócios (0 permitido)
+        return rng.geometric(1 / (mean + 1), rows) - 1
+    return rng.poisson(mean, rows)
+
+# 📌 4️⃣ Juntar colunas de texto numa linha CSV com aspas e ';'
+def csv_lines(columns):
+    lines = '"' + columns[0]
+    for col in columns[1:]:
+        lines = lines + '";"' + col
+    return '\n'.join(lines + '"') + '\n'
+
+# 📌 5️⃣ Um bloco de empresas e dos seus sócios
+def generate_block(first, rows, rng, args):
+    ids = np.arange(first, first + rows)
+    cnpj = pd.Series(ids).astype(str).str.zfill(8)
+
+    empresas = csv_lines([
+        cnpj,
+        dirty("EMPRESA " + cnpj + " LTDA", rng, args.dirty_share),
+        pd.Series(rng.choice(list(NATUREZAS), rows)),
+        pd.Series(rng.choice(list(QUALIFICACOES), rows)),
+        pd.Series(rng.integers(0, 10**7, rows)).astype(str) + "," + pd.Series(rng.integers(0, 100, rows)).astype(str).str.zfill(2),
+        pd.Series(rng.choice(PORTES, rows)),
+        pd.Series([""] * rows),
+    ])
+
+    counts = socios_per_company(rows, rng, args.socios_dist, args.socios_mean)
+    total = int(counts.sum())
+    socio_cnpj = pd.Series(np.repeat(cnpj.to_numpy(), counts))
+    # 🔹 Documento único dentro da empresa: a ordem do sócio vira parte do documento mascarado
+    ordem = pd.Series(np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts))
+    foreign = rng.random(total) < args.foreign_share
+    pais = np.where(foreign, rng.choice(PAISES_EXTERIOR, total), rng.choice(PAISES_BRASIL, total))
+    tipo = np.where(foreign, "3", rng.choice(["1", "2"], total, p=[0.1, 0.9]))
+    documento = "***" + (socio_cnpj.str[-3:] + ordem.astype(str).str.zfill(3)) + "**"
+    datas = pd.Series(pd.Timestamp("1990-01-01") + pd.to_timedelta(rng.integers(0, 12_000, total), unit="D"))
+
+    socios = csv_lines([
+        socio_cnpj,
+        pd.Series(tipo),
+        dirty("SOCIO " + socio_cnpj + " " + ordem.astype(str), rng, args.dirty_share),
+        documento,
+        pd.Series(rng.choice(list(QUALIFICACOES), total)),
+        datas.dt.strftime("%Y%m%d"),
+        pd.Series(rng.choice(FAIXAS, total)),
+        pd.Series(pais),
+        pd.Series(["***000000**"] * total),
+        pd.Series([""] * total),
+        pd.Series(["00"] * total),
+    ])
+    return empresas, socios, total
+
+# 📌 6️⃣ Tabelas de referência (código;descrição) no layout PAISCSV/NATJUCSV/QUALSCSV
+def write_references(out):
+    references = [("Paises.zip", "F.K03200$Z.D51011.PAISCSV", PAISES),
+                  ("Naturezas.zip", "F.K03200$Z.D51011.NATJUCSV", NATUREZAS),
+                  ("Qualificacoes.zip", "F.K03200$Z.D51011.QUALSCSV", QUALIFICACOES)]
+    for zip_name, member, values in references:
+        with zipfile.ZipFile(os.path.join(out, zip_name), "w", zipfile.ZIP_DEFLATED) as ref_zip:
+            ref_zip.writestr(member, csv_lines([pd.Series(list(values)), pd.Series(list(values.values()))]).encode("latin1"))
+    print("📦 Referências: Paises.zip / Naturezas.zip / Qualificacoes.zip")
+
+# 📌 7️⃣ Gerar os ZIPs de todos os shards
+def generate(args):
+    os.makedirs(args.out, exist_ok=True)
+    rng = np.random.default_rng(args.seed)
+    bounds = np.linspace(0, args.rows, args.shards + 1).astype(int)
+    totals = {"empresas": 0, "socios": 0}
+
+    for shard in range(args.shards):
+        member = f"K3241.K03200Y{shard}.D51011"
+        with zipfile.ZipFile(os.path.join(args.out, f"Empresas{shard}.zip"), "w", zipfile.ZIP_DEFLATED, compresslevel=1) as emp_zip, \
+             zipfile.ZipFile(os.path.join(args.out, f"Socios{shard}.zip"), "w", zipfile.ZIP_DEFLATED, compresslevel=1) as soc_zip, \
+             emp_zip.open(f"{member}.EMPRECSV", "w", force_zip64=True) as emp_file, \
+             soc_zip.open(f"{member}.SOCIOCSV", "w", force_zip64=True) as soc_file:
+            for first in range(bounds[shard], bounds[shard + 1], BLOCK_ROWS):
+                rows = int(min(BLOCK_ROWS, bounds[shard + 1] - first))
+                empresas, socios, socio_rows = generate_block(first, rows, rng, args)
+                emp_file.write(empresas.encode("latin1"))
+                soc_file.write(socios.encode("latin1"))
+                totals["empresas"] += rows
+                totals["socios"] += socio_rows
+        print(f"📦 Shard {shard}: Empresas{shard}.zip / Socios{shard}.zip")
+
+    write_references(args.out)
+
+    # 🔹 Parâmetros e contagens gravados junto, para o benchmark saber se pode reaproveitar
+    manifest = dict(vars(args), **totals)
+    with open(os.path.join(args.out, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ {totals['empresas']} empresas e {totals['socios']} sócios gerados em {args.out}")
+    return manifest
+
+if __name__ == "__main__":
+    generate(parse_args())
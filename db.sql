@@ -8,6 +8,8 @@ CREATE TABLE bronze.empresas (
     capital_social NUMERIC,                   -- Capital social da empresa
     cod_porte VARCHAR,                        -- Código do porte da empresa
     data_ingestao TIMESTAMP NOT NULL,         -- Data de ingestão
+    hash_linha BIGINT,                        -- Hash da linha (CDC)
+    operacao CHAR(1),                         -- Operação do CDC: I, U ou D
     PRIMARY KEY (cnpj, data_ingestao)         -- Incluindo coluna de particionamento
 ) PARTITION BY RANGE (data_ingestao);
 
@@ -20,6 +22,8 @@ COMMENT ON COLUMN bronze.empresas.qualificacao_responsavel IS 'Código que defin
 COMMENT ON COLUMN bronze.empresas.capital_social IS 'Capital social declarado pela empresa.';
 COMMENT ON COLUMN bronze.empresas.cod_porte IS 'Código que define o porte da empresa.';
 COMMENT ON COLUMN bronze.empresas.data_ingestao IS 'Data e hora em que os dados foram ingeridos na camada bronze.';
+COMMENT ON COLUMN bronze.empresas.hash_linha IS 'Hash das colunas da linha, comparado com o snapshot anterior no modo CDC.';
+COMMENT ON COLUMN bronze.empresas.operacao IS 'Operação do CDC: I (inserção), U (alteração) ou D (exclusão); nulo fora do CDC.';
 
 -- Partição para janeiro de 2025
 CREATE TABLE bronze.empresas_202501 PARTITION OF bronze.empresas
@@ -27,13 +31,38 @@ CREATE TABLE bronze.empresas_202501 PARTITION OF bronze.empresas
 
 CREATE SCHEMA IF NOT EXISTS silver;
 
+-- Dimensões de referência da Receita: a Silver guarda o id (smallint) no lugar do código
+CREATE TABLE silver.dim_paises (
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    codigo VARCHAR NOT NULL UNIQUE,           -- Código do país na Receita, sem zeros à esquerda
+    descricao VARCHAR                         -- Nome do país (nulo até a carga da referência)
+);
+CREATE TABLE silver.dim_naturezas (
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    codigo VARCHAR NOT NULL UNIQUE,           -- Código da natureza jurídica
+    descricao VARCHAR                         -- Descrição da natureza jurídica
+);
+CREATE TABLE silver.dim_qualificacoes (
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    codigo VARCHAR NOT NULL UNIQUE,           -- Código da qualificação de sócio/representante
+    descricao VARCHAR                         -- Descrição da qualificação
+);
+COMMENT ON TABLE silver.dim_paises IS 'Dimensão de países (Paises.zip da Receita).';
+COMMENT ON TABLE silver.dim_naturezas IS 'Dimensão de naturezas jurídicas (Naturezas.zip da Receita).';
+COMMENT ON TABLE silver.dim_qualificacoes IS 'Dimensão de qualificações de sócios (Qualificacoes.zip da Receita).';
+
+-- Brasil sempre presente: a flag de sócio estrangeiro da Gold depende dele
+INSERT INTO silver.dim_paises (codigo, descricao) VALUES ('105', 'BRASIL');
+
 CREATE TABLE silver.empresas (
     cnpj VARCHAR NOT NULL,                    -- Cadastro Nacional da Pessoa Jurídica
     razao_social VARCHAR,                     -- Nome empresarial
-    natureza_juridica INT,                    -- Código da natureza jurídica
+    natureza_juridica_id SMALLINT,            -- Id da natureza jurídica (silver.dim_naturezas)
     capital_social NUMERIC,                   -- Capital social da empresa
     porte_descricao VARCHAR,                  -- Descrição do porte
     data_processamento TIMESTAMP NOT NULL,    -- Data de processamento
+    hash_linha BIGINT,                        -- Hash da linha (CDC)
+    operacao CHAR(1),                         -- Operação do CDC: I, U ou D
     PRIMARY KEY (cnpj, data_processamento)    -- Incluindo coluna de particionamento
 ) PARTITION BY RANGE (data_processamento);
 
@@ -41,10 +70,12 @@ CREATE TABLE silver.empresas (
 COMMENT ON TABLE silver.empresas IS 'Tabela silver com dados de empresas tratados e normalizados.';
 COMMENT ON COLUMN silver.empresas.cnpj IS 'Número único de registro da empresa (CNPJ).';
 COMMENT ON COLUMN silver.empresas.razao_social IS 'Razão social ou nome empresarial da empresa.';
-COMMENT ON COLUMN silver.empresas.natureza_juridica IS 'Código que define a natureza jurídica da empresa.';
+COMMENT ON COLUMN silver.empresas.natureza_juridica_id IS 'Id da natureza jurídica da empresa na dimensão silver.dim_naturezas.';
 COMMENT ON COLUMN silver.empresas.capital_social IS 'Capital social declarado pela empresa.';
 COMMENT ON COLUMN silver.empresas.porte_descricao IS 'Descrição textual do porte da empresa.';
 COMMENT ON COLUMN silver.empresas.data_processamento IS 'Data e hora em que os dados foram processados na camada silver.';
+COMMENT ON COLUMN silver.empresas.hash_linha IS 'Hash das colunas da linha, comparado com a versão anterior no modo CDC.';
+COMMENT ON COLUMN silver.empresas.operacao IS 'Operação do CDC: I (inserção), U (alteração) ou D (exclusão); nulo fora do CDC.';
 
 
 CREATE TABLE bronze.socios (
@@ -60,6 +91,8 @@ CREATE TABLE bronze.socios (
     nome_representante VARCHAR,                    -- Nome do representante legal do sócio (se houver)
     qualificacao_representante VARCHAR,                -- Código da qualificação do representante
     data_ingestao TIMESTAMP NOT NULL DEFAULT NOW(),-- Data da ingestão dos dados
+    hash_linha BIGINT,                             -- Hash da linha (CDC)
+    operacao CHAR(1),                              -- Operação do CDC: I, U ou D
     PRIMARY KEY (cnpj, documento_socio, data_ingestao) -- Chave primária incluindo a partição
 ) PARTITION BY RANGE (data_ingestao);
 
@@ -77,6 +110,8 @@ COMMENT ON COLUMN bronze.socios.representante_legal IS 'Nome do representante le
 COMMENT ON COLUMN bronze.socios.nome_representante IS 'Nome do representante legal do sócio (se houver).';
 COMMENT ON COLUMN bronze.socios.qualificacao_representante IS 'Código da qualificação do representante do sócio.';
 COMMENT ON COLUMN bronze.socios.data_ingestao IS 'Data e hora em que os dados foram ingeridos na camada bronze.';
+COMMENT ON COLUMN bronze.socios.hash_linha IS 'Hash das colunas da linha, comparado com o snapshot anterior no modo CDC.';
+COMMENT ON COLUMN bronze.socios.operacao IS 'Operação do CDC: I (inserção), U (alteração) ou D (exclusão); nulo fora do CDC.';
 
 -- Criando a partição de janeiro de 2025
 CREATE TABLE bronze.socios_202501 PARTITION OF bronze.socios
@@ -88,14 +123,16 @@ CREATE TABLE silver.socios (
     tipo_socio VARCHAR,                         -- Tipo de sócio
     nome_socio VARCHAR,                         -- Nome do sócio
     documento_socio VARCHAR,                    -- CPF ou CNPJ do sócio
-    codigo_qualificacao_socio VARCHAR,          -- Código da qualificação do sócio
+    qualificacao_socio_id SMALLINT,             -- Id da qualificação do sócio (silver.dim_qualificacoes)
     data_entrada_sociedade DATE,                -- Data de entrada do sócio na empresa
     faixa_etaria VARCHAR,                       -- Código da faixa etária do sócio
-    pais VARCHAR,                               -- País do sócio
+    pais_id SMALLINT,                           -- Id do país do sócio (silver.dim_paises)
     representante_legal VARCHAR,                -- Nome do representante legal do sócio
     nome_representante VARCHAR,                 -- Nome do representante legal do sócio
-    qualificacao_representante VARCHAR,         -- Código da qualificação do representante
+    qualificacao_representante_id SMALLINT,     -- Id da qualificação do representante (silver.dim_qualificacoes)
     data_processamento TIMESTAMP NOT NULL,      -- Data de processamento na camada Silver
+    hash_linha BIGINT,                          -- Hash da linha (CDC)
+    operacao CHAR(1),                           -- Operação do CDC: I, U ou D
     PRIMARY KEY (cnpj, documento_socio, data_processamento)
 ) PARTITION BY RANGE (data_processamento);
 
@@ -105,14 +142,16 @@ COMMENT ON COLUMN silver.socios.cnpj IS 'CNPJ da empresa à qual o sócio está
 COMMENT ON COLUMN silver.socios.tipo_socio IS 'Tipo do sócio, indicando seu papel na empresa.';
 COMMENT ON COLUMN silver.socios.nome_socio IS 'Nome ou razão social do sócio.';
 COMMENT ON COLUMN silver.socios.documento_socio IS 'CPF ou CNPJ do sócio (normalizado e tratado).';
-COMMENT ON COLUMN silver.socios.codigo_qualificacao_socio IS 'Código de qualificação do sócio.';
+COMMENT ON COLUMN silver.socios.qualificacao_socio_id IS 'Id da qualificação do sócio na dimensão silver.dim_qualificacoes.';
 COMMENT ON COLUMN silver.socios.data_entrada_sociedade IS 'Data em que o sócio entrou na empresa.';
 COMMENT ON COLUMN silver.socios.faixa_etaria IS 'Código da faixa etária do sócio.';
-COMMENT ON COLUMN silver.socios.pais IS 'País de origem do sócio.';
+COMMENT ON COLUMN silver.socios.pais_id IS 'Id do país de origem do sócio na dimensão silver.dim_paises.';
 COMMENT ON COLUMN silver.socios.representante_legal IS 'Nome do representante legal do sócio.';
 COMMENT ON COLUMN silver.socios.nome_representante IS 'Nome do representante legal do sócio (se houver).';
-COMMENT ON COLUMN silver.socios.qualificacao_representante IS 'Código da qualificação do representante do sócio.';
+COMMENT ON COLUMN silver.socios.qualificacao_representante_id IS 'Id da qualificação do representante na dimensão silver.dim_qualificacoes.';
 COMMENT ON COLUMN silver.socios.data_processamento IS 'Data e hora em que os dados foram processados na camada Silver.';
+COMMENT ON COLUMN silver.socios.hash_linha IS 'Hash das colunas da linha, comparado com a versão anterior no modo CDC.';
+COMMENT ON COLUMN silver.socios.operacao IS 'Operação do CDC: I (inserção), U (alteração) ou D (exclusão); nulo fora do CDC.';
 
 -- Criando uma partição para Janeiro de 2025
 CREATE TABLE silver.socios_202501 PARTITION OF silver.socios
@@ -126,6 +165,7 @@ CREATE TABLE gold.empresas (
     capital_social NUMERIC,                   -- Capital social da empresa
     total_socios INT,                         -- Número total de sócios
     flag_socio_estrangeiro BOOLEAN,           -- Indica se há sócio estrangeiro
+    doc_alvo BOOLEAN,                         -- Porte 03 com mais de um sócio
     data_analise TIMESTAMP NOT NULL,          -- Data de análise
     PRIMARY KEY (cnpj, data_analise)          -- Incluindo coluna de particionamento
 ) PARTITION BY RANGE (data_analise);
@@ -137,8 +177,13 @@ COMMENT ON COLUMN gold.empresas.razao_social IS 'Razão social ou nome empresari
 COMMENT ON COLUMN gold.empresas.capital_social IS 'Capital social declarado pela empresa.';
 COMMENT ON COLUMN gold.empresas.total_socios IS 'Número total de sócios associados à empresa.';
 COMMENT ON COLUMN gold.empresas.flag_socio_estrangeiro IS 'True se houver sócio estrangeiro, False caso contrário.';
+COMMENT ON COLUMN gold.empresas.doc_alvo IS 'True se o porte da empresa for 03 e houver mais de um sócio.';
 COMMENT ON COLUMN gold.empresas.data_analise IS 'Data e hora em que os dados foram consolidados para análise.';
 
+-- Índice de consulta do registro mais recente de cada CNPJ (API de consulta)
+CREATE INDEX empresas_cnpj_recente ON gold.empresas (cnpj, data_analise DESC)
+    INCLUDE (razao_social, capital_social, total_socios, flag_socio_estrangeiro, doc_alvo);
+
 -- Criando a partição para Janeiro de 2025
 CREATE TABLE gold.empresas_202501 PARTITION OF gold.empresas
     FOR VALUES FROM ('2025-01-01') TO ('2025-02-01');
@@ -146,3 +191,46 @@ CREATE TABLE gold.empresas_202501 PARTITION OF gold.empresas
 
 
 
+CREATE SCHEMA IF NOT EXISTS controle;
+
+CREATE TABLE controle.watermarks (
+    tabela VARCHAR PRIMARY KEY,                   -- Tabela de destino que consome a Bronze
+    ultima_data_ingestao TIMESTAMP NOT NULL,      -- Último data_ingestao já processado
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()-- Momento da última atualização
+);
+
+COMMENT ON TABLE controle.watermarks IS 'Watermarks da carga incremental da Silver a partir da Bronze.';
+COMMENT ON COLUMN controle.watermarks.tabela IS 'Tabela Silver cujo watermark está registrado.';
+COMMENT ON COLUMN controle.watermarks.ultima_data_ingestao IS 'Maior data_ingestao da Bronze já carregada na Silver.';
+COMMENT ON COLUMN controle.watermarks.atualizado_em IS 'Data e hora da última atualização do watermark.';
+
+CREATE TABLE controle.checkpoints (
+    tabela VARCHAR NOT NULL,                      -- Tabela da Bronze em carga
+    data_ingestao TIMESTAMP NOT NULL,             -- Snapshot em carga
+    arquivo VARCHAR NOT NULL,                     -- ZIP de origem
+    membro VARCHAR NOT NULL,                      -- CSV dentro do ZIP
+    assinatura VARCHAR NOT NULL,                  -- Tamanho e mtime do ZIP
+    modo VARCHAR NOT NULL,                        -- insert, staging, com ou sem CDC
+    blocos INT NOT NULL DEFAULT 0,                -- Blocos já gravados
+    linhas BIGINT NOT NULL DEFAULT 0,             -- Linhas do CSV já gravadas
+    gravados BIGINT NOT NULL DEFAULT 0,           -- Registros gravados na tabela
+    concluido BOOLEAN NOT NULL DEFAULT FALSE,     -- Shard inteiro gravado
+    finalizada BOOLEAN NOT NULL DEFAULT FALSE,    -- Snapshot inteiro finalizado
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (tabela, data_ingestao, arquivo, membro)
+);
+
+COMMENT ON TABLE controle.checkpoints IS 'Progresso de cada shard da Bronze, para retomar uma carga interrompida sem duplicar registros.';
+COMMENT ON COLUMN controle.checkpoints.linhas IS 'Linhas do CSV já gravadas: na retomada, a leitura começa depois delas.';
+COMMENT ON COLUMN controle.checkpoints.finalizada IS 'Snapshot concluído (todos os shards, CDC e ATTACH) no mesmo commit.';
+
+CREATE TABLE controle.etapas (
+    etapa VARCHAR PRIMARY KEY,                    -- Etapa do pipeline (main.py)
+    fingerprint VARCHAR NOT NULL,                 -- sha256 das entradas e opções
+    entradas JSONB NOT NULL,                      -- Entradas que geraram o fingerprint
+    segundos DOUBLE PRECISION NOT NULL,           -- Duração da execução
+    concluida_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON TABLE controle.etapas IS 'Fingerprint da última execução bem-sucedida de cada etapa: entradas iguais, etapa reaproveitada.';
+COMMENT ON COLUMN controle.etapas.entradas IS 'Hash dos ZIPs (Bronze, dimensões) ou linhas e maior data por partição (Silver, Gold).';
@@ -0,0 +1,340 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import psycopg2
+import psycopg2.extensions
+
+from database import DATABASE_URL, DB_POOL_SIZE, connect_db, get_pool, execute_prepared
+from ingestion_gold import NOTIFY_CHANNEL
+
+# 🔹 Mesma porta publicada pelo docker-compose
+API_HOST = os.getenv('API_HOST', '0.0.0.0')
+API_PORT = int(os.getenv('API_PORT', '5000'))
+API_CACHE_SIZE = int(os.getenv('API_CACHE_SIZE', '100000'))  # CNPJs guardados no cache
+API_CACHE_TTL = float(os.getenv('API_CACHE_TTL', '300'))  # 🔹 Segundos; limite de atraso se um NOTIFY se perder
+API_BATCH_LIMIT = int(os.getenv('API_BATCH_LIMIT', '1000'))  # CNPJs por consulta em lote
+API_DB_THREADS = int(os.getenv('API_DB_THREADS', str(DB_POOL_SIZE)))  # 🔹 Uma conexão do pool por thread
+
+COLUMNS = ["cnpj", "razao_social", "capital_social", "total_socios",
+           "flag_socio_estrangeiro", "doc_alvo", "data_analise"]
+
+# 🔹 Registro mais recente de um CNPJ: varre só o início do índice empresas_cnpj_recente
+LOOKUP_QUERY = f"""
+    SELECT {", ".join(COLUMNS)} FROM gold.empresas
+    WHERE cnpj = $1 ORDER BY data_analise DESC LIMIT 1
+"""
+
+# 🔹 Em lote: o mesmo LIMIT 1 por CNPJ (LATERAL), em vez de ordenar todas as versões
+BATCH_QUERY = f"""
+    SELECT g.* FROM unnest($1::varchar[]) AS c(cnpj)
+    CROSS JOIN LATERAL (
+        SELECT {", ".join(COLUMNS)} FROM gold.empresas e
+        WHERE e.cnpj = c.cnpj ORDER BY e.data_analise DESC LIMIT 1
+    ) g
+"""
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+# 📌 1️⃣ Cache LRU com TTL, acessado só pelo event loop (sem locks)
+class LookupCache:
+    def __init__(self, maxsize=API_CACHE_SIZE, ttl=API_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # 🔹 Muda a cada invalidação: resultados de consultas iniciadas antes não entram no cache
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, key, value, generation):
+        if generation != self.generation or self.maxsize <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"tamanho": len(self.entries), "acertos": self.hits, "falhas": self.misses,
+                "taxa_acerto": round(self.hits / total, 4) if total else None,
+                "invalidacoes": self.generation}
+
+# 📌 2️⃣ Normalizar o CNPJ: a Gold guarda o CNPJ básico (8 dígitos)
+def normalize_cnpj(value):
+    digits = re.sub(r"\D", "", str(value))
+    if len(digits) == 14:
+        digits = digits[:8]  # 🔹 CNPJ completo: filial e dígitos verificadores não entram na Gold
+    return digits if len(digits) == 8 else None
+
+def to_record(row):
+    record = dict(zip(COLUMNS, row))
+    if record["capital_social"] is not None:
+        record["capital_social"] = float(record["capital_social"])
+    record["data_analise"] = record["data_analise"].isoformat()
+    return record
+
+# 📌 3️⃣ Acesso ao banco nas threads do executor: cada thread mantém uma conexão do pool
+_local = threading.local()
+
+def thread_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None or conn.closed:
+        conn = connect_db()
+        conn.autocommit = True  # 🔹 Só leituras: sem BEGIN/COMMIT a cada consulta
+        _local.conn = conn
+    return conn
+
+def run_query(name, query, params):
+    for attempt in range(2):
+        conn = thread_connection()
+        cursor = conn.cursor()
+        try:
+            execute_prepared(cursor, name, query, params)
+            return cursor.fetchall()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # 🔹 Conexão caiu (ex.: restart do Postgres): descarta e tenta uma vez com outra
+            get_pool().putconn(conn, close=True)
+            _local.conn = None
+            if attempt:
+                raise
+        finally:
+            cursor.close()
+
+def fetch_one(cnpj):
+    rows = run_query("api_cnpj", LOOKUP_QUERY, (cnpj,))
+    return to_record(rows[0]) if rows else None
+
+def fetch_many(cnpjs):
+    rows = run_query("api_cnpj_lote", BATCH_QUERY, (cnpjs,))
+    return {row[0]: to_record(row) for row in rows}
+
+# 📌 4️⃣ Consultas com cache; consultas simultâneas ao mesmo CNPJ viram uma só
+class LookupService:
+    def __init__(self, cache=None, threads=API_DB_THREADS):
+        self.cache = cache or LookupCache()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api-db")
+        self.pending = {}
+
+    async def query(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def lookup(self, cnpj):
+        hit, record = self.cache.get(cnpj)
+        if hit:
+            return record
+        if cnpj in self.pending:
+            return await asyncio.shield(self.pending[cnpj])
+
+        generation = self.cache.generation
+        future = asyncio.ensure_future(self.query(fetch_one, cnpj))
+        self.pending[cnpj] = future
+        try:
+            record = await asyncio.shield(future)
+        finally:
+            self.pending.pop(cnpj, None)
+        self.cache.put(cnpj, record, generation)  # 🔹 CNPJ inexistente também fica no cache
+        return record
+
+    async def lookup_many(self, cnpjs):
+        results = {}
+        missing = []
+        for cnpj in dict.fromkeys(cnpjs):
+            hit, record = self.cache.get(cnpj)
+            if hit:
+                results[cnpj] = record
+            else:
+                missing.append(cnpj)
+
+        if missing:
+            generation = self.cache.generation
+            found = await self.query(fetch_many, missing)
+            for cnpj in missing:
+                results[cnpj] = found.get(cnpj)
+                self.cache.put(cnpj, results[cnpj], generation)
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+# 📌 5️⃣ LISTEN no canal da Gold: cada carga nova limpa o cache
+class SnapshotListener:
+    def __init__(self, cache, retry_seconds=5):
+        self.cache = cache
+        self.retry_seconds = retry_seconds
+        self.conn = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            # 🔹 Conexão própria, fora do pool: fica parada esperando notificações
+            self.conn = psycopg2.connect(DATABASE_URL)
+            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = self.conn.cursor()
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL};")
+            cursor.close()
+            loop.add_reader(self.conn.fileno(), self.on_notify)
+            print(f"👂 Escutando novos snapshots da Gold no canal {NOTIFY_CHANNEL}")
+        except psycopg2.Error as e:
+            print(f"⚠️ LISTEN indisponível ({e}); cache expira só pelo TTL. Nova tentativa em {self.retry_seconds}s")
+            loop.call_later(self.retry_seconds, self.start)
+
+    def on_notify(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            self.stop()
+            self.cache.clear()  # 🔹 Notificações podem ter se perdido enquanto a conexão caía
+            print(f"⚠️ Conexão do LISTEN caiu ({e}); reconectando em {self.retry_seconds}s")
+            asyncio.get_running_loop().call_later(self.retry_seconds, self.start)
+            return
+
+        if self.conn.notifies:
+            snapshot = self.conn.notifies[-1].payload
+            self.conn.notifies.clear()
+            self.cache.clear()
+            print(f"♻️ Novo snapshot da Gold ({snapshot}): cache invalidado")
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            except (ValueError, psycopg2.Error):
+                pass  # 🔹 Conexão já fechada: o descritor não existe mais
+            self.conn.close()
+            self.conn = None
+
+# 📌 6️⃣ HTTP/1.1 mínimo sobre asyncio (keep-alive, GET e POST com JSON)
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, version = request_line.decode("latin1").split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > 1024 * 1024:
+        raise ValueError("corpo da requisição muito grande")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, version, headers, body
+
+def build_response(status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin1") + body
+
+# 📌 7️⃣ Rotas: /cnpj/{cnpj}, /cnpj?cnpjs=a,b (GET) ou {"cnpjs": [...]} (POST) e /health
+async def route(service, method, target, body):
+    url = urlsplit(target)
+    path = url.path.rstrip("/")
+
+    if path == "/health":
+        return 200, {"status": "ok", "cache": service.cache.stats()}
+
+    if path.startswith("/cnpj/") and method == "GET":
+        cnpj = normalize_cnpj(path[len("/cnpj/"):])
+        if cnpj is None:
+            return 400, {"erro": "CNPJ inválido: informe 8 ou 14 dígitos"}
+        record = await service.lookup(cnpj)
+        return (200, record) if record is not None else (404, {"erro": f"CNPJ {cnpj} não encontrado na Gold"})
+
+    if path == "/cnpj":
+        if method == "GET":
+            values = [value for item in parse_qs(url.query).get("cnpjs", []) for value in item.split(",") if value]
+        elif method == "POST":
+            values = json.loads(body or b"{}").get("cnpjs", [])
+        else:
+            return 405, {"erro": f"Método {method} não suportado"}
+        if not values or len(values) > API_BATCH_LIMIT:
+            return 400, {"erro": f"Informe de 1 a {API_BATCH_LIMIT} CNPJs"}
+        normalized = [(value, normalize_cnpj(value)) for value in values]
+        invalid = [value for value, cnpj in normalized if cnpj is None]
+        if invalid:
+            return 400, {"erro": "CNPJs inválidos", "cnpjs": invalid}
+        results = await service.lookup_many([cnpj for _, cnpj in normalized])
+        return 200, {"resultados": [results[cnpj] for cnpj in results if results[cnpj] is not None],
+                     "nao_encontrados": [cnpj for cnpj in results if results[cnpj] is None]}
+
+    return 404, {"erro": f"Rota {path} não existe"}
+
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(build_response(400, {"erro": "Requisição HTTP inválida"}, False))
+                break
+            if request is None:
+                break
+
+            method, target, version, headers, body = request
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+            try:
+                status, payload = await route(service, method, target, body)
+            except (ValueError, AttributeError):
+                status, payload = 400, {"erro": "JSON inválido"}
+            except Exception as e:
+                print(f"❌ Erro ao consultar {target}: {e}")
+                status, payload = 500, {"erro": "Erro interno ao consultar a Gold"}
+
+            writer.write(build_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass  # 🔹 Cliente desconectou no meio da resposta
+    finally:
+        writer.close()
+
+# 📌 8️⃣ Subir a API
+async def serve(host=API_HOST, port=API_PORT):
+    service = LookupService()
+    listener = SnapshotListener(service.cache)
+    listener.start()
+
+    server = await asyncio.start_server(lambda r, w: handle_connection(service, r, w), host, port)
+    print(f"🚀 API de consulta de CNPJ em http://{host}:{port} "
+          f"(cache {API_CACHE_SIZE} CNPJs, TTL {API_CACHE_TTL:.0f}s, {API_DB_THREADS} conexões)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        listener.stop()
+        service.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("👋 API encerrada.")
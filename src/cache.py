@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import os
+import re
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+import metrics
+from transform import STRING_DTYPE
+
+# 🔹 Cache local dos blocos já lidos e tratados, em Parquet, por ZIP + membro
+CACHE_ENABLED = os.getenv('BRONZE_CACHE', '1') == '1'
+CACHE_DIR = os.getenv('BRONZE_CACHE_DIR', '/app/stone/data/cache')
+CACHE_MAX_BYTES = int(os.getenv('BRONZE_CACHE_MAX_MB', '4096')) * 1024 * 1024
+
+# 🔹 Incrementar quando o tratamento dos blocos mudar: invalida todas as entradas antigas
+CACHE_VERSION = 2
+
+_hashes = {}
+
+# 📌 1️⃣ Hash do conteúdo do ZIP (memorizado por caminho, tamanho e mtime no processo)
+def file_hash(path):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        _hashes[memo_key] = digest.hexdigest()
+    return _hashes[memo_key]
+
+# 📌 2️⃣ Arquivo do cache para um membro de um ZIP
+def entry_path(zip_path, member):
+    member_name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(member))
+    return os.path.join(CACHE_DIR, f"v{CACHE_VERSION}_{file_hash(zip_path)[:32]}_{member_name}.parquet")
+
+# 📌 3️⃣ Converter um bloco para Arrow com o mesmo schema em todos os blocos
+def to_table(df, schema=None):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if schema is None:
+        # 🔹 Coluna toda nula no primeiro bloco vira texto, como as demais do CSV, e as
+        #    categorias usam sempre índices int32 (o pandas escolhe int8/int16 por bloco)
+        fields = []
+        for field in table.schema:
+            if pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            elif pa.types.is_dictionary(field.type):
+                field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+            fields.append(field)
+        schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table.cast(schema)
+
+# 📌 4️⃣ Ler os blocos de uma entrada com memory map, sem descompactar nem parsear o CSV
+def read_entry(path, chunk_size, skip_rows=0):
+    parquet = pq.ParquetFile(path, memory_map=True)
+    for batch in parquet.iter_batches(batch_size=chunk_size):
+        # 🔹 Retomada de uma carga interrompida: linhas já gravadas ficam de fora
+        if skip_rows >= batch.num_rows:
+            skip_rows -= batch.num_rows
+            continue
+        if skip_rows:
+            batch, skip_rows = batch.slice(skip_rows), 0
+        # 🔹 Texto volta direto como coluna Arrow, sem criar um str por célula
+        yield batch.to_pandas(types_mapper={pa.string(): STRING_DTYPE}.get)
+
+# 📌 5️⃣ Blocos tratados do cache; na falta, produz, grava e repassa cada bloco
+def cached_chunks(zip_path, member, chunk_size, produce, skip_rows=0):
+    if not CACHE_ENABLED:
+        yield from produce(skip_rows)
+        return
+
+    path = entry_path(zip_path, member)
+    if os.path.exists(path):
+        os.utime(path)  # 🔹 mtime marca o último uso para o LRU
+        print(f"💾 Cache encontrado para {os.path.basename(zip_path)}/{member}: {os.path.basename(path)}")
+        yield from metrics.timed_iter(read_entry(path, chunk_size, skip_rows), "leitura", rows="lidos")
+        return
+
+    if skip_rows:
+        # 🔹 Membro lido pela metade não vira entrada do cache
+        yield from produce(skip_rows)
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    writer = None
+    try:
+        for df in produce(0):
+            table = to_table(df, writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+            yield df
+
+        # 🔹 A entrada só passa a valer depois do membro inteiro lido
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(tmp_path, path)
+            print(f"💾 Cache gravado: {os.path.basename(path)} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+            evict(keep=path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# 📌 6️⃣ Entradas do cache, da usada há mais tempo para a mais recente
+def list_entries():
+    if not os.path.isdir(CACHE_DIR):
+        return []
+
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".parquet"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # 🔹 Removida por outro processo no meio da listagem
+        entries.append({"path": path, "bytes": stat.st_size, "usado_em": stat.st_mtime})
+    return sorted(entries, key=lambda entry: entry["usado_em"])
+
+# 📌 7️⃣ Remover as entradas menos usadas até caber no limite (LRU)
+def evict(max_bytes=CACHE_MAX_BYTES, keep=None):
+    entries = list_entries()
+    total = sum(entry["bytes"] for entry in entries)
+    removed = 0
+
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        if entry["path"] == keep:
+            continue
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
+            pass
+        total -= entry["bytes"]
+        removed += 1
+        print(f"🧹 Cache removido (LRU): {os.path.basename(entry['path'])}")
+    return removed
+
+# 📌 8️⃣ Apagar todo o cache
+def clear():
+    entries = list_entries()
+    for entry in entries:
+        os.remove(entry["path"])
+    print(f"🧹 {len(entries)} entrada(s) removida(s) de {CACHE_DIR}")
+
+# 📌 9️⃣ Listar as entradas com tamanho, linhas e último uso
+def print_entries():
+    entries = list_entries()
+    total = sum(entry["bytes"] for entry in entries)
+    print(f"💾 Cache em {CACHE_DIR}: {len(entries)} entrada(s), "
+          f"{total / 1024 / 1024:.1f} MB de {CACHE_MAX_BYTES / 1024 / 1024:.0f} MB")
+    for entry in reversed(entries):
+        rows = pq.ParquetFile(entry["path"]).metadata.num_rows
+        used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry["usado_em"]))
+        print(f"   {os.path.basename(entry['path'])}: {entry['bytes'] / 1024 / 1024:.1f} MB, "
+              f"{rows} registros, usado em {used}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache Parquet dos arquivos da Receita já tratados")
+    parser.add_argument("command", choices=["list", "clear", "prune"],
+                        help="list: mostra as entradas; clear: apaga tudo; prune: aplica o limite de tamanho")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        print_entries()
+    elif args.command == "clear":
+        clear()
+    else:
+        print(f"✅ {evict()} entrada(s) removida(s).")
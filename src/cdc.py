@@ -0,0 +1,232 @@
+import os
+from database import copy_dataframe
+
+# 🔹 '1': grava só inserções, alterações e exclusões em relação ao snapshot anterior
+CDC_ENABLED = os.getenv('CDC_ENABLED', '0') == '1'
+
+# 📌 1️⃣ Tabelas de controle do CDC: índice de hashes atual e snapshot em construção
+def index_table(table):
+    return f"controle.cdc_{table.replace('.', '_')}"
+
+def snapshot_table(table):
+    return f"{index_table(table)}_novo"
+
+def join_keys(key_columns, left, right):
+    return " AND ".join(f"{left}.{col} = {right}.{col}" for col in key_columns)
+
+# 📌 2️⃣ Garantir as colunas do CDC e o índice de hashes da tabela (com commit)
+def ensure_cdc(conn, table, key_columns):
+    index = index_table(table)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS hash_linha BIGINT,
+                ADD COLUMN IF NOT EXISTS operacao CHAR(1);
+            CREATE SCHEMA IF NOT EXISTS controle;
+        """)
+        cursor.execute("SELECT to_regclass(%s);", (index,))
+        if cursor.fetchone()[0] is None:
+            # 🔹 Mesmos tipos das chaves da tabela, sem precisar repeti-los aqui
+            cursor.execute(f"""
+                CREATE TABLE {index} AS SELECT {", ".join(key_columns)}, hash_linha FROM {table} WITH NO DATA;
+                ALTER TABLE {index} ADD PRIMARY KEY ({", ".join(key_columns)});
+            """)
+            print(f"🧱 Índice de hashes {index} criado.")
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 3️⃣ Começar um snapshot completo (Bronze): chaves e hashes vistos nesta carga
+def begin_snapshot(conn, table):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            DROP TABLE IF EXISTS {snapshot_table(table)};
+            CREATE TABLE {snapshot_table(table)} (LIKE {index_table(table)} INCLUDING ALL);
+        """)
+    finally:
+        cursor.close()
+
+# 📌 4️⃣ Enviar um bloco para uma tabela temporária, de onde sai só o que mudou
+def stage_dataframe(conn, table, columns, df, desc="📥 Enviando bloco para o CDC"):
+    source = f"tmp_cdc_{table.replace('.', '_')}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {source} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;
+            TRUNCATE {source};
+        """)
+    finally:
+        cursor.close()
+
+    if df is not None:
+        copy_dataframe(conn, source, columns, df, desc=desc)
+    return source
+
+# 📌 5️⃣ Gravar em `target` apenas as linhas novas ou alteradas de `source`
+def apply_changes(conn, source, table, target, key_columns, columns, ts_column, snapshot=False):
+    """
+    Calcula o hash de cada linha de `source` (todas as colunas menos `ts_column`)
+    e compara com o índice de hashes de `table`. Chaves sem hash anterior viram
+    'I', hashes diferentes viram 'U' e linhas idênticas não são gravadas.
+
+    Com `snapshot=True` (carga completa da Bronze) as chaves são registradas no
+    snapshot em construção e o índice só é trocado em finish_snapshot; sem ele
+    (Silver, que recebe só mudanças) o índice é atualizado no mesmo comando.
+    Vale sempre a primeira ocorrência de cada chave. Retorna as contagens por operação.
+    """
+    index = index_table(table)
+    keys = ", ".join(key_columns)
+    column_list = ", ".join(columns)
+    hash_columns = ", ".join(col for col in columns if col != ts_column)
+
+    if snapshot:
+        candidates = f"""
+            vistas AS (
+                INSERT INTO {snapshot_table(table)} ({keys}, hash_linha)
+                SELECT {keys}, hash_linha FROM linhas
+                ON CONFLICT DO NOTHING
+                RETURNING {keys}
+            ),
+            candidatas AS (
+                SELECT l.* FROM linhas l JOIN vistas v ON {join_keys(key_columns, 'v', 'l')}
+            ),"""
+    else:
+        candidates = f"""
+            indexadas AS (
+                INSERT INTO {index} AS atual ({keys}, hash_linha)
+                SELECT {keys}, hash_linha FROM linhas
+                ON CONFLICT ({keys}) DO UPDATE SET hash_linha = EXCLUDED.hash_linha
+                WHERE atual.hash_linha IS DISTINCT FROM EXCLUDED.hash_linha
+            ),
+            candidatas AS (
+                SELECT * FROM linhas
+            ),"""
+
+    cursor = conn.cursor()
+    try:
+        # 🔹 Todos os CTEs enxergam o índice de antes do comando: a comparação
+        #    usa sempre o hash anterior, mesmo quando o índice é atualizado junto
+        cursor.execute(f"""
+            WITH linhas AS (
+                SELECT DISTINCT ON ({keys}) {column_list},
+                       hashtextextended(ROW({hash_columns})::text, 0) AS hash_linha
+                FROM {source}
+                ORDER BY {keys}, ctid
+            ),{candidates}
+            gravadas AS (
+                INSERT INTO {target} ({column_list}, hash_linha, operacao)
+                SELECT {", ".join(f"c.{col}" for col in columns)}, c.hash_linha,
+                       CASE WHEN i.hash_linha IS NULL THEN 'I' ELSE 'U' END
+                FROM candidatas c
+                LEFT JOIN {index} i ON {join_keys(key_columns, 'i', 'c')}
+                WHERE i.hash_linha IS DISTINCT FROM c.hash_linha
+                RETURNING operacao
+            )
+            SELECT operacao, COUNT(*) FROM gravadas GROUP BY operacao;
+        """)
+        counts = {"I": 0, "U": 0}
+        counts.update(dict(cursor.fetchall()))
+        return counts
+    finally:
+        cursor.close()
+
+# 📌 6️⃣ Enviar chaves candidatas a exclusão para uma tabela temporária
+def stage_keys(conn, table, key_columns, df):
+    source = f"tmp_cdc_chaves_{table.replace('.', '_')}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {source} ON COMMIT DROP AS
+            SELECT {", ".join(key_columns)} FROM {index_table(table)} WITH NO DATA;
+            TRUNCATE {source};
+        """)
+    finally:
+        cursor.close()
+
+    copy_dataframe(conn, source, key_columns, df, desc="📥 Enviando chaves removidas")
+    return f"SELECT {', '.join(key_columns)} FROM {source}"
+
+# 📌 7️⃣ Chaves do lote de origem que não chegaram ao resultado (removidas ou descartadas)
+def missing_keys(batch_keys, df, key_columns):
+    batch_keys = batch_keys[key_columns].dropna().drop_duplicates()
+    if df is None or df.empty:
+        return batch_keys
+
+    present = df[key_columns].drop_duplicates()
+    merged = batch_keys.merge(present, on=key_columns, how="left", indicator=True)
+    return merged.loc[merged["_merge"] == "left_only", key_columns]
+
+# 📌 8️⃣ Gravar exclusões ('D') para chaves que existiam no índice
+def apply_deletes(conn, keys_query, table, target, key_columns, ts_column, ts, params=None):
+    index = index_table(table)
+    keys = ", ".join(key_columns)
+    params = dict(params or {}, cdc_data=ts)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            WITH removidas AS (
+                DELETE FROM {index} i
+                USING ({keys_query}) k
+                WHERE {join_keys(key_columns, 'i', 'k')}
+                RETURNING {", ".join(f"i.{col}" for col in key_columns)}
+            ),
+            gravadas AS (
+                INSERT INTO {target} ({keys}, {ts_column}, operacao)
+                SELECT DISTINCT {keys}, %(cdc_data)s::timestamp, 'D' FROM removidas
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM gravadas;
+        """, params)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+# 📌 9️⃣ Fechar o snapshot da Bronze: exclusões e troca do índice (sem commit)
+def finish_snapshot(conn, table, target, key_columns, ts_column, ts):
+    index, snapshot = index_table(table), snapshot_table(table)
+    schema, name = index.split(".")
+    cursor = conn.cursor()
+    try:
+        # 🔹 Chave no índice que não apareceu em nenhum shard = empresa/sócio removido
+        deletes = apply_deletes(conn, f"""
+            SELECT {", ".join(key_columns)} FROM {index} i
+            WHERE NOT EXISTS (SELECT 1 FROM {snapshot} s WHERE {join_keys(key_columns, 's', 'i')})
+        """, table, target, key_columns, ts_column, ts)
+
+        cursor.execute("""
+            SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p';
+        """, (snapshot,))
+        snapshot_pkey = cursor.fetchone()[0]
+        cursor.execute(f"""
+            DROP TABLE {index};
+            ALTER TABLE {snapshot} RENAME TO {name};
+            ALTER INDEX {schema}.{snapshot_pkey} RENAME TO {name}_pkey;
+        """)
+
+        cursor.execute(f"""
+            SELECT operacao, COUNT(*) FROM {target}
+            WHERE {ts_column} = %s AND operacao IN ('I', 'U') GROUP BY operacao;
+        """, (ts,))
+        counts = {"I": 0, "U": 0}
+        counts.update(dict(cursor.fetchall()))
+        counts["D"] = deletes
+        return counts
+    finally:
+        cursor.close()
+
+# 📌 🔟 Resumo do CDC
+def print_counts(table, counts):
+    print(f"🔁 CDC {table}: {counts.get('I', 0)} inserções, {counts.get('U', 0)} alterações, "
+          f"{counts.get('D', 0)} exclusões")
+
+# 📌 1️⃣1️⃣ Carga CDC de um lote já transformado: mudanças e exclusões (sem commit)
+def load_changes(conn, table, target, key_columns, columns, ts_column, ts, df, batch_keys):
+    source = stage_dataframe(conn, table, columns, df, desc=f"📥 Inserindo dados em {table}")
+    counts = apply_changes(conn, source, table, target, key_columns, columns, ts_column)
+    removed = stage_keys(conn, table, key_columns, missing_keys(batch_keys, df, key_columns))
+    counts["D"] = apply_deletes(conn, removed, table, target, key_columns, ts_column, ts)
+    print_counts(table, counts)
+    return sum(counts.values())
@@ -0,0 +1,149 @@
+import os
+from partitions import staging_table_name
+
+# 🔹 '0' desliga a retomada: toda execução começa um snapshot novo, do zero
+CHECKPOINT_ENABLED = os.getenv('BRONZE_CHECKPOINT', '1') == '1'
+
+# 📌 1️⃣ Garantir a tabela de checkpoints (uma linha por tabela, snapshot e shard)
+def ensure_checkpoint_table(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE SCHEMA IF NOT EXISTS controle;
+            CREATE TABLE IF NOT EXISTS controle.checkpoints (
+                tabela VARCHAR NOT NULL,
+                data_ingestao TIMESTAMP NOT NULL,
+                arquivo VARCHAR NOT NULL,
+                membro VARCHAR NOT NULL,
+                assinatura VARCHAR NOT NULL,
+                modo VARCHAR NOT NULL,
+                blocos INT NOT NULL DEFAULT 0,
+                linhas BIGINT NOT NULL DEFAULT 0,
+                gravados BIGINT NOT NULL DEFAULT 0,
+                concluido BOOLEAN NOT NULL DEFAULT FALSE,
+                finalizada BOOLEAN NOT NULL DEFAULT FALSE,
+                atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (tabela, data_ingestao, arquivo, membro)
+            );
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 2️⃣ Assinatura barata do ZIP: outro arquivo com o mesmo nome não retoma a carga antiga
+def file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def load_mode_label(staging, cdc):
+    return ("staging" if staging else "insert") + ("+cdc" if cdc else "")
+
+# 📌 3️⃣ Último snapshot não finalizado da tabela, se ainda puder ser retomado
+def find_resumable(conn, table, shards, staging, cdc):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT data_ingestao, arquivo, membro, assinatura, modo, gravados
+            FROM controle.checkpoints
+            WHERE tabela = %s AND data_ingestao = (
+                SELECT MAX(data_ingestao) FROM controle.checkpoints WHERE tabela = %s AND NOT finalizada
+            );
+        """, (table, table))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+
+        data_ingestao = rows[0][0]
+        target = staging_table_name(table, data_ingestao) if staging else table
+        expected = {(zip_path, member, file_signature(zip_path), load_mode_label(staging, cdc))
+                    for zip_path, member in shards}
+        if {row[1:5] for row in rows} != expected:
+            reason = "arquivos ou modo de carga diferentes"
+        else:
+            # 🔹 Staging é UNLOGGED: some num crash do Postgres, e aí os checkpoints não valem mais
+            cursor.execute("SELECT to_regclass(%s);", (target,))
+            if cursor.fetchone()[0] is None:
+                reason = f"{target} não existe mais"
+            else:
+                cursor.execute(f"SELECT COUNT(*) FROM {target} WHERE data_ingestao = %s;", (data_ingestao,))
+                found, recorded = cursor.fetchone()[0], sum(row[5] for row in rows)
+                if found == recorded:
+                    print(f"⏯️ Retomando o snapshot {data_ingestao} de {table}: {found} registros já gravados")
+                    return data_ingestao
+                reason = f"{found} registros em {target}, {recorded} nos checkpoints"
+
+        print(f"⚠️ Snapshot {data_ingestao} de {table} não pode ser retomado ({reason}): descartando")
+        discard_snapshot(conn, table, data_ingestao, staging)
+        return None
+    finally:
+        cursor.close()
+
+# 📌 4️⃣ Apagar o que um snapshot interrompido deixou gravado (com commit)
+def discard_snapshot(conn, table, data_ingestao, staging):
+    cursor = conn.cursor()
+    try:
+        if staging:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table_name(table, data_ingestao)};")
+        else:
+            cursor.execute(f"DELETE FROM {table} WHERE data_ingestao = %s;", (data_ingestao,))
+            print(f"🧹 {cursor.rowcount} registros do snapshot interrompido removidos de {table}")
+        cursor.execute("DELETE FROM controle.checkpoints WHERE tabela = %s AND data_ingestao = %s;",
+                       (table, data_ingestao))
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 5️⃣ Registrar os shards de um snapshot novo (sem commit)
+def register_shards(conn, table, data_ingestao, shards, staging, cdc):
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO controle.checkpoints (tabela, data_ingestao, arquivo, membro, assinatura, modo)
+            VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING;
+        """, [(table, data_ingestao, zip_path, member, file_signature(zip_path), load_mode_label(staging, cdc))
+              for zip_path, member in shards])
+    finally:
+        cursor.close()
+
+# 📌 6️⃣ Ler o checkpoint de um shard (None se o snapshot não registrou o shard)
+def get_checkpoint(conn, table, data_ingestao, zip_path, member):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT blocos, linhas, gravados, concluido FROM controle.checkpoints
+            WHERE tabela = %s AND data_ingestao = %s AND arquivo = %s AND membro = %s;
+        """, (table, data_ingestao, zip_path, member))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if row is None:
+        return None
+    checkpoint = {"tabela": table, "data_ingestao": data_ingestao, "arquivo": zip_path, "membro": member}
+    checkpoint.update(zip(["blocos", "linhas", "gravados", "concluido"], row))
+    return checkpoint
+
+# 📌 7️⃣ Avançar o checkpoint de um shard (sem commit: vai junto com o bloco gravado)
+def save_checkpoint(conn, checkpoint):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE controle.checkpoints
+            SET blocos = %(blocos)s, linhas = %(linhas)s, gravados = %(gravados)s,
+                concluido = %(concluido)s, atualizado_em = NOW()
+            WHERE tabela = %(tabela)s AND data_ingestao = %(data_ingestao)s
+              AND arquivo = %(arquivo)s AND membro = %(membro)s;
+        """, checkpoint)
+    finally:
+        cursor.close()
+
+# 📌 8️⃣ Marcar o snapshot como finalizado (sem commit: vai junto com o ATTACH/CDC)
+def finish_checkpoints(conn, table, data_ingestao):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE controle.checkpoints SET finalizada = TRUE, atualizado_em = NOW()
+            WHERE tabela = %s AND data_ingestao = %s;
+        """, (table, data_ingestao))
+    finally:
+        cursor.close()
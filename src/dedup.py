@@ -0,0 +1,92 @@
+import os
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+import metrics
+from cache import to_table
+from transform import STRING_DTYPE
+from writers import split_by_key
+
+# 🔹 'banco': duplicatas resolvidas na carga (ON CONFLICT ou antes do ATTACH);
+#    'spill': deduplicação em disco, por partição, antes de gravar
+DEDUP_MODE = os.getenv('SOCIOS_DEDUP', 'banco')
+DEDUP_PARTITIONS = int(os.getenv('DEDUP_PARTITIONS', '16'))  # 🔹 Cada partição precisa caber na memória
+SPILL_DIR = os.getenv('SPILL_DIR', os.path.join(os.getenv('EXTRACT_PATH', '/app/stone/temp'), 'spill'))
+
+def partition_name(index):
+    return f"p{index:03d}"
+
+# 📌 1️⃣ Diretório de spill de uma carga (recriado vazio)
+def create_spill_dir(name):
+    path = os.path.join(SPILL_DIR, name)
+    shutil.rmtree(path, ignore_errors=True)  # 🔹 Sobra de uma execução interrompida
+    os.makedirs(path)
+    return path
+
+def remove_spill_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+# 📌 2️⃣ Espalhar os blocos em arquivos por partição, pelo hash da chave
+def spill_chunks(chunks, spill_dir, source, key="cnpj", partitions=DEDUP_PARTITIONS):
+    """
+    Cada bloco é dividido pelo hash de `key` (o mesmo dos writers paralelos) e cada
+    parte vai para `<spill_dir>/pNNN/<source>.parquet`: todas as ocorrências de uma
+    chave caem na mesma partição, na ordem em que foram lidas. Retorna os registros
+    gravados em cada partição.
+    """
+    writers = [None] * partitions
+    rows = [0] * partitions
+    schema = None
+    try:
+        for df in chunks:
+            with metrics.phase("deduplicacao"):
+                for index, part in enumerate(split_by_key(df, key, partitions)):
+                    if not len(part):
+                        continue
+                    table = to_table(part, schema)
+                    schema = table.schema
+                    if writers[index] is None:
+                        directory = os.path.join(spill_dir, partition_name(index))
+                        os.makedirs(directory, exist_ok=True)
+                        writers[index] = pq.ParquetWriter(os.path.join(directory, f"{source}.parquet"), schema)
+                    writers[index].write_table(table)
+                    rows[index] += len(part)
+    finally:
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+    return rows
+
+# 📌 3️⃣ Ler uma partição inteira, com os arquivos na ordem das origens
+def read_partition(spill_dir, name):
+    directory = os.path.join(spill_dir, name)
+    if not os.path.isdir(directory):
+        return None
+    # 🔹 Origens numeradas na ordem dos shards: concatenar mantém a ordem de leitura global
+    tables = [pq.read_table(os.path.join(directory, file_name))
+              for file_name in sorted(os.listdir(directory)) if file_name.endswith(".parquet")]
+    if not tables:
+        return None
+    return pa.concat_tables(tables).to_pandas(types_mapper={pa.string(): STRING_DTYPE}.get)
+
+# 📌 4️⃣ Deduplicar uma partição mantendo a primeira ocorrência de cada chave
+def dedupe_partition(spill_dir, name, subset):
+    with metrics.phase("deduplicacao"):
+        df = read_partition(spill_dir, name)
+        if df is None:
+            metrics.record_partition(name, 0, 0)
+            return None, 0
+        received = len(df)
+        df = df.drop_duplicates(subset=subset, keep="first", ignore_index=True)
+    duplicates = received - len(df)
+    metrics.add_rows("rejeitados", duplicates)
+    metrics.record_partition(name, received, duplicates)
+    return df, duplicates
+
+# 📌 5️⃣ Resumo das duplicatas removidas por partição
+def print_dedup_report(partitions):
+    total = sum(partition["duplicadas"] for partition in partitions)
+    received = sum(partition["registros"] for partition in partitions)
+    print(f"🧹 Deduplicação em {len(partitions)} partição(ões): {total} duplicata(s) de {received} registros")
+    for partition in sorted(partitions, key=lambda p: p["particao"]):
+        print(f"   {partition['particao']}: {partition['duplicadas']} duplicata(s) de {partition['registros']} registros")
@@ -0,0 +1,211 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import psycopg2
+from database import connect_db, release_db, close_pool
+import metrics
+
+# 🔹 Modo de diagnóstico (opt-in): plano das consultas pesadas e deltas das estatísticas do Postgres por etapa
+DIAGNOSTICS = os.getenv('DIAGNOSTICS', '0') == '1'
+# 🔹 'analyze': EXPLAIN (ANALYZE, BUFFERS) executando a consulta numa transação desfeita (dry run);
+#    'plan': só o plano estimado, sem executar; 'off': sem EXPLAIN
+DIAGNOSTICS_EXPLAIN = os.getenv('DIAGNOSTICS_EXPLAIN', 'analyze')
+DIAGNOSTICS_TOP = int(os.getenv('DIAGNOSTICS_TOP', '10'))  # 🔹 Consultas e tabelas listadas no relatório
+DIAGNOSTICS_DIR = os.getenv('DIAGNOSTICS_DIR', os.path.join(metrics.METRICS_DIR, 'diagnostico'))
+
+STATEMENT_COUNTERS = ["calls", "total_exec_time", "rows", "shared_blks_hit", "shared_blks_read",
+                      "shared_blks_dirtied", "shared_blks_written", "temp_blks_read", "temp_blks_written"]
+TABLE_COUNTERS = ["seq_scan", "seq_tup_read", "idx_scan", "idx_tup_fetch", "n_tup_ins", "n_tup_upd", "n_tup_del",
+                  "heap_blks_hit", "heap_blks_read", "idx_blks_hit", "idx_blks_read"]
+
+# 📌 1️⃣ Habilitar o pg_stat_statements (precisa de shared_preload_libraries no servidor)
+def enable_statements(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements;")
+        cursor.execute("SELECT 1 FROM pg_stat_statements LIMIT 1;")
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"⚠️ pg_stat_statements indisponível ({str(e).strip().splitlines()[0]}): "
+              f"diagnóstico só com EXPLAIN e pg_stat_user_tables")
+        return False
+    finally:
+        cursor.close()
+
+# 📌 2️⃣ Contadores acumulados das tabelas e das consultas do banco atual
+def read_counters(conn, statements):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT pg_stat_clear_snapshot();")  # 🔹 Sem o cache de estatísticas da transação
+        cursor.execute(f"""
+            SELECT t.schemaname || '.' || t.relname,
+                   {", ".join(f"COALESCE({column}, 0)" for column in TABLE_COUNTERS)}
+            FROM pg_stat_user_tables t
+            JOIN pg_statio_user_tables USING (relid);
+        """)
+        tables = {row[0]: dict(zip(TABLE_COUNTERS, row[1:])) for row in cursor.fetchall()}
+
+        queries, texts = {}, {}
+        if statements:
+            cursor.execute(f"""
+                SELECT queryid, query, {", ".join(STATEMENT_COUNTERS)}
+                FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                  AND queryid IS NOT NULL;
+            """)
+            for queryid, query, *values in cursor.fetchall():
+                # 🔹 Mesma consulta de usuários diferentes: soma numa entrada só
+                entry = queries.setdefault(queryid, dict.fromkeys(STATEMENT_COUNTERS, 0))
+                for column, value in zip(STATEMENT_COUNTERS, values):
+                    entry[column] += value
+                texts[queryid] = query
+        return {"tabelas": tables, "consultas": queries, "textos": texts}
+    finally:
+        cursor.close()
+        conn.rollback()
+
+# 📌 3️⃣ Diferença entre duas leituras (só o que mudou durante a etapa)
+def counter_deltas(before, after, counters):
+    deltas = {}
+    for key, values in after.items():
+        previous = before.get(key, {})
+        delta = {column: values[column] - previous.get(column, 0) for column in counters}
+        if any(delta.values()):
+            deltas[key] = delta
+    return deltas
+
+# 📌 4️⃣ EXPLAIN de uma consulta da etapa, sempre desfeito no fim
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def explain_statement(conn, label, query, params):
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if DIAGNOSTICS_EXPLAIN == "analyze" else "FORMAT JSON"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"EXPLAIN ({options}) {query.strip().rstrip(';')}", params)
+        explained = cursor.fetchone()[0]
+    except psycopg2.Error as e:
+        print(f"⚠️ EXPLAIN de {label} falhou: {str(e).strip().splitlines()[0]}")
+        return {"consulta": label, "erro": str(e).strip()}
+    finally:
+        cursor.close()
+        conn.rollback()  # 🔹 Dry run: nada que a consulta tenha gravado fica
+
+    explained = (json.loads(explained) if isinstance(explained, str) else explained)[0]
+    plan = explained["Plan"]
+    return {
+        "consulta": label,
+        "execucao_ms": explained.get("Execution Time"),
+        "planejamento_ms": explained.get("Planning Time"),
+        "linhas": plan.get("Actual Rows", plan.get("Plan Rows")),
+        "custo": plan.get("Total Cost"),
+        "blocos_cache": plan.get("Shared Hit Blocks"),
+        "blocos_lidos": plan.get("Shared Read Blocks"),
+        "seq_scans": [{"tabela": node["Relation Name"], "linhas": node.get("Actual Rows", node.get("Plan Rows"))}
+                      for node in plan_nodes(plan) if node["Node Type"] == "Seq Scan"],
+        "plano": explained,
+    }
+
+# 📌 5️⃣ Relatório da etapa: consultas por tempo total e tabelas por leituras sequenciais
+def build_report(stage, seconds, statements, explains, before, after):
+    queries = counter_deltas(before["consultas"], after["consultas"], STATEMENT_COUNTERS)
+    ranked = sorted(queries.items(), key=lambda item: item[1]["total_exec_time"], reverse=True)
+    top_queries = [dict(delta, total_exec_time=round(delta["total_exec_time"], 1), queryid=str(queryid),
+                        query=" ".join(after["textos"][queryid].split()))
+                   for queryid, delta in ranked[:DIAGNOSTICS_TOP]]
+
+    tables = counter_deltas(before["tabelas"], after["tabelas"], TABLE_COUNTERS)
+    top_tables = [dict(delta, tabela=table) for table, delta in
+                  sorted(tables.items(), key=lambda item: (item[1]["seq_tup_read"], item[1]["seq_scan"]), reverse=True)
+                  [:DIAGNOSTICS_TOP]]
+
+    # 🔹 Tempo das consultas no servidor x tempo de parede da etapa: o resto é Python, rede ou espera
+    db_seconds = sum(delta["total_exec_time"] for delta in queries.values()) / 1000 if statements else None
+    return {
+        "etapa": stage,
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "segundos_etapa": round(seconds, 3),
+        "pg_stat_statements": statements,
+        "segundos_banco": round(db_seconds, 3) if db_seconds is not None else None,
+        "fracao_banco": round(db_seconds / seconds, 3) if db_seconds is not None and seconds > 0 else None,
+        "explain": explains,
+        "consultas": top_queries,
+        "tabelas": top_tables,
+    }
+
+def print_report(report, path):
+    db_time = (f"{report['segundos_banco']:.1f}s em consultas ({report['fracao_banco']:.0%})"
+               if report["segundos_banco"] is not None else "tempo no banco indisponível")
+    print(f"🩺 Diagnóstico de {report['etapa']}: {report['segundos_etapa']:.1f}s de etapa, {db_time}. Relatório em {path}")
+    for explained in report["explain"]:
+        if "erro" in explained:
+            continue
+        scans = ", ".join(f"{scan['tabela']} ({scan['linhas']})" for scan in explained["seq_scans"]) or "nenhum"
+        if explained["execucao_ms"] is None:  # 🔹 DIAGNOSTICS_EXPLAIN=plan: só estimativas
+            print(f"   EXPLAIN {explained['consulta']}: custo {explained['custo']}, ~{explained['linhas']} linhas, "
+                  f"seq scan: {scans}")
+            continue
+        print(f"   EXPLAIN {explained['consulta']}: {explained['execucao_ms']:.1f} ms, {explained['linhas']} linhas, "
+              f"cache {explained['blocos_cache']} / lidos {explained['blocos_lidos']} blocos, seq scan: {scans}")
+    for query in report["consultas"]:
+        print(f"   {query['total_exec_time']:>10.1f} ms {query['calls']:>6}x {query['rows']:>10} linhas "
+              f"hit {query['shared_blks_hit']} read {query['shared_blks_read']}  {query['query'][:90]}")
+    for table in report["tabelas"]:
+        if table["seq_scan"]:
+            print(f"   🔍 {table['tabela']}: {table['seq_scan']} seq scan(s), {table['seq_tup_read']} linhas lidas")
+
+# 📌 6️⃣ Diagnosticar uma etapa: EXPLAIN antes, leitura dos contadores antes e depois
+@contextmanager
+def capture(stage, module, kwargs):
+    """
+    As consultas de `module.diagnostic_statements(conn, **kwargs)` passam pelo
+    EXPLAIN antes da etapa, fora da janela medida. Os deltas de pg_stat_statements
+    e pg_stat_user_tables valem para o banco inteiro: com etapas em paralelo, uma
+    etapa enxerga as consultas da outra. Devolve um dict preenchido no fim com o
+    arquivo do relatório e o tempo no banco.
+    """
+    result = {}
+    conn = connect_db()
+    try:
+        statements = enable_statements(conn)
+        explains = []
+        hook = getattr(module, "diagnostic_statements", None)
+        if hook is not None and DIAGNOSTICS_EXPLAIN != "off":
+            for label, query, params in hook(conn, **kwargs):
+                explains.append(explain_statement(conn, label, query, params))
+    finally:
+        release_db(conn)
+
+    close_pool()  # 🔹 O que o EXPLAIN leu não pode cair na janela da etapa
+    conn = connect_db()
+    try:
+        before = read_counters(conn, statements)
+    finally:
+        release_db(conn)
+
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        seconds = time.perf_counter() - start
+        try:
+            close_pool()  # 🔹 As sessões da etapa só publicam as estatísticas das tabelas ao encerrar
+            conn = connect_db()
+            try:
+                after = read_counters(conn, statements)
+            finally:
+                release_db(conn)
+            report = build_report(stage, seconds, statements, explains, before, after)
+            path = os.path.join(DIAGNOSTICS_DIR, f"{stage}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            metrics.write_atomic(path, json.dumps(report, indent=2, ensure_ascii=False, default=str))
+            print_report(report, path)
+            result.update(arquivo=path, segundos_banco=report["segundos_banco"], fracao_banco=report["fracao_banco"])
+        except (psycopg2.Error, OSError) as e:
+            # 🔹 Falha no diagnóstico não pode mascarar o resultado da etapa
+            print(f"⚠️ Diagnóstico de {stage} não gerado: {e}")
@@ -0,0 +1,206 @@
+import argparse
+import glob
+import os
+import re
+import zipfile
+import pandas as pd
+from database import connect_db, release_db
+from fingerprints import zip_inputs
+import metrics
+
+# 🔹 Arquivos de referência da Receita (Paises.zip, Naturezas.zip, Qualificacoes.zip)
+REFERENCE_DIR = os.getenv('REFERENCE_DIR', '/app/stone/data')
+PAIS_BRASIL = "105"  # 🔹 Código do Brasil na tabela de países da Receita
+
+# 🔹 Dimensões: tabela, padrão do ZIP e padrão do membro CSV (código;descrição)
+DIMENSIONS = {
+    "paises": {"table": "silver.dim_paises",
+               "zip": os.getenv('PAISES_ZIP_PATTERN', os.path.join(REFERENCE_DIR, 'Paises*.zip')),
+               "member": r'.*PAISCSV$'},
+    "naturezas": {"table": "silver.dim_naturezas",
+                  "zip": os.getenv('NATUREZAS_ZIP_PATTERN', os.path.join(REFERENCE_DIR, 'Naturezas*.zip')),
+                  "member": r'.*NATJUCSV$'},
+    "qualificacoes": {"table": "silver.dim_qualificacoes",
+                      "zip": os.getenv('QUALIFICACOES_ZIP_PATTERN', os.path.join(REFERENCE_DIR, 'Qualificacoes*.zip')),
+                      "member": r'.*QUALSCSV$'},
+}
+# 🔹 Linhas que precisam existir mesmo sem o arquivo de referência (flag de sócio estrangeiro)
+SEEDS = {"paises": [(PAIS_BRASIL, "BRASIL")]}
+# 🔹 Colunas de id na Silver para bancos criados antes das dimensões (as colunas de código antigas ficam)
+SILVER_ID_COLUMNS = {"silver.empresas": ["natureza_juridica_id"],
+                     "silver.socios": ["qualificacao_socio_id", "pais_id", "qualificacao_representante_id"]}
+
+_keys = {}  # 🔹 Cache do processo: dimensão -> {chave: id}
+
+# 📌 1️⃣ Garantir as tabelas das dimensões (com commit)
+def ensure_dimensions(conn):
+    cursor = conn.cursor()
+    try:
+        for name, dimension in DIMENSIONS.items():
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {dimension['table']} (
+                    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                    codigo VARCHAR NOT NULL UNIQUE,
+                    descricao VARCHAR
+                );
+            """)
+            for codigo, descricao in SEEDS.get(name, []):
+                # 🔹 NOT EXISTS em vez de ON CONFLICT: o conflito gastaria um valor da sequência (smallint)
+                cursor.execute(f"INSERT INTO {dimension['table']} (codigo, descricao) SELECT %s, %s "
+                               f"WHERE NOT EXISTS (SELECT 1 FROM {dimension['table']} WHERE codigo = %s);",
+                               (codigo, descricao, codigo))
+        for table, columns in SILVER_ID_COLUMNS.items():
+            # 🔹 Só altera quando falta coluna: o ALTER trava a tabela mesmo com IF NOT EXISTS
+            schema, name = table.split(".")
+            cursor.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = %s;
+            """, (schema, name))
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [column for column in columns if column not in existing]
+            if existing and missing:
+                cursor.execute(f"ALTER TABLE {table} " + ", ".join(f"ADD COLUMN {column} SMALLINT" for column in missing) + ";")
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 2️⃣ Normalizar um código: números sem zeros à esquerda ('05' = '5'), texto em maiúsculas
+def normalize_code(value):
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (int, float)) or pd.api.types.is_number(value):
+        return str(int(value))
+    text = str(value).strip()
+    if not text:
+        return None
+    return str(int(text)) if re.fullmatch(r'[0-9]+', text) else text.upper()
+
+# 🔹 Mesma normalização dentro do Postgres (modo SQL da Silver)
+def normalize_sql(expression):
+    text = f"btrim(({expression})::text)"
+    return f"(CASE WHEN {text} ~ '^[0-9]+$' THEN ({text})::numeric::text ELSE NULLIF(upper({text}), '') END)"
+
+# 📌 3️⃣ Chaves de busca de uma dimensão: o código e, como alternativa, a descrição
+def keys_sql(table):
+    # 🔹 Arquivos antigos trazem o nome do país ('BRASIL') em vez do código
+    return f"""(
+            SELECT DISTINCT ON (chave) chave, id FROM (
+                SELECT codigo AS chave, id, 0 AS prioridade FROM {table}
+                UNION ALL
+                SELECT upper(btrim(descricao)), id, 1 FROM {table} WHERE descricao IS NOT NULL
+            ) chaves
+            ORDER BY chave, prioridade, id
+        )"""
+
+# 📌 4️⃣ Registrar códigos que a dimensão ainda não conhece, sem descrição (sem commit)
+def register_codes(cursor, table, values_sql, params=None):
+    cursor.execute(f"""
+        INSERT INTO {table} (codigo)
+        SELECT DISTINCT valor FROM ({values_sql}) valores
+        WHERE valor IS NOT NULL AND valor NOT IN (SELECT chave FROM {keys_sql(table)} conhecidas)
+        ORDER BY valor
+        ON CONFLICT (codigo) DO NOTHING;
+    """, params)
+    return cursor.rowcount
+
+# 📌 5️⃣ Trocar os códigos de uma coluna pelos ids da dimensão, com cache no processo
+def lookup_ids(values, name, conn=None):
+    """
+    Só os valores distintos da coluna são normalizados e procurados. O cache da
+    dimensão é lido do banco na primeira chamada do processo e relido quando
+    aparece um código novo, que é registrado sem descrição (o arquivo de
+    referência completa a descrição na próxima carga). Com `conn`, os códigos
+    novos ficam na transação de quem chama (sem commit) e o cache do processo
+    não é usado nem atualizado. Retorna Int16.
+    """
+    table = DIMENSIONS[name]["table"]
+    mapping = {raw: normalize_code(raw) for raw in pd.unique(values.dropna())}
+    keys = _keys.get(name) if conn is None else None
+    missing = sorted({code for code in mapping.values() if code is not None and (keys is None or code not in keys)})
+
+    if keys is None or missing:
+        own = conn is None
+        conn = connect_db() if own else conn
+        cursor = conn.cursor()
+        try:
+            if own and keys is None:
+                ensure_dimensions(conn)
+            if missing:
+                added = register_codes(cursor, table, "SELECT unnest(%(valores)s::text[]) AS valor", {"valores": missing})
+                if own:
+                    conn.commit()
+                if added:
+                    print(f"🆕 {added} código(s) sem referência registrado(s) em {table}")
+            cursor.execute(f"SELECT chave, id FROM {keys_sql(table)} chaves;")
+            keys = dict(cursor.fetchall())
+            if own:
+                _keys[name] = keys
+        finally:
+            cursor.close()
+            if own:
+                release_db(conn)
+
+    ids = {raw: keys.get(code) for raw, code in mapping.items()}
+    return values.map(ids).astype("Int16")
+
+# 📌 6️⃣ Ler o CSV de referência (código;descrição) de um ZIP da Receita
+def read_reference(zip_path, member_pattern):
+    regex = re.compile(member_pattern)
+    frames = []
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for member in sorted(zip_ref.namelist()):
+            if not regex.match(os.path.basename(member)):
+                continue
+            with zip_ref.open(member) as raw:
+                frames.append(pd.read_csv(raw, sep=";", header=None, names=["codigo", "descricao"],
+                                          dtype=str, encoding="latin1", keep_default_na=False))
+    if not frames:
+        raise FileNotFoundError(f"❌ Nenhum membro {member_pattern} em {zip_path}.")
+    return pd.concat(frames, ignore_index=True)
+
+# 📌 7️⃣ Gravar a referência na dimensão: códigos novos ganham id, os existentes só a descrição (sem commit)
+def load_reference(conn, name, df):
+    df = df.assign(codigo=df["codigo"].map(normalize_code), descricao=df["descricao"].str.strip())
+    df = df.dropna(subset=["codigo"]).drop_duplicates(subset=["codigo"], keep="last")
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(f"""
+            INSERT INTO {DIMENSIONS[name]['table']} AS dim (codigo, descricao) VALUES (%s, %s)
+            ON CONFLICT (codigo) DO UPDATE SET descricao = EXCLUDED.descricao
+            WHERE dim.descricao IS DISTINCT FROM EXCLUDED.descricao;
+        """, list(df[["codigo", "descricao"]].itertuples(index=False, name=None)))
+    finally:
+        cursor.close()
+    return len(df)
+
+# 🔹 Entradas da etapa para a memorização do main.py: conteúdo dos ZIPs de referência
+def fingerprint_inputs(conn):
+    return {name: zip_inputs(dimension["zip"]) for name, dimension in DIMENSIONS.items()}
+
+# 📌 8️⃣ Executar a carga das dimensões (arquivo ausente não impede a Silver: os códigos entram sem descrição)
+def main():
+    conn = connect_db()
+    try:
+        ensure_dimensions(conn)
+        for name, dimension in DIMENSIONS.items():
+            zip_paths = sorted(glob.glob(dimension["zip"]))
+            if not zip_paths:
+                print(f"⚠️ Referência de {name} não encontrada ({dimension['zip']}): mantendo {dimension['table']}")
+                continue
+            with metrics.phase("leitura"):
+                df = pd.concat([read_reference(path, dimension["member"]) for path in zip_paths], ignore_index=True)
+            metrics.add_rows("lidos", len(df))
+            with metrics.phase("banco"):
+                total = load_reference(conn, name, df)
+            metrics.add_rows("gravados", total)
+            print(f"✅ {total} códigos de {name} carregados em {dimension['table']}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db(conn)
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="Carga das dimensões de referência da Receita (países, naturezas, qualificações)").parse_args()
+    main()
@@ -0,0 +1,125 @@
+import glob
+import hashlib
+import json
+import os
+import psycopg2
+from cache import file_hash
+from database import connect_db, release_db
+from shards import discover_shards
+
+# 🔹 '0' desliga a memorização: toda etapa executa sempre
+MEMO_ENABLED = os.getenv('PIPELINE_MEMO', '1') == '1'
+# 🔹 Incrementar quando o tratamento das etapas mudar: nenhum fingerprint antigo volta a valer
+MEMO_VERSION = 1
+
+# 📌 1️⃣ Garantir a tabela com o fingerprint da última execução bem-sucedida de cada etapa
+def ensure_memo_table(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE SCHEMA IF NOT EXISTS controle;
+            CREATE TABLE IF NOT EXISTS controle.etapas (
+                etapa VARCHAR PRIMARY KEY,
+                fingerprint VARCHAR NOT NULL,
+                entradas JSONB NOT NULL,
+                segundos DOUBLE PRECISION NOT NULL,
+                concluida_em TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 2️⃣ Entradas em arquivo: hash do conteúdo de cada ZIP (e os membros lidos dele)
+def zip_inputs(zip_pattern, member_pattern=None):
+    if member_pattern is None:
+        return [{"arquivo": os.path.basename(path), "sha256": file_hash(path)} for path in sorted(glob.glob(zip_pattern))]
+
+    inputs = {}
+    for zip_path, member in discover_shards(zip_pattern, member_pattern):
+        entry = inputs.setdefault(zip_path, {"arquivo": os.path.basename(zip_path), "sha256": file_hash(zip_path),
+                                             "membros": []})
+        entry["membros"].append(member)
+    return list(inputs.values())
+
+# 📌 3️⃣ Entradas em tabela: linhas e maior data de cada partição
+def table_inputs(conn, table, time_column):
+    """
+    Contagem exata (uma leitura da tabela): uma carga que apaga e grava o mesmo
+    número de linhas ainda muda a maior data da partição.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT tableoid::regclass::text, COUNT(*), MAX({time_column})
+            FROM {table} GROUP BY 1 ORDER BY 1;
+        """)
+        return [{"particao": partition, "linhas": rows, "maior_data": latest}
+                for partition, rows, latest in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+# 📌 4️⃣ Fingerprint da etapa: entradas de `module.fingerprint_inputs(conn, **options)` + opções
+def compute(conn, module, options):
+    hook = getattr(module, "fingerprint_inputs", None)
+    if hook is None:
+        return None, None  # 🔹 Etapa sem entradas declaradas nunca é reaproveitada
+
+    # 🔹 --full-refresh força a etapa (main.py) em vez de mudar o fingerprint
+    inputs = {"versao": MEMO_VERSION, "opcoes": {key: value for key, value in options.items() if key != "full_refresh"},
+              "entradas": hook(conn, **options)}
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest(), text
+
+# 📌 5️⃣ Última execução bem-sucedida registrada da etapa: (fingerprint, segundos, concluída em)
+def last_run(conn, stage):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT fingerprint, segundos, concluida_em FROM controle.etapas WHERE etapa = %s;", (stage,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.rollback()
+
+# 📌 6️⃣ Registrar o fingerprint depois da etapa concluída (com commit)
+def record_run(conn, stage, fingerprint, inputs, seconds):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO controle.etapas (etapa, fingerprint, entradas, segundos, concluida_em)
+            VALUES (%s, %s, %s::jsonb, %s, NOW())
+            ON CONFLICT (etapa) DO UPDATE
+            SET fingerprint = EXCLUDED.fingerprint, entradas = EXCLUDED.entradas,
+                segundos = EXCLUDED.segundos, concluida_em = EXCLUDED.concluida_em;
+        """, (stage, fingerprint, inputs, seconds))
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 7️⃣ No processo da etapa: fingerprint atual e última execução, antes de decidir se executa
+def check(stage, module, options):
+    conn = connect_db()
+    try:
+        ensure_memo_table(conn)
+        fingerprint, inputs = compute(conn, module, options)
+        if fingerprint is None:
+            return None
+        return {"fingerprint": fingerprint, "entradas": inputs, "anterior": last_run(conn, stage)}
+    except (psycopg2.Error, OSError) as e:
+        # 🔹 Sem fingerprint a etapa só não é reaproveitada: executa normalmente
+        conn.rollback()
+        print(f"⚠️ Fingerprint de {stage} indisponível ({str(e).strip().splitlines()[0]}): executando a etapa")
+        return None
+    finally:
+        release_db(conn)
+
+def save(stage, state, seconds):
+    conn = connect_db()
+    try:
+        record_run(conn, stage, state["fingerprint"], state["entradas"], seconds)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"⚠️ Fingerprint de {stage} não registrado: {e}")
+    finally:
+        release_db(conn)
@@ -0,0 +1,137 @@
+import time
+from cdc import join_keys
+from database import ensure_watermark_table, get_watermark, set_watermark
+import ingestion_silver_empresas
+import ingestion_silver_socios
+
+# 🔹 Tabelas da Silver compactadas em histórico: chave e colunas de negócio de cada uma
+SILVER_TABLES = [
+    (ingestion_silver_empresas.TABLE, ingestion_silver_empresas.KEY_COLUMNS, ingestion_silver_empresas.COLUMNS),
+    (ingestion_silver_socios.TABLE, ingestion_silver_socios.KEY_COLUMNS, ingestion_silver_socios.COLUMNS),
+]
+TS_COLUMN = "data_processamento"
+
+# 📌 1️⃣ Tabela de histórico (SCD tipo 2) e chave do watermark da compactação
+def history_table(table):
+    return f"{table}_historico"
+
+def watermark_key(table):
+    return f"{history_table(table)}:{table}"
+
+def value_columns(columns):
+    return [col for col in columns if col != TS_COLUMN]
+
+# 📌 2️⃣ Garantir a tabela de histórico: uma linha por versão, aberta de valid_from até valid_to (com commit)
+def ensure_history(conn, table, key_columns, columns):
+    history = history_table(table)
+    name = history.split(".")[1]
+    keys = ", ".join(key_columns)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass(%s);", (history,))
+        if cursor.fetchone()[0] is None:
+            # 🔹 Mesmos tipos das colunas da Silver, sem precisar repeti-los aqui
+            cursor.execute(f"""
+                CREATE TABLE {history} AS
+                SELECT {", ".join(value_columns(columns))}, NULL::BIGINT AS hash_linha FROM {table} WITH NO DATA;
+                ALTER TABLE {history}
+                    ADD COLUMN valid_from TIMESTAMP NOT NULL,
+                    ADD COLUMN valid_to TIMESTAMP,
+                    ADD PRIMARY KEY ({keys}, valid_from);
+                -- 🔹 Estado atual: uma versão aberta por chave, a um predicado indexado de distância
+                CREATE UNIQUE INDEX {name}_atual ON {history} ({keys}) WHERE valid_to IS NULL;
+                CREATE INDEX {name}_valid_from ON {history} (valid_from);
+                CREATE INDEX {name}_valid_to ON {history} (valid_to);
+            """)
+            print(f"🧱 Histórico {history} criado.")
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 3️⃣ Aplicar um snapshot da Silver ao histórico: fecha as versões que mudaram e abre as novas (sem commit)
+def apply_snapshot(cursor, table, key_columns, columns, ts, changes_only):
+    """
+    Snapshot completo (Silver fora do CDC): chave ausente ou com hash diferente
+    tem a versão aberta fechada em `ts`. Snapshot de mudanças (CDC): só as chaves
+    presentes são fechadas, e as exclusões ('D') não abrem versão nova.
+    """
+    history = history_table(table)
+    values = value_columns(columns)
+    column_list = ", ".join(values)
+
+    cursor.execute(f"""
+        DROP TABLE IF EXISTS tmp_historico;
+        CREATE TEMP TABLE tmp_historico ON COMMIT DROP AS
+        SELECT {column_list}, operacao, hashtextextended(ROW({column_list})::text, 0) AS hash_linha
+        FROM {table} WHERE {TS_COLUMN} = %s;
+        ANALYZE tmp_historico;
+    """, (ts,))
+
+    if changes_only:
+        cursor.execute(f"""
+            UPDATE {history} h SET valid_to = %s
+            FROM tmp_historico t
+            WHERE h.valid_to IS NULL AND {join_keys(key_columns, 't', 'h')}
+              AND (t.operacao = 'D' OR t.hash_linha IS DISTINCT FROM h.hash_linha);
+        """, (ts,))
+    else:
+        cursor.execute(f"""
+            UPDATE {history} h SET valid_to = %s
+            WHERE h.valid_to IS NULL AND NOT EXISTS (
+                SELECT 1 FROM tmp_historico t
+                WHERE {join_keys(key_columns, 't', 'h')} AND t.hash_linha = h.hash_linha
+            );
+        """, (ts,))
+    closed = cursor.rowcount
+
+    # 🔹 Chave sem versão aberta (nova ou recém-fechada) recebe a versão do snapshot
+    cursor.execute(f"""
+        INSERT INTO {history} ({column_list}, hash_linha, valid_from)
+        SELECT {", ".join(f"t.{col}" for col in values)}, t.hash_linha, %s
+        FROM tmp_historico t
+        WHERE t.operacao IS DISTINCT FROM 'D' AND NOT EXISTS (
+            SELECT 1 FROM {history} h WHERE h.valid_to IS NULL AND {join_keys(key_columns, 't', 'h')}
+        );
+    """, (ts,))
+    return closed, cursor.rowcount
+
+# 📌 4️⃣ Compactar no histórico os snapshots da Silver posteriores ao watermark (um commit por snapshot)
+def compact_table(conn, table, key_columns, columns):
+    ensure_history(conn, table, key_columns, columns)
+    watermark = get_watermark(conn, watermark_key(table))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT {TS_COLUMN}, BOOL_OR(operacao IS NOT NULL)
+            FROM {table}
+            WHERE %(watermark)s::timestamp IS NULL OR {TS_COLUMN} > %(watermark)s
+            GROUP BY {TS_COLUMN} ORDER BY {TS_COLUMN};
+        """, {"watermark": watermark})
+        snapshots = cursor.fetchall()
+
+        totals = {"snapshots": len(snapshots), "fechadas": 0, "abertas": 0}
+        for ts, changes_only in snapshots:
+            begin = time.perf_counter()
+            closed, opened = apply_snapshot(cursor, table, key_columns, columns, ts, changes_only)
+            set_watermark(conn, watermark_key(table), ts)  # 🔹 Mesmo commit do snapshot aplicado
+            conn.commit()
+            totals["fechadas"] += closed
+            totals["abertas"] += opened
+            print(f"🗜️ {table} {ts}: {closed} versões fechadas, {opened} abertas "
+                  f"({time.perf_counter() - begin:.1f}s)")
+        return totals
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# 📌 5️⃣ Compactar todas as tabelas da Silver
+def compact_silver(conn):
+    ensure_watermark_table(conn)
+    results = {}
+    for table, key_columns, columns in SILVER_TABLES:
+        results[table] = compact_table(conn, table, key_columns, columns)
+        if not results[table]["snapshots"]:
+            print(f"✅ {history_table(table)} já está em dia.")
+    return results
@@ -1,24 +1,52 @@
 import pandas as pd
-import psycopg2
-from psycopg2 import sql
 from datetime import datetime
-from tqdm import tqdm
+from cache import cached_chunks
+from checkpoints import (CHECKPOINT_ENABLED, ensure_checkpoint_table, find_resumable, register_shards,
+                         get_checkpoint, save_checkpoint, finish_checkpoints, load_mode_label)
+from cdc import CDC_ENABLED, ensure_cdc, begin_snapshot, stage_dataframe, apply_changes, finish_snapshot, print_counts
+from database import connect_db, release_db, copy_dataframe
+from partitions import LOAD_MODE, create_staging_table, staging_table_name, attach_staging_table
+from shards import discover_shards, run_shards
+from fingerprints import zip_inputs
+from parallel_csv import PARSE_WORKERS, parse_parallel
+import metrics
+from writers import ParallelWriter
+from transform import STRING_DTYPE, clean_text_columns, clean_utf8_strip
 import zipfile
+from collections import deque
+import time
 import os
 
-# 🔹 Configurações do banco de dados
-DB_CONFIG = {
-    "host": "localhost",
-    "port": "5432",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "has2582"
-}
-
 # Caminho relativo ou variável de ambiente para o arquivo ZIP
 ZIP_FILE = os.getenv('ZIP_FILE', '/app/stone/data/Empresas.zip')  # Variável de ambiente no Docker
 EXTRACT_PATH = os.getenv('EXTRACT_PATH', '/app/stone/temp')  # Pasta temporária para extração no contêiner
 EXPECTED_CSV = "K3241.K03200Y1.D50111.EMPRECSV"  # Nome do CSV dentro do ZIP
+STREAMING = os.getenv('BRONZE_STREAMING', '1') == '1'  # Lê o CSV direto do ZIP em blocos
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '500000'))  # Linhas por bloco no modo streaming
+# 🔹 O release mensal vem dividido em Empresas0.zip ... Empresas9.zip e o nome do membro muda todo mês
+ZIP_PATTERN = os.getenv('EMPRESAS_ZIP_PATTERN', os.getenv('ZIP_FILE', '/app/stone/data/Empresas*.zip'))
+MEMBER_PATTERN = os.getenv('EMPRESAS_MEMBER_PATTERN', r'.*\.EMPRECSV$')
+BRONZE_WORKERS = int(os.getenv('BRONZE_WORKERS', '4'))  # Shards ingeridos em paralelo
+BRONZE_WRITERS = int(os.getenv('BRONZE_WRITERS', '1'))  # 🔹 Conexões gravando em paralelo dentro de cada shard
+
+TABLE = "bronze.empresas"
+PRIMARY_KEY = ["cnpj", "data_ingestao"]
+KEY_COLUMNS = ["cnpj"]  # 🔹 Chave do CDC entre snapshots
+
+CSV_COLUMNS = ["cnpj", "razao_social", "natureza_juridica", "qualificacao_responsavel", "capital_social", "cod_porte", "ignore"]
+
+# 🔹 Tipos na leitura: texto em Arrow, códigos como inteiros pequenos e o porte como categoria
+CSV_DTYPES = {
+    "cnpj": STRING_DTYPE,
+    "razao_social": STRING_DTYPE,
+    "natureza_juridica": "Int16",
+    "qualificacao_responsavel": "Int16",
+    "capital_social": STRING_DTYPE,  # 🔹 Vírgula decimal: convertido no transform_chunk
+    "cod_porte": "category",
+    "ignore": STRING_DTYPE,
+}
+# 🔹 Mesmas opções na leitura sequencial (stream_csv) e no parse paralelo (parallel_csv)
+CSV_READ_OPTIONS = {"sep": ";", "header": None, "names": CSV_COLUMNS, "dtype": CSV_DTYPES, "encoding": "latin1"}
 
 # 📌 1️⃣ Função para extrair o CSV do ZIP
 def extract_csv(zip_path, extract_to, expected_file):
@@ -33,13 +61,18 @@ def extract_csv(zip_path, extract_to, expected_file):
         else:
             raise FileNotFoundError(f"❌ Arquivo esperado ({expected_file}) não encontrado no ZIP.")
 
-# 📌 2️⃣ Conectar ao banco de dados
-def connect_db():
-    try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Erro na conexão: {e}")
-        return None
+# 📌 2️⃣ Ler o CSV direto do ZIP em blocos, sem arquivo temporário
+def stream_csv(zip_path, expected_file, chunk_size, skip_rows=0):
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        if expected_file not in zip_ref.namelist():
+            raise FileNotFoundError(f"❌ Arquivo esperado ({expected_file}) não encontrado no ZIP.")
+
+        with zip_ref.open(expected_file) as raw:
+            # 🔹 O pandas decodifica o latin1 de forma incremental a cada bloco lido
+            reader = pd.read_csv(raw, **CSV_READ_OPTIONS, chunksize=chunk_size,
+                                 skiprows=skip_rows or None)  # 🔹 Linhas já gravadas numa carga interrompida
+            for chunk in reader:
+                yield chunk
 
 # 📌 3️⃣ Criar partição dinamicamente
 def create_partition(conn, data_ingestao):
@@ -59,7 +92,8 @@ def create_partition(conn, data_ingestao):
         print(f"✅ Partição {partition_name} criada/verificada.")
     except Exception as e:
         conn.rollback()
-        print(f"⚠️ Erro ao criar partição: {e}")
+        print(f"❌ Erro ao criar partição: {e}")
+        raise  # 🔹 Sem a partição a carga falharia depois, com um erro menos claro
     finally:
         cursor.close()
 
@@ -67,48 +101,212 @@ def create_partition(conn, data_ingestao):
 def clean_text(value):
     return value.encode('utf-8', 'ignore').decode('utf-8').strip() if isinstance(value, str) else value
 
-# 📌 5️⃣ Inserir dados no PostgreSQL
+# 📌 5️⃣ Tratar um bloco lido do CSV
+def transform_chunk(df):
+    df.columns = CSV_COLUMNS
+    df.drop(columns=["ignore"], inplace=True)
+    df["capital_social"] = df["capital_social"].str.replace(",", ".").astype(float)
+    return clean_text_columns(df, clean_utf8_strip)  # 🔹 Versão vetorizada de applymap(clean_text)
+
+# 📌 6️⃣ Copiar um bloco para a Bronze usando uma conexão já aberta
+def load_chunk(conn, df, data_ingestao, table=TABLE, cdc=False):
+    columns = ["cnpj", "razao_social", "natureza_juridica", "qualificacao_responsavel",
+               "capital_social", "cod_porte", "data_ingestao"]
+    df = df.assign(data_ingestao=data_ingestao)
+    with metrics.phase("banco"):
+        if cdc:
+            # 🔹 Só as linhas novas ou alteradas em relação ao snapshot anterior são gravadas
+            source = stage_dataframe(conn, TABLE, columns, df, desc="📥 Inserindo dados")
+            counts = apply_changes(conn, source, TABLE, table, KEY_COLUMNS, columns, "data_ingestao", snapshot=True)
+            total = counts["I"] + counts["U"]
+        else:
+            total = copy_dataframe(conn, table, columns, df, desc="📥 Inserindo dados")
+    metrics.add_rows("gravados", total)
+    return total
+
+# 📌 7️⃣ Inserir dados no PostgreSQL via COPY
 def insert_data(df):
-    conn = connect_db()
-    if conn is None:
-        return
+    conn = connect_db(bulk=True)
 
-    create_partition(conn, datetime.now())
-    cursor = conn.cursor()
-    insert_query = """
-        INSERT INTO bronze.empresas (cnpj, razao_social, natureza_juridica, 
-                                     qualificacao_responsavel, capital_social, 
-                                     cod_porte, data_ingestao)
-        VALUES (%s, %s, %s, %s, %s, %s, %s);
-    """
+    data_ingestao = datetime.now()
+    create_partition(conn, data_ingestao)
 
     try:
-        for _, row in tqdm(df.iterrows(), total=len(df), desc="📥 Inserindo dados"):
-            cursor.execute(insert_query, (
-                row['cnpj'], row['razao_social'], row['natureza_juridica'],
-                row['qualificacao_responsavel'], row['capital_social'],
-                row['cod_porte'], datetime.now()
-            ))
+        load_chunk(conn, df, data_ingestao)
         conn.commit()
         print("✅ Dados inseridos na Bronze!")
     except Exception as e:
         conn.rollback()
         print(f"❌ Erro ao inserir dados: {e}")
+        raise
     finally:
-        cursor.close()
-        conn.close()
+        release_db(conn)
+
+# 📌 8️⃣ Inserir os blocos já tratados; com checkpoint, cada bloco é um commit
+def insert_stream(chunks, data_ingestao=None, table=TABLE, cdc=False, checkpoint=None):
+    conn = connect_db(bulk=True)
+
+    if data_ingestao is None:
+        data_ingestao = datetime.now()
+        create_partition(conn, data_ingestao)
+    total = 0
+
+    try:
+        if BRONZE_WRITERS > 1:
+            total = insert_parallel(conn, chunks, data_ingestao, table, cdc, checkpoint)
+        else:
+            for chunk in chunks:
+                rows = len(chunk)
+                written = load_chunk(conn, chunk, data_ingestao, table, cdc)
+                total += written
+                if checkpoint is not None:
+                    # 🔹 Bloco e checkpoint no mesmo commit: numa retomada nada é gravado duas vezes
+                    advance_checkpoint(conn, checkpoint, rows, written)
+        if checkpoint is not None:
+            checkpoint["concluido"] = True
+            save_checkpoint(conn, checkpoint)
+        conn.commit()
+        print(f"✅ {total} registros inseridos na Bronze!")
+        return total
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erro ao inserir dados: {e}")
+        raise
+    finally:
+        release_db(conn)
+
+# 📌 9️⃣ Avançar o checkpoint do shard com um bloco gravado (com commit)
+def advance_checkpoint(conn, checkpoint, rows, written):
+    checkpoint.update(blocos=checkpoint["blocos"] + 1, linhas=checkpoint["linhas"] + rows,
+                      gravados=checkpoint["gravados"] + written)
+    save_checkpoint(conn, checkpoint)
+    conn.commit()
+
+# 📌 🔟 Inserir com writers paralelos: enquanto eles gravam um bloco, este processo já lê e trata o próximo
+def insert_parallel(conn, chunks, data_ingestao, table, cdc, checkpoint):
+    pending_rows = deque()  # 🔹 Linhas lidas de cada bloco enviado, na ordem das rodadas
+
+    def on_round(written):
+        # 🔹 Depois do commit de todos os writers: o checkpoint só anda com o bloco inteiro gravado
+        rows = pending_rows.popleft()
+        if checkpoint is not None:
+            advance_checkpoint(conn, checkpoint, rows, written)
+
+    load = lambda writer_conn, df: load_chunk(writer_conn, df, data_ingestao, table, cdc)
+    with ParallelWriter(load, BRONZE_WRITERS, commit_rounds=checkpoint is not None, on_round=on_round,
+                        name=f"{TABLE}-writer") as writer:
+        for chunk in chunks:
+            pending_rows.append(len(chunk))
+            writer.submit(chunk)
+        total = writer.join()
+        writer.commit()
+    return total
+
+# 📌 1️⃣1️⃣ Ingerir um shard (ZIP + membro) com conexão própria, dentro do processo worker
+def ingest_shard(zip_path, member, data_ingestao, chunk_size, table=TABLE, cdc=False):
+    start = time.perf_counter()
+    metrics.start()  # 🔹 Métricas do shard, somadas às da etapa no processo principal
+
+    checkpoint = None
+    if CHECKPOINT_ENABLED:
+        conn = connect_db()
+        try:
+            checkpoint = get_checkpoint(conn, TABLE, data_ingestao, zip_path, member)
+        finally:
+            release_db(conn)
+    skip_rows = checkpoint["linhas"] if checkpoint is not None else 0
+    if checkpoint is not None and checkpoint["concluido"]:
+        print(f"⏭️ {os.path.basename(zip_path)}/{member} já carregado neste snapshot ({checkpoint['gravados']} registros)")
+        return {"arquivo": zip_path, "membro": member, "registros": 0,
+                "segundos": time.perf_counter() - start, "metricas": metrics.snapshot()}
+    if skip_rows:
+        print(f"⏯️ {os.path.basename(zip_path)}/{member}: retomando após {checkpoint['blocos']} bloco(s), linha {skip_rows}")
+
+    def produce(skip_rows=0):
+        if PARSE_WORKERS > 1:
+            # 🔹 Faixas de bytes do CSV lidas e tratadas em processos próprios
+            yield from parse_parallel(zip_path, member, chunk_size, CSV_READ_OPTIONS, transform_chunk, skip_rows=skip_rows)
+            return
+        for chunk in metrics.timed_iter(stream_csv(zip_path, member, chunk_size, skip_rows), "leitura", rows="lidos"):
+            with metrics.phase("transformacao"):
+                chunk = transform_chunk(chunk)
+            yield chunk
+
+    # 🔹 ZIP idêntico ao de uma execução anterior: os blocos tratados vêm do cache Parquet
+    chunks = cached_chunks(zip_path, member, chunk_size, produce, skip_rows)
+    total = insert_stream(chunks, data_ingestao, table, cdc, checkpoint)
+    return {"arquivo": zip_path, "membro": member, "registros": total,
+            "segundos": time.perf_counter() - start, "metricas": metrics.snapshot()}
+
+# 📌 1️⃣2️⃣ Entradas da etapa para a memorização do main.py: conteúdo de cada ZIP e os membros lidos
+def fingerprint_inputs(conn, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    zips = zip_inputs(ZIP_PATTERN, MEMBER_PATTERN) if STREAMING else zip_inputs(ZIP_FILE)
+    return {"zips": zips, "modo": load_mode_label((load_mode or LOAD_MODE) == "staging", cdc)}
+
+# 📌 1️⃣3️⃣ Executar o processo de ingestão
+def main(load_mode=None, cdc=None):
+    if STREAMING:
+        shards = discover_shards(ZIP_PATTERN, MEMBER_PATTERN)
+        staging = (load_mode or LOAD_MODE) == "staging"
+        cdc = CDC_ENABLED if cdc is None else cdc
+
+        # 🔹 Todos os shards entram no mesmo snapshot; a partição (ou staging) é criada uma única vez
+        conn = connect_db(bulk=True)
+        try:
+            # 🔹 Snapshot interrompido com os mesmos arquivos: continua de onde parou, com a mesma data
+            resumed = None
+            if CHECKPOINT_ENABLED:
+                ensure_checkpoint_table(conn)
+                resumed = find_resumable(conn, TABLE, shards, staging, cdc)
+            data_ingestao = resumed or datetime.now()
+
+            if cdc:
+                ensure_cdc(conn, TABLE, KEY_COLUMNS)
+                if resumed is None:
+                    begin_snapshot(conn, TABLE)
+                conn.commit()
+            if staging:
+                table = staging_table_name(TABLE, data_ingestao) if resumed else create_staging_table(conn, TABLE, data_ingestao)
+            else:
+                create_partition(conn, data_ingestao)
+                table = TABLE
+            if CHECKPOINT_ENABLED and resumed is None:
+                register_shards(conn, TABLE, data_ingestao, shards, staging, cdc)
+            conn.commit()
+
+            print(f"📥 Ingerindo {len(shards)} shard(s) com {BRONZE_WORKERS} worker(s) em blocos de {CHUNK_SIZE} linhas...")
+            results = run_shards(ingest_shard, shards, BRONZE_WORKERS, data_ingestao, CHUNK_SIZE, table, cdc)
+            for result in results:
+                metrics.merge(result["metricas"])
+
+            if cdc:
+                # 🔹 Exclusões só podem ser calculadas depois de todos os shards
+                with metrics.phase("banco"):
+                    counts = finish_snapshot(conn, TABLE, table, KEY_COLUMNS, "data_ingestao", data_ingestao)
+                metrics.add_rows("gravados", counts["D"])
+                print_counts(TABLE, counts)
+            if CHECKPOINT_ENABLED:
+                finish_checkpoints(conn, TABLE, data_ingestao)
+            if staging:
+                attach_staging_table(conn, TABLE, table, "data_ingestao", PRIMARY_KEY, data_ingestao, dedupe=False)
+            conn.commit()
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_db(conn)
 
-# 📌 6️⃣ Executar o processo de ingestão
-def main():
     print("📂 Extraindo arquivo ZIP...")
     csv_file = extract_csv(ZIP_FILE, EXTRACT_PATH, EXPECTED_CSV)
 
     print(f"📥 Lendo o arquivo CSV extraído: {csv_file}")
-    df = pd.read_csv(csv_file, sep=";", header=None, dtype=str, encoding="latin1")
-    df.columns = ["cnpj", "razao_social", "natureza_juridica", "qualificacao_responsavel", "capital_social", "cod_porte", "ignore"]
-    df.drop(columns=["ignore"], inplace=True)
-    df["capital_social"] = df["capital_social"].str.replace(",", ".").astype(float)
-    df = df.applymap(clean_text)
+    with metrics.phase("leitura"):
+        df = pd.read_csv(csv_file, sep=";", header=None, names=CSV_COLUMNS, dtype=CSV_DTYPES, encoding="latin1")
+    metrics.add_rows("lidos", len(df))
+    with metrics.phase("transformacao"):
+        df = transform_chunk(df)
 
     print(f"📊 Processando {len(df)} registros para ingestão...")
     insert_data(df)
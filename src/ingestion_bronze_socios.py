@@ -1,26 +1,63 @@
-import psycopg2
-from psycopg2 import sql
 import pandas as pd
-from psycopg2.extras import execute_values
 from datetime import datetime
-from tqdm import tqdm 
+from cache import cached_chunks
+from checkpoints import (CHECKPOINT_ENABLED, ensure_checkpoint_table, find_resumable, register_shards,
+                         get_checkpoint, save_checkpoint, finish_checkpoints, load_mode_label)
+from cdc import CDC_ENABLED, ensure_cdc, begin_snapshot, stage_dataframe, apply_changes, finish_snapshot, print_counts
+from database import connect_db, release_db, copy_dataframe
+from dedup import (DEDUP_MODE, DEDUP_PARTITIONS, partition_name, create_spill_dir, remove_spill_dir,
+                   spill_chunks, dedupe_partition, print_dedup_report)
+from partitions import LOAD_MODE, create_staging_table, staging_table_name, attach_staging_table
+from shards import discover_shards, run_shards
+from fingerprints import zip_inputs
+from parallel_csv import PARSE_WORKERS, parse_parallel
+import metrics
+from writers import ParallelWriter
+from transform import STRING_DTYPE, clean_text_columns, clean_printable_ascii
 import re
 import zipfile
+from collections import deque
+from functools import partial
+import time
 import os
 
-# 🔹 Configurações do banco de dados
-DB_CONFIG = {
-    "host": "localhost",
-    "port": "5432",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "has2582"
-}
-
 # Caminho relativo ou variável de ambiente para o arquivo ZIP
 ZIP_FILE = os.getenv('ZIP_FILE', '/app/stone/data/Socios.zip')  # A variável de ambiente pode ser configurada no Docker
 EXTRACT_PATH = os.getenv('EXTRACT_PATH', '/app/stone/temp')  # Pasta temporária para extração no contêiner
 EXPECTED_CSV = "K3241.K03200Y1.D50111.SOCIOCSV"  # Nome do CSV dentro do ZIP
+STREAMING = os.getenv('BRONZE_STREAMING', '1') == '1'  # Lê o CSV direto do ZIP em blocos
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '500000'))  # Linhas por bloco no modo streaming
+# 🔹 O release mensal vem dividido em Socios0.zip ... Socios9.zip e o nome do membro muda todo mês
+ZIP_PATTERN = os.getenv('SOCIOS_ZIP_PATTERN', os.getenv('ZIP_FILE', '/app/stone/data/Socios*.zip'))
+MEMBER_PATTERN = os.getenv('SOCIOS_MEMBER_PATTERN', r'.*\.SOCIOCSV$')
+BRONZE_WORKERS = int(os.getenv('BRONZE_WORKERS', '4'))  # Shards ingeridos em paralelo
+BRONZE_WRITERS = int(os.getenv('BRONZE_WRITERS', '1'))  # 🔹 Conexões gravando em paralelo dentro de cada shard
+
+TABLE = "bronze.socios"
+PRIMARY_KEY = ["cnpj", "documento_socio", "data_ingestao"]
+KEY_COLUMNS = ["cnpj", "documento_socio"]  # 🔹 Chave do CDC entre snapshots
+
+CSV_COLUMNS = ["cnpj", "tipo_socio", "nome_socio", "documento_socio",
+               "codigo_qualificacao_socio", "data_entrada_sociedade", "faixa_etaria",
+               "pais", "representante_legal", "nome_representante", "qualificacao_representante"]
+
+# 🔹 Tipos na leitura: texto em Arrow e códigos repetidos como categoria (mantendo o texto
+#    original, já que as colunas de qualificação são VARCHAR na Bronze)
+CSV_DTYPES = {
+    "cnpj": STRING_DTYPE,
+    "tipo_socio": "category",
+    "nome_socio": STRING_DTYPE,
+    "documento_socio": STRING_DTYPE,
+    "codigo_qualificacao_socio": "category",
+    "data_entrada_sociedade": STRING_DTYPE,  # 🔹 AAAAMMDD: convertido no transform_chunk
+    "faixa_etaria": "category",
+    "pais": "category",
+    "representante_legal": STRING_DTYPE,
+    "nome_representante": STRING_DTYPE,
+    "qualificacao_representante": "category",
+}
+# 🔹 Mesmas opções na leitura sequencial (stream_csv) e no parse paralelo (parallel_csv)
+CSV_READ_OPTIONS = {"sep": ";", "header": None, "names": CSV_COLUMNS, "dtype": CSV_DTYPES, "encoding": "latin1"}
 
 # 📌 1️⃣ Função para extrair o CSV do ZIP
 def extract_csv(zip_path, extract_to, expected_file):
@@ -35,13 +72,18 @@ def extract_csv(zip_path, extract_to, expected_file):
         else:
             raise FileNotFoundError(f"❌ Arquivo esperado ({expected_file}) não encontrado no ZIP.")
 
-# 📌 2️⃣ Conectar ao banco de dados
-def connect_db():
-    try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Erro na conexão: {e}")
-        return None
+# 📌 2️⃣ Ler o CSV direto do ZIP em blocos, sem arquivo temporário
+def stream_csv(zip_path, expected_file, chunk_size, skip_rows=0):
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        if expected_file not in zip_ref.namelist():
+            raise FileNotFoundError(f"❌ Arquivo esperado ({expected_file}) não encontrado no ZIP.")
+
+        with zip_ref.open(expected_file) as raw:
+            # 🔹 O pandas decodifica o latin1 de forma incremental a cada bloco lido
+            reader = pd.read_csv(raw, **CSV_READ_OPTIONS, chunksize=chunk_size,
+                                 skiprows=skip_rows or None)  # 🔹 Linhas já gravadas numa carga interrompida
+            for chunk in reader:
+                yield chunk
 
 # 📌 3️⃣ Criar partição
 def create_partition(conn, data_ingestao):
@@ -62,7 +104,8 @@ def create_partition(conn, data_ingestao):
         print(f"✅ Partição {partition_name} criada/verificada.")
     except Exception as e:
         conn.rollback()
-        print(f"⚠️ Erro ao criar partição: {e}")
+        print(f"❌ Erro ao criar partição: {e}")
+        raise  # 🔹 Sem a partição a carga falharia depois, com um erro menos claro
     finally:
         cursor.close()
 
@@ -70,60 +113,278 @@ def create_partition(conn, data_ingestao):
 def clean_text(value):
     return re.sub(r'[^\x20-\x7E]', '', value).strip() if isinstance(value, str) else value
 
-# 📌 5️⃣ Inserir dados
+# 📌 5️⃣ Tratar um bloco lido do CSV
+def transform_chunk(df):
+    df.columns = CSV_COLUMNS
+    df["data_entrada_sociedade"] = pd.to_datetime(df["data_entrada_sociedade"], format='%Y%m%d', errors='coerce')
+    return clean_text_columns(df, clean_printable_ascii)  # 🔹 Versão vetorizada de applymap(clean_text)
+
+# 📌 6️⃣ Copiar um bloco para a Bronze usando uma conexão já aberta
+def load_chunk(conn, df, data_ingestao, table=TABLE, cdc=False):
+    columns = ["cnpj", "tipo_socio", "nome_socio", "documento_socio",
+               "codigo_qualificacao_socio", "data_entrada_sociedade",
+               "faixa_etaria", "pais", "representante_legal",
+               "nome_representante", "qualificacao_representante", "data_ingestao"]
+    received = len(df)
+    # 🔹 Duplicatas entre blocos caem no ON CONFLICT, mantendo sempre a primeira ocorrência
+    df = df.drop_duplicates(subset=['cnpj', 'documento_socio'])
+    df = df.assign(data_ingestao=data_ingestao)
+    with metrics.phase("banco"):
+        if cdc:
+            # 🔹 Só as linhas novas ou alteradas em relação ao snapshot anterior são gravadas
+            source = stage_dataframe(conn, TABLE, columns, df, desc="📥 Inserindo dados na Bronze")
+            counts = apply_changes(conn, source, TABLE, table, KEY_COLUMNS, columns, "data_ingestao", snapshot=True)
+            metrics.add_rows("gravados", counts["I"] + counts["U"])
+            metrics.add_rows("rejeitados", received - len(df))
+            return counts["I"] + counts["U"]
+        # 🔹 Na staging não há PK: as duplicatas são removidas antes do ATTACH
+        conflict_columns = PRIMARY_KEY if table == TABLE else None
+        total = copy_dataframe(conn, table, columns, df, conflict_columns=conflict_columns,
+                               desc="📥 Inserindo dados na Bronze")
+    metrics.add_rows("gravados", total)
+    metrics.add_rows("rejeitados", received - total)  # 🔹 Duplicadas no bloco ou já gravadas
+    return total
+
+# 📌 7️⃣ Inserir dados via COPY
 def insert_data(df):
-    conn = connect_db()
-    if conn is None:
-        return
+    conn = connect_db(bulk=True)
 
-    create_partition(conn, datetime.now())
-    cursor = conn.cursor()
-    insert_query = """
-        INSERT INTO bronze.socios (cnpj, tipo_socio, nome_socio, documento_socio, 
-                                  codigo_qualificacao_socio, data_entrada_sociedade, 
-                                  faixa_etaria, pais, representante_legal, 
-                                  nome_representante, qualificacao_representante, data_ingestao)
-        VALUES %s
-        ON CONFLICT (cnpj, documento_socio, data_ingestao) DO NOTHING;
-    """
+    data_ingestao = datetime.now()
+    create_partition(conn, data_ingestao)
 
     try:
-        df = df.drop_duplicates(subset=['cnpj', 'documento_socio'])
-        values = [
-            (
-                row['cnpj'], row['tipo_socio'], row['nome_socio'], row['documento_socio'],
-                row['codigo_qualificacao_socio'], row['data_entrada_sociedade'], row['faixa_etaria'],
-                row['pais'], row['representante_legal'], row['nome_representante'],
-                row['qualificacao_representante'], datetime.now()
-            )
-            for _, row in df.iterrows()
-        ]
-        
-        for i in tqdm(range(0, len(values), 10000), desc="📥 Inserindo dados na Bronze", unit=" registros"):
-            batch = values[i:i+10000]
-            execute_values(cursor, insert_query, batch)
-            conn.commit()
-        
+        load_chunk(conn, df, data_ingestao)
+        conn.commit()
         print("✅ Dados inseridos na Bronze!")
     except Exception as e:
         conn.rollback()
         print(f"❌ Erro ao inserir dados: {e}")
+        raise
     finally:
-        cursor.close()
-        conn.close()
+        release_db(conn)
+
+# 📌 8️⃣ Inserir os blocos já tratados; com checkpoint, cada bloco é um commit
+def insert_stream(chunks, data_ingestao=None, table=TABLE, cdc=False, checkpoint=None):
+    conn = connect_db(bulk=True)
+
+    if data_ingestao is None:
+        data_ingestao = datetime.now()
+        create_partition(conn, data_ingestao)
+    total = 0
+
+    try:
+        if BRONZE_WRITERS > 1:
+            total = insert_parallel(conn, chunks, data_ingestao, table, cdc, checkpoint)
+        else:
+            for chunk in chunks:
+                rows = len(chunk)
+                written = load_chunk(conn, chunk, data_ingestao, table, cdc)
+                total += written
+                if checkpoint is not None:
+                    # 🔹 Bloco e checkpoint no mesmo commit: numa retomada nada é gravado duas vezes
+                    advance_checkpoint(conn, checkpoint, rows, written)
+        if checkpoint is not None:
+            checkpoint["concluido"] = True
+            save_checkpoint(conn, checkpoint)
+        conn.commit()
+        print(f"✅ {total} registros inseridos na Bronze!")
+        return total
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erro ao inserir dados: {e}")
+        raise
+    finally:
+        release_db(conn)
+
+# 📌 9️⃣ Avançar o checkpoint do shard com um bloco gravado (com commit)
+def advance_checkpoint(conn, checkpoint, rows, written):
+    checkpoint.update(blocos=checkpoint["blocos"] + 1, linhas=checkpoint["linhas"] + rows,
+                      gravados=checkpoint["gravados"] + written)
+    save_checkpoint(conn, checkpoint)
+    conn.commit()
+
+# 📌 🔟 Inserir com writers paralelos: enquanto eles gravam um bloco, este processo já lê e trata o próximo
+def insert_parallel(conn, chunks, data_ingestao, table, cdc, checkpoint):
+    pending_rows = deque()  # 🔹 Linhas lidas de cada bloco enviado, na ordem das rodadas
+
+    def on_round(written):
+        # 🔹 Depois do commit de todos os writers: o checkpoint só anda com o bloco inteiro gravado
+        rows = pending_rows.popleft()
+        if checkpoint is not None:
+            advance_checkpoint(conn, checkpoint, rows, written)
+
+    load = lambda writer_conn, df: load_chunk(writer_conn, df, data_ingestao, table, cdc)
+    with ParallelWriter(load, BRONZE_WRITERS, commit_rounds=checkpoint is not None, on_round=on_round,
+                        name=f"{TABLE}-writer") as writer:
+        for chunk in chunks:
+            pending_rows.append(len(chunk))
+            writer.submit(chunk)
+        total = writer.join()
+        writer.commit()
+    return total
+
+# 📌 1️⃣1️⃣ Ler e tratar os blocos de um shard (ZIP + membro)
+def read_chunks(zip_path, member, chunk_size, skip_rows=0):
+    if PARSE_WORKERS > 1:
+        # 🔹 Faixas de bytes do CSV lidas e tratadas em processos próprios
+        yield from parse_parallel(zip_path, member, chunk_size, CSV_READ_OPTIONS, transform_chunk, skip_rows=skip_rows)
+        return
+    for chunk in metrics.timed_iter(stream_csv(zip_path, member, chunk_size, skip_rows), "leitura", rows="lidos"):
+        with metrics.phase("transformacao"):
+            chunk = transform_chunk(chunk)
+        yield chunk
+
+# 📌 1️⃣2️⃣ Ingerir um shard (ZIP + membro) com conexão própria, dentro do processo worker
+def ingest_shard(zip_path, member, data_ingestao, chunk_size, table=TABLE, cdc=False):
+    start = time.perf_counter()
+    metrics.start()  # 🔹 Métricas do shard, somadas às da etapa no processo principal
+
+    checkpoint = None
+    if CHECKPOINT_ENABLED:
+        conn = connect_db()
+        try:
+            checkpoint = get_checkpoint(conn, TABLE, data_ingestao, zip_path, member)
+        finally:
+            release_db(conn)
+    skip_rows = checkpoint["linhas"] if checkpoint is not None else 0
+    if checkpoint is not None and checkpoint["concluido"]:
+        print(f"⏭️ {os.path.basename(zip_path)}/{member} já carregado neste snapshot ({checkpoint['gravados']} registros)")
+        return {"arquivo": zip_path, "membro": member, "registros": 0,
+                "segundos": time.perf_counter() - start, "metricas": metrics.snapshot()}
+    if skip_rows:
+        print(f"⏯️ {os.path.basename(zip_path)}/{member}: retomando após {checkpoint['blocos']} bloco(s), linha {skip_rows}")
+
+    # 🔹 ZIP idêntico ao de uma execução anterior: os blocos tratados vêm do cache Parquet
+    chunks = cached_chunks(zip_path, member, chunk_size, partial(read_chunks, zip_path, member, chunk_size), skip_rows)
+    total = insert_stream(chunks, data_ingestao, table, cdc, checkpoint)
+    return {"arquivo": zip_path, "membro": member, "registros": total,
+            "segundos": time.perf_counter() - start, "metricas": metrics.snapshot()}
+
+# 📌 1️⃣3️⃣ Deduplicação em disco: espalhar um shard em arquivos por partição de CNPJ
+def spill_shard(zip_path, member, spill_dir, chunk_size, order):
+    start = time.perf_counter()
+    metrics.start()
+
+    chunks = cached_chunks(zip_path, member, chunk_size, partial(read_chunks, zip_path, member, chunk_size))
+    # 🔹 Arquivo numerado pela posição do shard: a partição é lida na mesma ordem da carga normal
+    rows = spill_chunks(chunks, spill_dir, f"{order[(zip_path, member)]:05d}")
+    return {"arquivo": zip_path, "membro": member, "registros": sum(rows),
+            "segundos": time.perf_counter() - start, "metricas": metrics.snapshot()}
+
+# 📌 1️⃣4️⃣ Deduplicar uma partição (primeira ocorrência de cada chave) e gravá-la na Bronze
+def load_partition(spill_dir, name, data_ingestao, chunk_size, table=TABLE, cdc=False):
+    start = time.perf_counter()
+    metrics.start()
+
+    df, duplicates = dedupe_partition(spill_dir, name, KEY_COLUMNS)
+    total = 0
+    if df is not None and len(df):
+        print(f"🧹 Partição {name}: {duplicates} duplicata(s) removida(s), {len(df)} registros para gravar")
+        chunks = (df.iloc[begin:begin + chunk_size] for begin in range(0, len(df), chunk_size))
+        total = insert_stream(chunks, data_ingestao, table, cdc)
+    return {"arquivo": spill_dir, "membro": name, "registros": total,
+            "segundos": time.perf_counter() - start, "metricas": metrics.snapshot()}
+
+# 📌 1️⃣5️⃣ Deduplicação em disco do snapshot: espalhar todos os shards e gravar partição por partição
+def ingest_spilled(shards, data_ingestao, table, cdc):
+    """
+    Sem a tabela inteira na memória: os shards são espalhados em DEDUP_PARTITIONS
+    partições por hash do CNPJ e cada partição (que cabe na memória) é deduplicada
+    e gravada por um worker. Vale a primeira ocorrência na ordem dos shards, como
+    no drop_duplicates sobre o arquivo inteiro.
+    """
+    spill_dir = create_spill_dir(f"socios_{data_ingestao.strftime('%Y%m%d_%H%M%S')}")
+    try:
+        order = {shard: index for index, shard in enumerate(shards)}
+        print(f"💽 Espalhando {len(shards)} shard(s) em {DEDUP_PARTITIONS} partições por CNPJ ({spill_dir})...")
+        spilled = run_shards(spill_shard, shards, BRONZE_WORKERS, spill_dir, CHUNK_SIZE, order)
+
+        partitions = [(spill_dir, partition_name(index)) for index in range(DEDUP_PARTITIONS)]
+        print(f"🧹 Deduplicando e gravando {DEDUP_PARTITIONS} partições com {BRONZE_WORKERS} worker(s)...")
+        loaded = run_shards(load_partition, partitions, BRONZE_WORKERS, data_ingestao, CHUNK_SIZE, table, cdc)
+    finally:
+        remove_spill_dir(spill_dir)
+
+    print_dedup_report([partition for result in loaded for partition in result["metricas"]["particoes"]])
+    return spilled + loaded
+
+# 📌 1️⃣6️⃣ Entradas da etapa para a memorização do main.py: conteúdo de cada ZIP e os membros lidos
+def fingerprint_inputs(conn, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    zips = zip_inputs(ZIP_PATTERN, MEMBER_PATTERN) if STREAMING else zip_inputs(ZIP_FILE)
+    return {"zips": zips, "modo": load_mode_label((load_mode or LOAD_MODE) == "staging", cdc)}
+
+# 📌 1️⃣7️⃣ Executar ingestão
+def main(load_mode=None, cdc=None):
+    if STREAMING:
+        shards = discover_shards(ZIP_PATTERN, MEMBER_PATTERN)
+        staging = (load_mode or LOAD_MODE) == "staging"
+        cdc = CDC_ENABLED if cdc is None else cdc
+        spill = DEDUP_MODE == "spill"
+        # 🔹 Os arquivos de spill não sobrevivem à execução: sem retomada por shard
+        checkpointing = CHECKPOINT_ENABLED and not spill
+        if spill and CHECKPOINT_ENABLED:
+            print("⚠️ SOCIOS_DEDUP=spill: retomada por checkpoint desativada nesta carga")
+
+        # 🔹 Todos os shards entram no mesmo snapshot; a partição (ou staging) é criada uma única vez
+        conn = connect_db(bulk=True)
+        try:
+            # 🔹 Snapshot interrompido com os mesmos arquivos: continua de onde parou, com a mesma data
+            resumed = None
+            if checkpointing:
+                ensure_checkpoint_table(conn)
+                resumed = find_resumable(conn, TABLE, shards, staging, cdc)
+            data_ingestao = resumed or datetime.now()
+
+            if cdc:
+                ensure_cdc(conn, TABLE, KEY_COLUMNS)
+                if resumed is None:
+                    begin_snapshot(conn, TABLE)
+                conn.commit()
+            if staging:
+                table = staging_table_name(TABLE, data_ingestao) if resumed else create_staging_table(conn, TABLE, data_ingestao)
+            else:
+                create_partition(conn, data_ingestao)
+                table = TABLE
+            if checkpointing and resumed is None:
+                register_shards(conn, TABLE, data_ingestao, shards, staging, cdc)
+            conn.commit()
+
+            if spill:
+                results = ingest_spilled(shards, data_ingestao, table, cdc)
+            else:
+                print(f"📥 Ingerindo {len(shards)} shard(s) com {BRONZE_WORKERS} worker(s) em blocos de {CHUNK_SIZE} linhas...")
+                results = run_shards(ingest_shard, shards, BRONZE_WORKERS, data_ingestao, CHUNK_SIZE, table, cdc)
+            for result in results:
+                metrics.merge(result["metricas"])
+
+            if cdc:
+                # 🔹 Exclusões só podem ser calculadas depois de todos os shards
+                with metrics.phase("banco"):
+                    counts = finish_snapshot(conn, TABLE, table, KEY_COLUMNS, "data_ingestao", data_ingestao)
+                metrics.add_rows("gravados", counts["D"])
+                print_counts(TABLE, counts)
+            if checkpointing:
+                finish_checkpoints(conn, TABLE, data_ingestao)
+            if staging:
+                attach_staging_table(conn, TABLE, table, "data_ingestao", PRIMARY_KEY, data_ingestao, dedupe=True)
+            conn.commit()
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_db(conn)
 
-# 📌 6️⃣ Executar ingestão
-def main():
     print("📂 Extraindo arquivo ZIP...")
     csv_file = extract_csv(ZIP_FILE, EXTRACT_PATH, EXPECTED_CSV)
 
     print(f"📥 Lendo o arquivo CSV extraído: {csv_file}")
-    df = pd.read_csv(csv_file, sep=";", header=None, dtype=str, encoding="latin1")
-    df.columns = ["cnpj", "tipo_socio", "nome_socio", "documento_socio",
-                  "codigo_qualificacao_socio", "data_entrada_sociedade", "faixa_etaria",
-                  "pais", "representante_legal", "nome_representante", "qualificacao_representante"]
-    df["data_entrada_sociedade"] = pd.to_datetime(df["data_entrada_sociedade"], errors='coerce')
-    df = df.applymap(clean_text)
+    with metrics.phase("leitura"):
+        df = pd.read_csv(csv_file, sep=";", header=None, names=CSV_COLUMNS, dtype=CSV_DTYPES, encoding="latin1")
+    metrics.add_rows("lidos", len(df))
+    with metrics.phase("transformacao"):
+        df = transform_chunk(df)
 
     print(f"📊 Processando {len(df)} registros para ingestão...")
     insert_data(df)
@@ -1,27 +1,32 @@
-import psycopg2
+import argparse
+import itertools
+import os
 import pandas as pd
-from psycopg2.extras import execute_values
 from datetime import datetime
-from tqdm import tqdm 
-
-# 🔹 Configuração do banco de dados
-DB_CONFIG = {
-    "host": "localhost",
-    "port": "5432",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "has2582"
-}
-
-# 📌 1️⃣ Conectar ao banco de dados
-def connect_db():
-    try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Erro na conexão: {e}")
-        return None
+from database import (connect_db, release_db, copy_dataframe, stream_query,
+                      ensure_watermark_table, get_watermark, set_watermark)
+from cdc import CDC_ENABLED
+from ingestion_silver_empresas import PORTE_DESCRICAO
+from history import compact_silver
+from fingerprints import table_inputs
+from dimensions import DIMENSIONS, PAIS_BRASIL
+import metrics
+from partitions import LOAD_MODE, create_staging_table, attach_staging_table
+
+# 🔹 Watermarks da Gold: último snapshot de cada tabela Silver já agregado
+WATERMARK_EMPRESAS = "gold.empresas:silver.empresas"
+WATERMARK_SOCIOS = "gold.empresas:silver.socios"
 
-# 📌 2️⃣ Criar partição dinamicamente antes da inserção
+TABLE = "gold.empresas"
+PRIMARY_KEY = ["cnpj", "data_analise"]
+# 🔹 Canal do NOTIFY enviado a cada carga da Gold (a API de consulta limpa o cache ao recebê-lo)
+NOTIFY_CHANNEL = "gold_empresas_snapshot"
+GOLD_STREAMING = os.getenv('GOLD_STREAMING', '1') == '1'  # 🔹 Lê a Silver em blocos (cursor no servidor)
+# 🔹 'silver': compara os snapshots da Silver; 'historico': lê o estado atual das tabelas
+#    de histórico (SCD tipo 2, src/history.py), compactadas antes de cada agregação
+GOLD_SOURCE = os.getenv('GOLD_SOURCE', 'silver')
+
+# 📌 1️⃣ Criar partição dinamicamente antes da inserção
 def create_partition(conn, data_analise):
     cursor = conn.cursor()
     partition_name = f"empresas_{data_analise.strftime('%Y_%m')}"
@@ -40,93 +45,366 @@ def create_partition(conn, data_analise):
         print(f"✅ Partição {partition_name} criada/verificada.")
     except Exception as e:
         conn.rollback()
-        print(f"⚠️ Erro ao criar partição: {e}")
+        print(f"❌ Erro ao criar partição: {e}")
+        raise  # 🔹 Sem a partição a carga falharia depois, com um erro menos claro
+    finally:
+        cursor.close()
+
+# 📌 2️⃣ Garantir a coluna doc_alvo e o índice de consulta em bases criadas antes deles
+def ensure_gold_columns(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("ALTER TABLE gold.empresas ADD COLUMN IF NOT EXISTS doc_alvo BOOLEAN;")
+        # 🔹 Registro mais recente de um CNPJ com index-only scan (API de consulta, src/api.py)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS empresas_cnpj_recente ON gold.empresas (cnpj, data_analise DESC)
+            INCLUDE (razao_social, capital_social, total_socios, flag_socio_estrangeiro, doc_alvo);
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+# 📌 3️⃣ Identificar os snapshots da Silver (último e último já agregado)
+def get_snapshots(conn, full_refresh=False):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(data_processamento) FROM silver.empresas;")
+        empresas_atual = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(data_processamento) FROM silver.socios;")
+        socios_atual = cursor.fetchone()[0]
     finally:
         cursor.close()
 
-# 📌 3️⃣ Extrair dados da Silver
-def extract_from_silver():
+    return {
+        "empresas_atual": empresas_atual,
+        "socios_atual": socios_atual,
+        "empresas_anterior": None if full_refresh else get_watermark(conn, WATERMARK_EMPRESAS),
+        "socios_anterior": None if full_refresh else get_watermark(conn, WATERMARK_SOCIOS),
+    }
+
+# 🔹 Sócio estrangeiro: país diferente do Brasil na dimensão de países (id smallint, sem comparar texto)
+BRASIL_ID_SQL = f"(SELECT id FROM {DIMENSIONS['paises']['table']} WHERE codigo = '{PAIS_BRASIL}')"
+
+# 🔹 CNPJs que saíram da Silver desde o watermark: entram entre os alterados, mas não geram
+#    linha agregada; a carga apaga da Gold o que eles tinham (remove_cnpjs)
+CDC_REMOVED_SQL = """
+    SELECT cnpj FROM (
+        SELECT DISTINCT ON (cnpj) cnpj, operacao FROM silver.empresas
+        WHERE %(empresas_anterior)s::timestamp IS NULL OR data_processamento > %(empresas_anterior)s
+        ORDER BY cnpj, data_processamento DESC
+    ) ultimas
+    WHERE operacao = 'D'
+"""  # 🔹 Versão mais recente da empresa é uma exclusão ('D')
+
+SNAPSHOT_REMOVED_SQL = """
+    SELECT cnpj FROM silver.empresas WHERE data_processamento = %(empresas_anterior)s
+    EXCEPT
+    SELECT cnpj FROM silver.empresas WHERE data_processamento = %(empresas_atual)s
+"""  # 🔹 Estava no snapshot anterior e não está no atual
+
+HISTORICO_REMOVED_SQL = """
+    SELECT cnpj FROM silver.empresas_historico
+    WHERE %(empresas_anterior)s::timestamp IS NULL OR valid_to > %(empresas_anterior)s
+    EXCEPT
+    SELECT cnpj FROM silver.empresas_historico WHERE valid_to IS NULL
+"""  # 🔹 Versão fechada depois do watermark sem versão aberta que a substitua
+
+# 🔹 No CDC a Silver só tem mudanças: o estado atual é a versão mais recente de cada
+#    chave, e os CNPJs alterados são os que receberam alguma linha desde o watermark
+#    (as exclusões 'D' incluídas: o CNPJ removido entra aqui e sai no filtro final)
+CDC_QUERY = f"""
+    WITH cnpjs_alterados AS (
+        SELECT cnpj FROM silver.empresas
+        WHERE %(empresas_anterior)s::timestamp IS NULL OR data_processamento > %(empresas_anterior)s
+        UNION
+        SELECT cnpj FROM silver.socios
+        WHERE %(socios_anterior)s::timestamp IS NULL OR data_processamento > %(socios_anterior)s
+    ),
+    empresas_atuais AS (
+        SELECT DISTINCT ON (e.cnpj) e.*
+        FROM silver.empresas e JOIN cnpjs_alterados c ON c.cnpj = e.cnpj
+        ORDER BY e.cnpj, e.data_processamento DESC
+    ),
+    socios_atuais AS (
+        SELECT DISTINCT ON (s.cnpj, s.documento_socio) s.*
+        FROM silver.socios s JOIN cnpjs_alterados c ON c.cnpj = s.cnpj
+        ORDER BY s.cnpj, s.documento_socio, s.data_processamento DESC
+    )
+    SELECT e.cnpj, e.razao_social, e.capital_social, e.porte_descricao,
+           COUNT(s.cnpj) AS total_socios,
+           BOOL_OR(s.pais_id <> {BRASIL_ID_SQL}) AS flag_socio_estrangeiro
+    FROM empresas_atuais e
+    LEFT JOIN socios_atuais s ON s.cnpj = e.cnpj AND s.operacao IS DISTINCT FROM 'D'
+    WHERE e.operacao IS DISTINCT FROM 'D'
+    GROUP BY e.cnpj, e.razao_social, e.capital_social, e.porte_descricao;
+"""
+
+# 🔹 Um CNPJ muda quando a empresa difere do snapshot anterior ou quando o
+#    conjunto de sócios (documento e país) ganha, perde ou altera alguém
+SNAPSHOT_QUERY = f"""
+    WITH empresas_alteradas AS (
+        SELECT cnpj, razao_social, capital_social, porte_descricao
+        FROM silver.empresas WHERE data_processamento = %(empresas_atual)s
+        EXCEPT
+        SELECT cnpj, razao_social, capital_social, porte_descricao
+        FROM silver.empresas WHERE data_processamento = %(empresas_anterior)s
+    ),
+    socios_atual AS (
+        SELECT cnpj, documento_socio, pais_id
+        FROM silver.socios WHERE data_processamento = %(socios_atual)s
+    ),
+    socios_anterior AS (
+        SELECT cnpj, documento_socio, pais_id
+        FROM silver.socios WHERE data_processamento = %(socios_anterior)s
+    ),
+    cnpjs_alterados AS (
+        SELECT cnpj FROM empresas_alteradas
+        UNION
+        SELECT cnpj FROM (SELECT * FROM socios_atual EXCEPT SELECT * FROM socios_anterior) novos
+        UNION
+        SELECT cnpj FROM (SELECT * FROM socios_anterior EXCEPT SELECT * FROM socios_atual) removidos
+        UNION
+        SELECT cnpj FROM ({SNAPSHOT_REMOVED_SQL}) empresas_removidas
+    )
+    SELECT e.cnpj, e.razao_social, e.capital_social, e.porte_descricao,
+           COUNT(s.cnpj) AS total_socios,
+           BOOL_OR(s.pais_id <> {BRASIL_ID_SQL}) AS flag_socio_estrangeiro
+    FROM silver.empresas e
+    JOIN cnpjs_alterados c ON c.cnpj = e.cnpj
+    LEFT JOIN socios_atual s ON s.cnpj = e.cnpj
+    WHERE e.data_processamento = %(empresas_atual)s
+    GROUP BY e.cnpj, e.razao_social, e.capital_social, e.porte_descricao;
+"""
+
+# 🔹 Sobre o histórico: o estado atual é `valid_to IS NULL` (índice parcial) e um CNPJ
+#    mudou se alguma versão dele abriu ou fechou depois do watermark. Vale para a Silver
+#    em CDC ou não; CNPJs com mudança em colunas que a Gold não usa também são reagregados
+HISTORICO_QUERY = f"""
+    WITH cnpjs_alterados AS (
+        SELECT cnpj FROM silver.empresas_historico
+        WHERE %(empresas_anterior)s::timestamp IS NULL
+           OR valid_from > %(empresas_anterior)s OR valid_to > %(empresas_anterior)s
+        UNION
+        SELECT cnpj FROM silver.socios_historico
+        WHERE %(socios_anterior)s::timestamp IS NULL
+           OR valid_from > %(socios_anterior)s OR valid_to > %(socios_anterior)s
+        UNION
+        SELECT cnpj FROM ({HISTORICO_REMOVED_SQL}) empresas_removidas
+    )
+    SELECT e.cnpj, e.razao_social, e.capital_social, e.porte_descricao,
+           COUNT(s.cnpj) AS total_socios,
+           BOOL_OR(s.pais_id <> {BRASIL_ID_SQL}) AS flag_socio_estrangeiro
+    FROM silver.empresas_historico e
+    JOIN cnpjs_alterados c ON c.cnpj = e.cnpj
+    LEFT JOIN silver.socios_historico s ON s.cnpj = e.cnpj AND s.valid_to IS NULL
+    WHERE e.valid_to IS NULL
+    GROUP BY e.cnpj, e.razao_social, e.capital_social, e.porte_descricao;
+"""
+
+def silver_query(cdc=False, source=None):
+    if (source or GOLD_SOURCE) == "historico":
+        return HISTORICO_QUERY
+    return CDC_QUERY if cdc else SNAPSHOT_QUERY
+
+def removed_query(cdc=False, source=None):
+    if (source or GOLD_SOURCE) == "historico":
+        return HISTORICO_REMOVED_SQL
+    return CDC_REMOVED_SQL if cdc else SNAPSHOT_REMOVED_SQL
+
+# 🔹 Com a Gold lendo o histórico, os snapshots novos da Silver entram nele antes
+def prepare_source(conn):
+    if GOLD_SOURCE == "historico":
+        compact_silver(conn)
+
+def print_snapshots(snapshots):
+    print(f"🔖 Snapshots Silver: empresas {snapshots['empresas_anterior']} -> {snapshots['empresas_atual']}, "
+          f"socios {snapshots['socios_anterior']} -> {snapshots['socios_atual']}")
+
+# 📌 4️⃣ Extrair da Silver apenas os CNPJs que mudaram no último snapshot
+def extract_from_silver(full_refresh=False, cdc=False):
     conn = connect_db()
-    if conn is None:
-        return None
-    
-    query = """
-        SELECT e.cnpj, e.razao_social, e.capital_social,
-               COUNT(s.cnpj) AS total_socios,
-               BOOL_OR(s.pais NOT IN ('BRASIL', 'BRA')) AS flag_socio_estrangeiro
-        FROM silver.empresas e
-        LEFT JOIN silver.socios s ON e.cnpj = s.cnpj
-        GROUP BY e.cnpj, e.razao_social, e.capital_social;
-    """
     
+    ensure_watermark_table(conn)
+    prepare_source(conn)
+    snapshots = get_snapshots(conn, full_refresh)
+    if snapshots["empresas_atual"] is None:
+        release_db(conn)
+        return None, snapshots
+
     try:
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return df
+        print_snapshots(snapshots)
+        df = pd.read_sql(silver_query(cdc), conn, params=snapshots)
+        print(f"🔎 {len(df)} CNPJs alterados desde a última agregação.")
+        return df, snapshots
     except Exception as e:
         print(f"❌ Erro ao extrair dados: {e}")
-        return None
+        raise
+    finally:
+        release_db(conn)
 
+# 🔹 Mesma consulta em blocos de STREAM_ITERSIZE linhas, numa conexão aberta pelo chamador
+def stream_from_silver(conn, snapshots, cdc=False):
+    print_snapshots(snapshots)
+    yield from stream_query(conn, silver_query(cdc), snapshots)
 
-# 📌 4️⃣ Transformar os dados
-def transform_data(df):
+# 📌 5️⃣ Transformar os dados
+def transform_data(df, data_analise=None):
     if df is None or df.empty:
         print("⚠️ Nenhum dado para processar!")
         return None
     
     print("🔄 Transformando os dados...")
     
-    df['data_analise'] = datetime.now()
+    df['data_analise'] = data_analise or datetime.now()  # 🔹 Mesma data em todos os blocos
     
     df['flag_socio_estrangeiro'] = df['flag_socio_estrangeiro'].fillna(False)
     
-
-    df['doc_alvo'] = (df['porte'] == '03') & (df['total_socios'] > 1)
+    # 🔹 Porte '03' chega na Silver já traduzido para a descrição
+    df['doc_alvo'] = (df['porte_descricao'] == PORTE_DESCRICAO['03']) & (df['total_socios'] > 1)
     
     return df
 
-# 📌 5️⃣ Carregar dados na Gold
-def load_to_gold(df):
-    conn = connect_db()
-    if conn is None:
-        return
-    
-    create_partition(conn, datetime.now())  
+# 📌 6️⃣ Registrar os snapshots agregados (sem commit: vai junto com a carga)
+def advance_watermarks(conn, snapshots):
+    set_watermark(conn, WATERMARK_EMPRESAS, snapshots["empresas_atual"])
+    if snapshots["socios_atual"] is not None:
+        set_watermark(conn, WATERMARK_SOCIOS, snapshots["socios_atual"])
+
+# 📌 7️⃣ Avisar quem consulta a Gold que há um snapshot novo (entregue só no commit)
+def notify_snapshot(conn, data_analise):
     cursor = conn.cursor()
-    insert_query = """
-        INSERT INTO gold.empresas (cnpj, razao_social, capital_social, total_socios, flag_socio_estrangeiro, data_analise)
-        VALUES %s
-        ON CONFLICT (cnpj, data_analise) DO NOTHING;
+    try:
+        cursor.execute("SELECT pg_notify(%s, %s);", (NOTIFY_CHANNEL, data_analise.isoformat()))
+    finally:
+        cursor.close()
+
+# 📌 8️⃣ Apagar da Gold os CNPJs que saíram da Silver (sem commit: vai junto com a carga)
+def remove_cnpjs(conn, snapshots, data_analise, cdc=False):
+    cursor = conn.cursor()
+    try:
+        if snapshots["empresas_anterior"] is None:
+            # 🔹 Carga completa: a data nova tem todos os CNPJs vivos, o resto saiu da Silver
+            cursor.execute("""
+                DELETE FROM gold.empresas g
+                WHERE NOT EXISTS (SELECT 1 FROM gold.empresas a WHERE a.cnpj = g.cnpj AND a.data_analise = %s);
+            """, (data_analise,))
+        else:
+            cursor.execute(f"DELETE FROM gold.empresas WHERE cnpj IN ({removed_query(cdc)});", snapshots)
+        if cursor.rowcount:
+            print(f"🗑️ {cursor.rowcount} registros de CNPJs removidos da Silver apagados da Gold")
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+# 📌 9️⃣ Carregar dados na Gold via COPY
+def load_to_gold(chunks, snapshots=None, load_mode=None, cdc=False):
+    """
+    Transforma e grava cada bloco da Silver conforme chega, numa única transação,
+    junto com o avanço dos watermarks e a remoção dos CNPJs que saíram da Silver
+    (o registro mais recente de um CNPJ na Gold é sempre de um CNPJ vivo). Sem
+    blocos, só os watermarks avançam e as remoções são aplicadas.
     """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None or first.empty:
+        print("⚠️ Nenhum CNPJ alterado: só os watermarks avançam.")
+        first = None
+
+    conn = connect_db(bulk=True)
+    
+    data_analise = datetime.now()
+    staging = first is not None and (load_mode or LOAD_MODE) == "staging"
+    if not staging:
+        create_partition(conn, data_analise)
+    ensure_gold_columns(conn)
+    columns = ["cnpj", "razao_social", "capital_social", "total_socios",
+               "flag_socio_estrangeiro", "doc_alvo", "data_analise"]
     
     try:
-        values = [
-            (
-                row['cnpj'], row['razao_social'], row['capital_social'],
-                row['total_socios'], row['flag_socio_estrangeiro'], row['data_analise']
-            )
-            for _, row in df.iterrows()
-        ]
-        
-        for i in tqdm(range(0, len(values), 10000), desc="📥 Inserindo dados na Gold", unit=" registros"):
-            batch = values[i:i+10000]
-            execute_values(cursor, insert_query, batch)
+        total = 0
+        # 🔹 COPY sem PK nem ON CONFLICT; índice e deduplicação uma única vez no ATTACH
+        table = create_staging_table(conn, TABLE, data_analise) if staging else TABLE
+        for df_silver in (itertools.chain([first], chunks) if first is not None else []):
+            with metrics.phase("transformacao"):
+                df = transform_data(df_silver, data_analise)
+            if df is None:
+                continue
+            with metrics.phase("banco"):
+                if staging:
+                    total += copy_dataframe(conn, table, columns, df, desc="📥 Inserindo dados na Gold")
+                else:
+                    written = copy_dataframe(conn, TABLE, columns, df, conflict_columns=PRIMARY_KEY,
+                                             desc="📥 Inserindo dados na Gold")
+                    metrics.add_rows("rejeitados", len(df) - written)  # 🔹 Já agregados nesta data (ON CONFLICT)
+                    total += written
+        with metrics.phase("banco"):
+            if staging:
+                attach_staging_table(conn, TABLE, table, "data_analise", PRIMARY_KEY, data_analise, dedupe=True)
+            removed = 0
+            if snapshots is not None:
+                removed = remove_cnpjs(conn, snapshots, data_analise, cdc)
+                advance_watermarks(conn, snapshots)
+            if total or removed:
+                notify_snapshot(conn, data_analise)
             conn.commit()
-        
-        print(f"✅ {len(df)} registros carregados na Gold!")
+        metrics.add_rows("gravados", total)
+        print(f"✅ {total} registros carregados na Gold!")
+        return total
     except Exception as e:
         conn.rollback()
         print(f"❌ Erro ao inserir dados na Gold: {e}")
+        raise
     finally:
-        cursor.close()
-        conn.close()
+        release_db(conn)
 
-# 📌 6️⃣ Executar ETL da Gold
-def main():
-    df_silver = extract_from_silver()
-    df_transformed = transform_data(df_silver)
-    if df_transformed is not None:
-        load_to_gold(df_transformed)
+# 🔹 Consulta pesada da etapa (junção Silver empresas x sócios), para o EXPLAIN do modo de diagnóstico
+def diagnostic_statements(conn, full_refresh=False, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    ensure_watermark_table(conn)
+    snapshots = get_snapshots(conn, full_refresh)
+    if snapshots["empresas_atual"] is None:
+        return []
+    return [("extracao_silver", silver_query(cdc), snapshots)]
+
+# 🔹 Entradas da etapa para a memorização do main.py: partições da Silver (o histórico sai delas)
+def fingerprint_inputs(conn, full_refresh=False, load_mode=None, cdc=None):
+    return {"silver_empresas": table_inputs(conn, "silver.empresas", "data_processamento"),
+            "silver_socios": table_inputs(conn, "silver.socios", "data_processamento"),
+            "cdc": CDC_ENABLED if cdc is None else cdc}
+
+# 📌 🔟 Executar ETL da Gold
+def main(full_refresh=False, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    if not GOLD_STREAMING:
+        with metrics.phase("leitura"):
+            df_silver, snapshots = extract_from_silver(full_refresh, cdc)
+        metrics.add_rows("lidos", len(df_silver) if df_silver is not None else 0)
+        if snapshots["empresas_atual"] is not None:
+            # 🔹 Mesmo sem CNPJs alterados o watermark avança para o snapshot atual
+            load_to_gold([df_silver] if df_silver is not None else [], snapshots, load_mode, cdc)
+        return
+
+    # 🔹 Um bloco por vez da Silver até a Gold: a conexão de leitura fica aberta durante a carga
+    conn = connect_db()
+    try:
+        ensure_watermark_table(conn)
+        prepare_source(conn)
+        snapshots = get_snapshots(conn, full_refresh)
+        if snapshots["empresas_atual"] is None:
+            print("⚠️ Nenhum dado para processar!")
+            return
+        chunks = metrics.timed_iter(stream_from_silver(conn, snapshots, cdc), "leitura", rows="lidos")
+        load_to_gold(chunks, snapshots, load_mode, cdc)
+    finally:
+        release_db(conn)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="ETL da Gold (empresas)")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Reagrega todos os CNPJs do último snapshot da Silver")
+    parser.add_argument("--cdc", action="store_true", default=None,
+                        help="A Silver foi carregada em modo CDC (só mudanças)")
+    parser.add_argument("--load-mode", choices=["insert", "staging"], default=None,
+                        help="insert: grava na partição viva; staging: carrega sem índices e anexa a partição no fim")
+    args = parser.parse_args()
+    main(full_refresh=args.full_refresh, load_mode=args.load_mode, cdc=args.cdc)
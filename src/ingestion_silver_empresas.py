@@ -1,27 +1,38 @@
-import psycopg2
-from psycopg2 import sql
+import argparse
+import itertools
+import os
+import sys
 import pandas as pd
 from datetime import datetime
-from tqdm import tqdm  # 🔹 Adicionando barra de progresso
-
-# 🔹 Configurações do banco de dados
-DB_CONFIG = {
-    "host": "localhost",
-    "port": "5432",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "has2582"
-}
+from database import (connect_db, release_db, copy_dataframe, stream_query,
+                      ensure_watermark_table, get_watermark, set_watermark)
+from cdc import CDC_ENABLED, ensure_cdc, stage_dataframe, apply_changes, apply_deletes, load_changes, print_counts
+import metrics
+from writers import ParallelWriter
+from partitions import LOAD_MODE, create_staging_table, attach_staging_table
+from fingerprints import table_inputs
+from transform import compare_frames
+from dimensions import DIMENSIONS, ensure_dimensions, lookup_ids, normalize_sql, keys_sql, register_codes
 
-# 📌 1️⃣ Conectar ao banco de dados
-def connect_db():
-    try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Erro na conexão: {e}")
-        return None
+WATERMARK_KEY = "silver.empresas"  # 🔹 Chave do watermark em controle.watermarks
+SILVER_MODE = os.getenv('SILVER_MODE', 'python')  # 🔹 'python' (referência) ou 'sql' (pushdown no Postgres)
+SILVER_STREAMING = os.getenv('SILVER_STREAMING', '1') == '1'  # 🔹 Lê a Bronze em blocos (cursor no servidor)
+SILVER_WRITERS = int(os.getenv('SILVER_WRITERS', '1'))  # 🔹 Conexões gravando em paralelo (modo staging)
+
+TABLE = "silver.empresas"
+PRIMARY_KEY = ["cnpj", "data_processamento"]
+KEY_COLUMNS = ["cnpj"]  # 🔹 Chave do CDC
+COLUMNS = ["cnpj", "razao_social", "natureza_juridica_id", "capital_social",
+           "porte_descricao", "data_processamento"]
 
-# 📌 2️⃣ Criar partição dinamicamente antes da inserção
+PORTE_DESCRICAO = {
+    '01': 'Microempresa',
+    '02': 'Pequeno Porte',
+    '03': 'Médio Porte',
+    '04': 'Grande Porte'
+}
+
+# 📌 1️⃣ Criar partição dinamicamente antes da inserção
 def create_partition(conn, data_processamento):
     cursor = conn.cursor()
     partition_name = f"empresas_{data_processamento.strftime('%Y_%m')}"
@@ -40,83 +51,345 @@ def create_partition(conn, data_processamento):
         print(f"✅ Partição {partition_name} criada/verificada.")
     except Exception as e:
         conn.rollback()
-        print(f"⚠️ Erro ao criar partição: {e}")
+        print(f"❌ Erro ao criar partição: {e}")
+        raise  # 🔹 Sem a partição a carga falharia depois, com um erro menos claro
     finally:
         cursor.close()
 
-# 📌 3️⃣ Extrair dados da Bronze
-def extract_from_bronze():
+# 🔹 Limite superior da Bronze no modo SQL: o snapshot que chegar depois do MAX(data_ingestao)
+#    fica para a próxima carga, junto com o watermark (sem limite quando o parâmetro é nulo)
+BRONZE_UPPER_BOUND_SQL = "(%(ultima)s::timestamp IS NULL OR data_ingestao <= %(ultima)s)"
+
+# 📌 2️⃣ Origem na Bronze: no CDC, só a versão mais recente de cada CNPJ no intervalo
+def bronze_source_sql(cdc=False, bounded=False):
+    # 🔹 bounded: no modo SQL o CDC escolhe a versão mais recente só até o MAX(data_ingestao) lido antes da carga
+    bound = f" AND {BRONZE_UPPER_BOUND_SQL}" if bounded else ""
+    if not cdc:
+        return "bronze.empresas"
+    return f"""(
+            SELECT DISTINCT ON (cnpj) * FROM bronze.empresas
+            WHERE (%(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s){bound}
+            ORDER BY cnpj, data_ingestao DESC
+        ) bronze"""
+
+# 📌 3️⃣ Extrair dados da Bronze: inteira (pd.read_sql) ou em blocos (cursor no servidor)
+def extract_query(cdc=False):
+    return f"""
+        SELECT cnpj, razao_social, natureza_juridica, capital_social, cod_porte, data_ingestao
+        FROM {bronze_source_sql(cdc)}
+        WHERE %(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s;
+    """  # 🔹 Só as partições da Bronze posteriores ao último watermark processado
+
+def extract_from_bronze(full_refresh=False, cdc=False):
     conn = connect_db()
-    if conn is None:
-        return None
     
-    query = """
-        SELECT cnpj, razao_social, natureza_juridica, capital_social, cod_porte, data_ingestao
-        FROM bronze.empresas;
-    """  # 🔹 Removida a limitação de MAX(data_ingestao)
+    ensure_watermark_table(conn)
+    watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
     
     try:
-        df = pd.read_sql(query, conn)
-        conn.close()
+        print(f"🔖 Watermark atual: {watermark or 'nenhum (carga completa)'}")
+        df = pd.read_sql(extract_query(cdc), conn, params={"watermark": watermark})
         return df
     except Exception as e:
         print(f"❌ Erro ao extrair dados: {e}")
-        return None
+        raise
+    finally:
+        release_db(conn)
+
+def stream_from_bronze(full_refresh=False, cdc=False):
+    conn = connect_db()
+    try:
+        ensure_watermark_table(conn)
+        watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
+        print(f"🔖 Watermark atual: {watermark or 'nenhum (carga completa)'}")
+        yield from stream_query(conn, extract_query(cdc), {"watermark": watermark})
+    finally:
+        release_db(conn)
 
 # 📌 4️⃣ Transformar os dados
-def transform_data(df):
+def transform_data(df, data_processamento=None, conn=None):
     if df is None or df.empty:
         print("⚠️ Nenhum dado para processar!")
         return None
     
     print("🔄 Transformando os dados...")
     df.dropna(subset=['cnpj', 'razao_social', 'natureza_juridica'], inplace=True)  # 🔹 Remover apenas valores nulos
+    # 🔹 Código da Receita -> id da dimensão (smallint), com cache no processo
+    df['natureza_juridica_id'] = lookup_ids(df['natureza_juridica'], "naturezas", conn)
     df['capital_social'] = df['capital_social'].fillna(0).astype(float)
-    df['porte_descricao'] = df['cod_porte'].map({
-        '01': 'Microempresa',
-        '02': 'Pequeno Porte',
-        '03': 'Médio Porte',
-        '04': 'Grande Porte'
-    }).fillna('Desconhecido')
-    df['data_processamento'] = datetime.now()
-    df.drop(columns=['cod_porte'], inplace=True)
+    df['porte_descricao'] = df['cod_porte'].map(PORTE_DESCRICAO).fillna('Desconhecido')
+    df['data_processamento'] = data_processamento or datetime.now()  # 🔹 Mesmo snapshot em todos os blocos
+    df.drop(columns=['cod_porte', 'natureza_juridica'], inplace=True)
     return df
 
-# 📌 5️⃣ Carregar dados na Silver
-def load_to_silver(df):
-    conn = connect_db()
-    if conn is None:
-        return
-    
-    create_partition(conn, datetime.now())  # 🔹 Criar partição antes da inserção
-    cursor = conn.cursor()
-    insert_query = """
-        INSERT INTO silver.empresas (cnpj, razao_social, natureza_juridica, capital_social, porte_descricao, data_processamento)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (cnpj, data_processamento) DO NOTHING;
+# 📌 5️⃣ Carregar dados na Silver via COPY
+def load_chunk(conn, table, df, data_processamento, batch_keys=None):
+    if batch_keys is not None:
+        return load_changes(conn, TABLE, table, KEY_COLUMNS, COLUMNS, "data_processamento",
+                            data_processamento, df, batch_keys)
+    if table != TABLE:
+        # 🔹 COPY sem PK nem ON CONFLICT; índice e deduplicação uma única vez no ATTACH
+        return copy_dataframe(conn, table, COLUMNS, df, desc="📥 Inserindo dados na Silver")
+    total = copy_dataframe(conn, TABLE, COLUMNS, df, conflict_columns=PRIMARY_KEY,
+                           desc="📥 Inserindo dados na Silver")
+    metrics.add_rows("rejeitados", len(df) - total)  # 🔹 Já existentes no snapshot (ON CONFLICT)
+    return total
+
+def load_to_silver(chunks, load_mode=None, cdc=False):
     """
+    Transforma e grava cada bloco da Bronze conforme chega, numa única transação:
+    a Silver só vê o snapshot completo, com o watermark avançado no mesmo commit.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None or first.empty:
+        print("⚠️ Nenhum dado para processar!")
+        return 0
+
+    conn = connect_db(bulk=True)
+    
+    data_processamento = datetime.now()  # 🔹 Um único snapshot para todos os blocos
+    staging = (load_mode or LOAD_MODE) == "staging"
+    # 🔹 Só na staging os writers podem confirmar cada um a sua parte: a Silver só vê o ATTACH
+    parallel = SILVER_WRITERS > 1 and staging and not cdc
+    if SILVER_WRITERS > 1 and not parallel:
+        print("⚠️ SILVER_WRITERS ignorado: writers paralelos só no modo staging sem CDC.")
+    if cdc:
+        ensure_cdc(conn, TABLE, KEY_COLUMNS)
+    if not staging:
+        create_partition(conn, data_processamento)  # 🔹 Criar partição antes da inserção
     
+    writer = None
+    try:
+        table = create_staging_table(conn, TABLE, data_processamento) if staging else TABLE
+        if parallel:
+            conn.commit()  # 🔹 Staging visível para as conexões dos writers
+
+            def write(writer_conn, df):
+                with metrics.phase("banco"):
+                    return load_chunk(writer_conn, table, df, data_processamento)
+            writer = ParallelWriter(write, SILVER_WRITERS, name=f"{TABLE}-writer")
+        total = 0
+        ultima_data_ingestao = None
+        for df_bronze in itertools.chain([first], chunks):
+            maior = df_bronze['data_ingestao'].max()
+            ultima_data_ingestao = maior if ultima_data_ingestao is None else max(ultima_data_ingestao, maior)
+            batch_keys = df_bronze[KEY_COLUMNS].copy() if cdc else None  # 🔹 Antes dos filtros do transform_data
+            lidos = len(df_bronze)
+
+            with metrics.phase("transformacao"):
+                df = transform_data(df_bronze, data_processamento)
+            # 🔹 Linhas descartadas pelos filtros (chaves ou campos obrigatórios nulos)
+            metrics.add_rows("rejeitados", lidos - len(df))
+            if writer is not None:
+                writer.submit(df)  # 🔹 Próximo bloco já é lido enquanto os writers gravam este
+                continue
+            with metrics.phase("banco"):
+                total += load_chunk(conn, table, df, data_processamento, batch_keys)
+
+        with metrics.phase("banco"):
+            if writer is not None:
+                total = writer.join()
+                writer.commit()
+            if staging:
+                attach_staging_table(conn, TABLE, table, "data_processamento", PRIMARY_KEY,
+                                     data_processamento, dedupe=True)
+            set_watermark(conn, WATERMARK_KEY, ultima_data_ingestao)  # 🔹 Mesmo commit da carga
+            conn.commit()
+        metrics.add_rows("gravados", total)
+        print(f"✅ {total} registros carregados na Silver!")
+        return total
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erro ao inserir dados na Silver: {e}")
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        release_db(conn)
+
+# 📌 6️⃣ SELECT equivalente ao transform_data, executado dentro do Postgres
+def build_select_sql(cdc=False):
+    porte_cases = "\n".join(
+        f"                   WHEN '{codigo}' THEN '{descricao}'" for codigo, descricao in PORTE_DESCRICAO.items()
+    )
+    return f"""
+        SELECT cnpj, razao_social, naturezas.id AS natureza_juridica_id,
+               COALESCE(capital_social, 0) AS capital_social,
+               CASE cod_porte
+{porte_cases}
+                   ELSE 'Desconhecido'
+               END AS porte_descricao,
+               %(data_processamento)s::timestamp AS data_processamento
+        FROM {bronze_source_sql(cdc, bounded=True)}
+        LEFT JOIN {keys_sql(DIMENSIONS['naturezas']['table'])} naturezas
+               ON naturezas.chave = {normalize_sql('natureza_juridica')}
+        WHERE cnpj IS NOT NULL AND razao_social IS NOT NULL AND natureza_juridica IS NOT NULL
+          AND (%(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s)
+          AND {BRONZE_UPPER_BOUND_SQL}
+    """
+
+# 🔹 Códigos que a dimensão ainda não conhece entram antes do INSERT ... SELECT (que só faz o JOIN)
+def register_pushdown_codes(cursor, params, cdc=False):
+    register_codes(cursor, DIMENSIONS['naturezas']['table'], f"""
+        SELECT {normalize_sql('natureza_juridica')} AS valor FROM {bronze_source_sql(cdc, bounded=True)}
+        WHERE cnpj IS NOT NULL AND razao_social IS NOT NULL
+          AND (%(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s)
+          AND {BRONZE_UPPER_BOUND_SQL}
+    """, params)
+
+# 📌 7️⃣ Pushdown no CDC: o SELECT vai para uma temporária e só as mudanças são gravadas
+def load_pushdown_changes(conn, target, data_processamento, params):
+    source = stage_dataframe(conn, TABLE, COLUMNS, None)
+    cursor = conn.cursor()
     try:
-        for _, row in tqdm(df.iterrows(), total=len(df), desc="📥 Inserindo dados na Silver"):
-            cursor.execute(insert_query, (
-                row['cnpj'], row['razao_social'], row['natureza_juridica'],
-                row['capital_social'], row['porte_descricao'], row['data_processamento']
-            ))
+        cursor.execute(f"INSERT INTO {source} ({', '.join(COLUMNS)}) {build_select_sql(cdc=True)};", params)
+    finally:
+        cursor.close()
+
+    counts = apply_changes(conn, source, TABLE, target, KEY_COLUMNS, COLUMNS, "data_processamento")
+    # 🔹 CNPJs do lote que não saíram no SELECT: removidos na Bronze ou descartados pelos filtros
+    removed = f"SELECT cnpj FROM {bronze_source_sql(cdc=True, bounded=True)} EXCEPT SELECT cnpj FROM {source}"
+    counts["D"] = apply_deletes(conn, removed, TABLE, target, KEY_COLUMNS, "data_processamento",
+                                data_processamento, params)
+    print_counts(TABLE, counts)
+    return sum(counts.values())
+
+# 📌 8️⃣ Executar a Silver como INSERT ... SELECT, sem trafegar os dados pelo Python
+def run_pushdown(full_refresh=False, load_mode=None, cdc=False):
+    conn = connect_db(bulk=True)
+
+    ensure_watermark_table(conn)
+    ensure_dimensions(conn)
+    data_processamento = datetime.now()
+    staging = (load_mode or LOAD_MODE) == "staging"
+    # 🔹 Só na staging os writers podem confirmar cada um a sua parte: a Silver só vê o ATTACH
+    parallel = SILVER_WRITERS > 1 and staging and not cdc
+    if SILVER_WRITERS > 1 and not parallel:
+        print("⚠️ SILVER_WRITERS ignorado: writers paralelos só no modo staging sem CDC.")
+    if cdc:
+        ensure_cdc(conn, TABLE, KEY_COLUMNS)
+    if not staging:
+        create_partition(conn, data_processamento)
+    cursor = conn.cursor()
+
+    try:
+        watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
+        print(f"🔖 Watermark atual: {watermark or 'nenhum (carga completa)'}")
+        params = {"watermark": watermark, "data_processamento": data_processamento}
+
+        cursor.execute("""
+            SELECT MAX(data_ingestao) FROM bronze.empresas
+            WHERE %(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s;
+        """, params)
+        ultima_data_ingestao = cursor.fetchone()[0]
+        if ultima_data_ingestao is None:
+            print("⚠️ Nenhum dado para processar!")
+            return
+        params["ultima"] = ultima_data_ingestao  # 🔹 Mesmo limite no SELECT e no watermark
+
+        target, on_conflict = TABLE, f"ON CONFLICT ({', '.join(PRIMARY_KEY)}) DO NOTHING"
+        if staging:
+            target, on_conflict = create_staging_table(conn, TABLE, data_processamento), ""
+
+        register_pushdown_codes(cursor, params, cdc)
+        print("🔄 Transformando os dados no Postgres (INSERT ... SELECT)...")
+        if cdc:
+            total = load_pushdown_changes(conn, target, data_processamento, params)
+        else:
+            cursor.execute(f"""
+                INSERT INTO {target} (cnpj, razao_social, natureza_juridica_id, capital_social,
+                                      porte_descricao, data_processamento)
+                {build_select_sql()}
+                {on_conflict};
+            """, params)
+            total = cursor.rowcount
+        if staging:
+            attach_staging_table(conn, TABLE, target, "data_processamento", PRIMARY_KEY,
+                                 data_processamento, dedupe=True)
+        set_watermark(conn, WATERMARK_KEY, ultima_data_ingestao)
         conn.commit()
-        print(f"✅ {len(df)} registros carregados na Silver!")
+        metrics.add_rows("gravados", total)
+        print(f"✅ {total} registros carregados na Silver!")
     except Exception as e:
         conn.rollback()
         print(f"❌ Erro ao inserir dados na Silver: {e}")
+        raise
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
-# 📌 6️⃣ Executar ETL da Silver
-def main():
-    df_bronze = extract_from_bronze()
-    df_transformed = transform_data(df_bronze)
-    if df_transformed is not None:
-        load_to_silver(df_transformed)
+# 📌 9️⃣ Comparar o modo Python (referência) com o modo SQL sobre toda a Bronze
+def check_parity():
+    """
+    Tudo numa transação desfeita no fim: os códigos que a dimensão ainda não
+    conhece são registrados como no modo SQL, antes dos dois lados, e somem no
+    rollback (só os valores da sequência dos ids ficam consumidos).
+    """
+    df_bronze = extract_from_bronze(full_refresh=True)
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    try:
+        params = {"watermark": None, "ultima": None, "data_processamento": datetime.now()}
+        register_pushdown_codes(cursor, params)
+        df_python = transform_data(df_bronze, conn=conn)
+        df_sql = pd.read_sql(build_select_sql(), conn, params=params)
+    finally:
+        cursor.close()
+        conn.rollback()
+        release_db(conn)
+
+    columns = ["cnpj", "razao_social", "natureza_juridica_id", "capital_social", "porte_descricao"]
+    return compare_frames(df_python, df_sql, columns, numeric_columns=["capital_social", "natureza_juridica_id"])
+
+# 🔹 Consulta pesada da etapa, para o EXPLAIN do modo de diagnóstico (src/diagnostics.py)
+def diagnostic_statements(conn, full_refresh=False, mode=None, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    ensure_watermark_table(conn)
+    watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
+    if (mode or SILVER_MODE) == "sql":
+        return [("select_pushdown", build_select_sql(cdc), {"watermark": watermark, "ultima": None, "data_processamento": datetime.now()})]
+    return [("extracao_bronze", extract_query(cdc), {"watermark": watermark})]
+
+# 🔹 Entradas da etapa para a memorização do main.py: partições da Bronze (a Silver só guarda ids,
+#    então a descrição que a etapa de dimensões completa não muda o resultado)
+def fingerprint_inputs(conn, full_refresh=False, mode=None, load_mode=None, cdc=None):
+    return {"bronze": table_inputs(conn, "bronze.empresas", "data_ingestao"), "cdc": CDC_ENABLED if cdc is None else cdc}
+
+# 📌 🔟 Executar ETL da Silver
+def main(full_refresh=False, mode=None, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    if (mode or SILVER_MODE) == "sql":
+        # 🔹 Leitura e transformação acontecem dentro do Postgres: tudo conta como banco
+        with metrics.phase("banco"):
+            run_pushdown(full_refresh, load_mode, cdc)
+        return
+
+    if SILVER_STREAMING:
+        # 🔹 Um bloco por vez da Bronze até a Silver: memória constante, qualquer que seja o volume
+        chunks = metrics.timed_iter(stream_from_bronze(full_refresh, cdc), "leitura", rows="lidos")
+    else:
+        with metrics.phase("leitura"):
+            df_bronze = extract_from_bronze(full_refresh, cdc)
+        metrics.add_rows("lidos", len(df_bronze))
+        chunks = [df_bronze]
+    load_to_silver(chunks, load_mode, cdc)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETL da Silver (empresas)")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Ignora o watermark e reprocessa todo o histórico da Bronze")
+    parser.add_argument("--mode", choices=["python", "sql"], default=None,
+                        help="python: transforma no pandas; sql: INSERT ... SELECT no Postgres")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="Compara a saída dos modos python e sql sem gravar nada")
+    parser.add_argument("--cdc", action="store_true", default=None,
+                        help="Grava só inserções, alterações e exclusões em relação ao que a Silver já tem")
+    parser.add_argument("--load-mode", choices=["insert", "staging"], default=None,
+                        help="insert: grava na partição viva; staging: carrega sem índices e anexa a partição no fim")
+    args = parser.parse_args()
+
+    if args.check_parity:
+        sys.exit(0 if check_parity() else 1)
+    main(full_refresh=args.full_refresh, mode=args.mode, load_mode=args.load_mode, cdc=args.cdc)
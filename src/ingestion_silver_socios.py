@@ -1,28 +1,38 @@
-import psycopg2
+import argparse
+import itertools
+import os
+import sys
 import pandas as pd
-from psycopg2.extras import execute_values
 from datetime import datetime
-from tqdm import tqdm  # Barra de progresso
+from database import (connect_db, release_db, copy_dataframe, stream_query,
+                      ensure_watermark_table, get_watermark, set_watermark)
+from cdc import CDC_ENABLED, ensure_cdc, stage_dataframe, apply_changes, apply_deletes, load_changes, print_counts
+import metrics
+from writers import ParallelWriter
+from partitions import LOAD_MODE, create_staging_table, attach_staging_table
+from dimensions import DIMENSIONS, ensure_dimensions, lookup_ids, normalize_sql, keys_sql, register_codes
+from fingerprints import table_inputs
+from transform import clean_printable_ascii, compare_frames
 import re
 
-# 🔹 Configuração do banco de dados
-DB_CONFIG = {
-    "host": "localhost",
-    "port": "5432",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "has2582"
-}
-
-# 📌 1️⃣ Conectar ao banco de dados
-def connect_db():
-    try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Erro na conexão: {e}")
-        return None
+WATERMARK_KEY = "silver.socios"  # 🔹 Chave do watermark em controle.watermarks
+SILVER_MODE = os.getenv('SILVER_MODE', 'python')  # 🔹 'python' (referência) ou 'sql' (pushdown no Postgres)
+SILVER_STREAMING = os.getenv('SILVER_STREAMING', '1') == '1'  # 🔹 Lê a Bronze em blocos (cursor no servidor)
+SILVER_WRITERS = int(os.getenv('SILVER_WRITERS', '1'))  # 🔹 Conexões gravando em paralelo (modo staging)
 
-# 📌 2️⃣ Criar partição dinamicamente antes da inserção
+TABLE = "silver.socios"
+PRIMARY_KEY = ["cnpj", "documento_socio", "data_processamento"]
+KEY_COLUMNS = ["cnpj", "documento_socio"]  # 🔹 Chave do CDC
+COLUMNS = ["cnpj", "tipo_socio", "nome_socio", "documento_socio",
+           "qualificacao_socio_id", "data_entrada_sociedade",
+           "faixa_etaria", "pais_id", "representante_legal",
+           "nome_representante", "qualificacao_representante_id", "data_processamento"]
+# 🔹 Colunas da Bronze trocadas pelo id (smallint) da dimensão de referência na Silver
+DIMENSION_COLUMNS = {"codigo_qualificacao_socio": ("qualificacao_socio_id", "qualificacoes"),
+                     "pais": ("pais_id", "paises"),
+                     "qualificacao_representante": ("qualificacao_representante_id", "qualificacoes")}
+
+# 📌 1️⃣ Criar partição dinamicamente antes da inserção
 def create_partition(conn, data_processamento):
     cursor = conn.cursor()
     partition_name = f"socios_{data_processamento.strftime('%Y_%m')}"
@@ -41,95 +51,377 @@ def create_partition(conn, data_processamento):
         print(f"✅ Partição {partition_name} criada/verificada.")
     except Exception as e:
         conn.rollback()
-        print(f"⚠️ Erro ao criar partição: {e}")
+        print(f"❌ Erro ao criar partição: {e}")
+        raise  # 🔹 Sem a partição a carga falharia depois, com um erro menos claro
     finally:
         cursor.close()
 
-# 📌 3️⃣ Extrair dados da Bronze
-def extract_from_bronze():
-    conn = connect_db()
-    if conn is None:
-        return None
-    
-    query = """
+# 🔹 Limite superior da Bronze no modo SQL: o snapshot que chegar depois do MAX(data_ingestao)
+#    fica para a próxima carga, junto com o watermark (sem limite quando o parâmetro é nulo)
+BRONZE_UPPER_BOUND_SQL = "(%(ultima)s::timestamp IS NULL OR data_ingestao <= %(ultima)s)"
+
+# 📌 2️⃣ Origem na Bronze: no CDC, só a versão mais recente de cada sócio no intervalo
+def bronze_source_sql(cdc=False, bounded=False):
+    # 🔹 bounded: no modo SQL o CDC escolhe a versão mais recente só até o MAX(data_ingestao) lido antes da carga
+    bound = f" AND {BRONZE_UPPER_BOUND_SQL}" if bounded else ""
+    if not cdc:
+        return "bronze.socios"
+    return f"""(
+            SELECT DISTINCT ON (cnpj, documento_socio) * FROM bronze.socios
+            WHERE (%(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s){bound}
+            ORDER BY cnpj, documento_socio, data_ingestao DESC
+        ) bronze"""
+
+# 📌 3️⃣ Extrair dados da Bronze: inteira (pd.read_sql) ou em blocos (cursor no servidor)
+def extract_query(cdc=False):
+    return f"""
         SELECT cnpj, tipo_socio, nome_socio, documento_socio, codigo_qualificacao_socio,
                data_entrada_sociedade, faixa_etaria, pais, representante_legal,
                nome_representante, qualificacao_representante, data_ingestao
-        FROM bronze.socios;
-    """
+        FROM {bronze_source_sql(cdc)}
+        WHERE %(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s;
+    """  # 🔹 Só as partições da Bronze posteriores ao último watermark processado
+
+def extract_from_bronze(full_refresh=False, cdc=False):
+    conn = connect_db()
+    
+    ensure_watermark_table(conn)
+    watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
     
     try:
-        df = pd.read_sql(query, conn)
-        conn.close()
+        print(f"🔖 Watermark atual: {watermark or 'nenhum (carga completa)'}")
+        df = pd.read_sql(extract_query(cdc), conn, params={"watermark": watermark})
         return df
     except Exception as e:
         print(f"❌ Erro ao extrair dados: {e}")
-        return None
+        raise
+    finally:
+        release_db(conn)
+
+def stream_from_bronze(full_refresh=False, cdc=False):
+    conn = connect_db()
+    try:
+        ensure_watermark_table(conn)
+        watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
+        print(f"🔖 Watermark atual: {watermark or 'nenhum (carga completa)'}")
+        yield from stream_query(conn, extract_query(cdc), {"watermark": watermark})
+    finally:
+        release_db(conn)
 
 # 📌 4️⃣ Limpeza de caracteres
 def clean_text(value):
     return re.sub(r'[^\x20-\x7E]', '', value).replace('*', '').strip() if isinstance(value, str) else value
 
 # 📌 5️⃣ Transformar os dados
-def transform_data(df):
+def transform_data(df, data_processamento=None, conn=None):
     if df is None or df.empty:
         print("⚠️ Nenhum dado para processar!")
         return None
     
     print("🔄 Transformando os dados...")
     df.dropna(subset=['cnpj', 'nome_socio', 'documento_socio'], inplace=True)
-    df['documento_socio'] = df['documento_socio'].apply(clean_text)
-    df['pais'] = df['pais'].apply(clean_text)
-    df['data_processamento'] = datetime.now()
+    # 🔹 Versão vetorizada de .apply(clean_text), com o mesmo resultado
+    df['documento_socio'] = clean_printable_ascii(df['documento_socio'], remove_chars='*')
+    df['pais'] = clean_printable_ascii(df['pais'], remove_chars='*')
+    # 🔹 Códigos da Receita -> ids das dimensões (smallint), com cache no processo
+    for column, (id_column, dimension) in DIMENSION_COLUMNS.items():
+        df[id_column] = lookup_ids(df[column], dimension, conn)
+    df.drop(columns=list(DIMENSION_COLUMNS), inplace=True)
+    df['data_processamento'] = data_processamento or datetime.now()  # 🔹 Mesmo snapshot em todos os blocos
     return df
 
-# 📌 6️⃣ Carregar dados na Silver
-def load_to_silver(df):
-    conn = connect_db()
-    if conn is None:
-        return
-    
-    create_partition(conn, datetime.now())  # Criar partição antes da inserção
-    cursor = conn.cursor()
-    insert_query = """
-        INSERT INTO silver.socios (cnpj, tipo_socio, nome_socio, documento_socio,
-                                  codigo_qualificacao_socio, data_entrada_sociedade,
-                                  faixa_etaria, pais, representante_legal,
-                                  nome_representante, qualificacao_representante, data_processamento)
-        VALUES %s
-        ON CONFLICT (cnpj, documento_socio, data_processamento) DO NOTHING;
+# 📌 6️⃣ Chaves do lote da Bronze já no formato da Silver (documento limpo)
+def silver_keys(df):
+    keys = df.dropna(subset=KEY_COLUMNS)
+    return pd.DataFrame({"cnpj": keys["cnpj"],
+                         "documento_socio": clean_printable_ascii(keys["documento_socio"], remove_chars='*')})
+
+# 📌 7️⃣ Carregar dados na Silver via COPY
+def load_chunk(conn, table, df, data_processamento, batch_keys=None):
+    if batch_keys is not None:
+        return load_changes(conn, TABLE, table, KEY_COLUMNS, COLUMNS, "data_processamento",
+                            data_processamento, df, batch_keys)
+    if table != TABLE:
+        # 🔹 COPY sem PK nem ON CONFLICT; índice e deduplicação uma única vez no ATTACH
+        return copy_dataframe(conn, table, COLUMNS, df, desc="📥 Inserindo dados na Silver")
+    total = copy_dataframe(conn, TABLE, COLUMNS, df, conflict_columns=PRIMARY_KEY,
+                           desc="📥 Inserindo dados na Silver")
+    metrics.add_rows("rejeitados", len(df) - total)  # 🔹 Duplicados ou já existentes no snapshot (ON CONFLICT)
+    return total
+
+def load_to_silver(chunks, load_mode=None, cdc=False):
+    """
+    Transforma e grava cada bloco da Bronze conforme chega, numa única transação:
+    a Silver só vê o snapshot completo, com o watermark avançado no mesmo commit.
     """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None or first.empty:
+        print("⚠️ Nenhum dado para processar!")
+        return 0
+
+    conn = connect_db(bulk=True)
     
+    data_processamento = datetime.now()  # 🔹 Um único snapshot para todos os blocos
+    staging = (load_mode or LOAD_MODE) == "staging"
+    # 🔹 Só na staging os writers podem confirmar cada um a sua parte: a Silver só vê o ATTACH
+    parallel = SILVER_WRITERS > 1 and staging and not cdc
+    if SILVER_WRITERS > 1 and not parallel:
+        print("⚠️ SILVER_WRITERS ignorado: writers paralelos só no modo staging sem CDC.")
+    if cdc:
+        ensure_cdc(conn, TABLE, KEY_COLUMNS)
+    if not staging:
+        create_partition(conn, data_processamento)  # Criar partição antes da inserção
+    
+    writer = None
     try:
-        values = [
-            (
-                row['cnpj'], row['tipo_socio'], row['nome_socio'], row['documento_socio'],
-                row['codigo_qualificacao_socio'], row['data_entrada_sociedade'],
-                row['faixa_etaria'], row['pais'], row['representante_legal'],
-                row['nome_representante'], row['qualificacao_representante'], row['data_processamento']
-            )
-            for _, row in df.iterrows()
-        ]
-        
-        for i in tqdm(range(0, len(values), 10000), desc="📥 Inserindo dados na Silver", unit=" registros"):
-            batch = values[i:i+10000]
-            execute_values(cursor, insert_query, batch)
+        table = create_staging_table(conn, TABLE, data_processamento) if staging else TABLE
+        if parallel:
+            conn.commit()  # 🔹 Staging visível para as conexões dos writers
+
+            def write(writer_conn, df):
+                with metrics.phase("banco"):
+                    return load_chunk(writer_conn, table, df, data_processamento)
+            writer = ParallelWriter(write, SILVER_WRITERS, name=f"{TABLE}-writer")
+        total = 0
+        ultima_data_ingestao = None
+        for df_bronze in itertools.chain([first], chunks):
+            maior = df_bronze['data_ingestao'].max()
+            ultima_data_ingestao = maior if ultima_data_ingestao is None else max(ultima_data_ingestao, maior)
+            batch_keys = silver_keys(df_bronze) if cdc else None  # 🔹 Antes dos filtros do transform_data
+            lidos = len(df_bronze)
+
+            with metrics.phase("transformacao"):
+                df = transform_data(df_bronze, data_processamento)
+            # 🔹 Linhas descartadas pelos filtros (chaves ou nome nulos)
+            metrics.add_rows("rejeitados", lidos - len(df))
+            if writer is not None:
+                writer.submit(df)  # 🔹 Próximo bloco já é lido enquanto os writers gravam este
+                continue
+            with metrics.phase("banco"):
+                total += load_chunk(conn, table, df, data_processamento, batch_keys)
+
+        with metrics.phase("banco"):
+            if writer is not None:
+                total = writer.join()
+                writer.commit()
+            if staging:
+                attach_staging_table(conn, TABLE, table, "data_processamento", PRIMARY_KEY,
+                                     data_processamento, dedupe=True)
+            set_watermark(conn, WATERMARK_KEY, ultima_data_ingestao)  # 🔹 Mesmo commit da carga
             conn.commit()
-        
-        print(f"✅ {len(df)} registros carregados na Silver!")
+        metrics.add_rows("gravados", total)
+        print(f"✅ {total} registros carregados na Silver!")
+        return total
     except Exception as e:
         conn.rollback()
         print(f"❌ Erro ao inserir dados na Silver: {e}")
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        release_db(conn)
+
+# 📌 8️⃣ Equivalente SQL do clean_text: remove fora de \x20-\x7E, tira '*' e espaços das pontas
+def clean_text_sql(column):
+    return f"btrim(replace(regexp_replace({column}, '[^ -~]', '', 'g'), '*', ''), ' ')"
+
+# 🔹 Valor da Bronze que vai para a dimensão, tratado como no transform_data
+def dimension_source_sql(column):
+    return clean_text_sql(column) if column == "pais" else column
+
+# 📌 9️⃣ SELECT equivalente ao transform_data, executado dentro do Postgres
+def build_select_sql(cdc=False):
+    return f"""
+        SELECT cnpj, tipo_socio, nome_socio,
+               {clean_text_sql('documento_socio')} AS documento_socio,
+               qualificacoes.id AS qualificacao_socio_id, data_entrada_sociedade, faixa_etaria,
+               paises.id AS pais_id,
+               representante_legal, nome_representante, representantes.id AS qualificacao_representante_id,
+               %(data_processamento)s::timestamp AS data_processamento
+        FROM {bronze_source_sql(cdc, bounded=True)}
+        LEFT JOIN {keys_sql(DIMENSIONS['qualificacoes']['table'])} qualificacoes
+               ON qualificacoes.chave = {normalize_sql(dimension_source_sql('codigo_qualificacao_socio'))}
+        LEFT JOIN {keys_sql(DIMENSIONS['paises']['table'])} paises
+               ON paises.chave = {normalize_sql(dimension_source_sql('pais'))}
+        LEFT JOIN {keys_sql(DIMENSIONS['qualificacoes']['table'])} representantes
+               ON representantes.chave = {normalize_sql(dimension_source_sql('qualificacao_representante'))}
+        WHERE cnpj IS NOT NULL AND nome_socio IS NOT NULL AND documento_socio IS NOT NULL
+          AND (%(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s)
+          AND {BRONZE_UPPER_BOUND_SQL}
+    """
+
+# 🔹 Códigos que as dimensões ainda não conhecem entram antes do INSERT ... SELECT (que só faz o JOIN)
+def register_pushdown_codes(cursor, params, cdc=False):
+    for column, (_, dimension) in DIMENSION_COLUMNS.items():
+        register_codes(cursor, DIMENSIONS[dimension]['table'], f"""
+            SELECT {normalize_sql(dimension_source_sql(column))} AS valor FROM {bronze_source_sql(cdc, bounded=True)}
+            WHERE cnpj IS NOT NULL AND nome_socio IS NOT NULL AND documento_socio IS NOT NULL
+              AND (%(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s)
+              AND {BRONZE_UPPER_BOUND_SQL}
+        """, params)
+
+# 📌 🔟 Pushdown no CDC: o SELECT vai para uma temporária e só as mudanças são gravadas
+def load_pushdown_changes(conn, target, data_processamento, params):
+    source = stage_dataframe(conn, TABLE, COLUMNS, None)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"INSERT INTO {source} ({', '.join(COLUMNS)}) {build_select_sql(cdc=True)};", params)
+    finally:
+        cursor.close()
+
+    counts = apply_changes(conn, source, TABLE, target, KEY_COLUMNS, COLUMNS, "data_processamento")
+    # 🔹 Sócios do lote que não saíram no SELECT: removidos na Bronze ou descartados pelos filtros
+    removed = f"""
+        SELECT cnpj, {clean_text_sql('documento_socio')} AS documento_socio FROM {bronze_source_sql(cdc=True, bounded=True)}
+        WHERE documento_socio IS NOT NULL
+        EXCEPT SELECT cnpj, documento_socio FROM {source}
+    """
+    counts["D"] = apply_deletes(conn, removed, TABLE, target, KEY_COLUMNS, "data_processamento",
+                                data_processamento, params)
+    print_counts(TABLE, counts)
+    return sum(counts.values())
+
+# 📌 1️⃣1️⃣ Executar a Silver como INSERT ... SELECT, sem trafegar os dados pelo Python
+def run_pushdown(full_refresh=False, load_mode=None, cdc=False):
+    conn = connect_db(bulk=True)
+
+    ensure_watermark_table(conn)
+    ensure_dimensions(conn)
+    data_processamento = datetime.now()
+    staging = (load_mode or LOAD_MODE) == "staging"
+    # 🔹 Só na staging os writers podem confirmar cada um a sua parte: a Silver só vê o ATTACH
+    parallel = SILVER_WRITERS > 1 and staging and not cdc
+    if SILVER_WRITERS > 1 and not parallel:
+        print("⚠️ SILVER_WRITERS ignorado: writers paralelos só no modo staging sem CDC.")
+    if cdc:
+        ensure_cdc(conn, TABLE, KEY_COLUMNS)
+    if not staging:
+        create_partition(conn, data_processamento)
+    cursor = conn.cursor()
+
+    try:
+        watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
+        print(f"🔖 Watermark atual: {watermark or 'nenhum (carga completa)'}")
+        params = {"watermark": watermark, "data_processamento": data_processamento}
+
+        cursor.execute("""
+            SELECT MAX(data_ingestao) FROM bronze.socios
+            WHERE %(watermark)s::timestamp IS NULL OR data_ingestao > %(watermark)s;
+        """, params)
+        ultima_data_ingestao = cursor.fetchone()[0]
+        if ultima_data_ingestao is None:
+            print("⚠️ Nenhum dado para processar!")
+            return
+        params["ultima"] = ultima_data_ingestao  # 🔹 Mesmo limite no SELECT e no watermark
+
+        target, on_conflict = TABLE, f"ON CONFLICT ({', '.join(PRIMARY_KEY)}) DO NOTHING"
+        if staging:
+            target, on_conflict = create_staging_table(conn, TABLE, data_processamento), ""
+
+        register_pushdown_codes(cursor, params, cdc)
+        print("🔄 Transformando os dados no Postgres (INSERT ... SELECT)...")
+        if cdc:
+            total = load_pushdown_changes(conn, target, data_processamento, params)
+        else:
+            cursor.execute(f"""
+                INSERT INTO {target} (cnpj, tipo_socio, nome_socio, documento_socio,
+                                      qualificacao_socio_id, data_entrada_sociedade,
+                                      faixa_etaria, pais_id, representante_legal,
+                                      nome_representante, qualificacao_representante_id, data_processamento)
+                {build_select_sql()}
+                {on_conflict};
+            """, params)
+            total = cursor.rowcount
+        if staging:
+            attach_staging_table(conn, TABLE, target, "data_processamento", PRIMARY_KEY,
+                                 data_processamento, dedupe=True)
+        set_watermark(conn, WATERMARK_KEY, ultima_data_ingestao)
+        conn.commit()
+        metrics.add_rows("gravados", total)
+        print(f"✅ {total} registros carregados na Silver!")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erro ao inserir dados na Silver: {e}")
+        raise
+    finally:
+        cursor.close()
+        release_db(conn)
+
+# 📌 1️⃣2️⃣ Comparar o modo Python (referência) com o modo SQL sobre toda a Bronze
+def check_parity():
+    """
+    Tudo numa transação desfeita no fim: os códigos que as dimensões ainda não
+    conhecem são registrados como no modo SQL, antes dos dois lados, e somem no
+    rollback (só os valores da sequência dos ids ficam consumidos).
+    """
+    df_bronze = extract_from_bronze(full_refresh=True)
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    try:
+        params = {"watermark": None, "ultima": None, "data_processamento": datetime.now()}
+        register_pushdown_codes(cursor, params)
+        df_python = transform_data(df_bronze, conn=conn)
+        df_sql = pd.read_sql(build_select_sql(), conn, params=params)
     finally:
         cursor.close()
-        conn.close()
+        conn.rollback()
+        release_db(conn)
+
+    columns = ["cnpj", "tipo_socio", "nome_socio", "documento_socio",
+               "qualificacao_socio_id", "data_entrada_sociedade", "faixa_etaria",
+               "pais_id", "representante_legal", "nome_representante", "qualificacao_representante_id"]
+    id_columns = [id_column for id_column, _ in DIMENSION_COLUMNS.values()]
+    return compare_frames(df_python, df_sql, columns, numeric_columns=id_columns)
+
+# 🔹 Consulta pesada da etapa, para o EXPLAIN do modo de diagnóstico (src/diagnostics.py)
+def diagnostic_statements(conn, full_refresh=False, mode=None, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    ensure_watermark_table(conn)
+    watermark = None if full_refresh else get_watermark(conn, WATERMARK_KEY)
+    if (mode or SILVER_MODE) == "sql":
+        return [("select_pushdown", build_select_sql(cdc), {"watermark": watermark, "ultima": None, "data_processamento": datetime.now()})]
+    return [("extracao_bronze", extract_query(cdc), {"watermark": watermark})]
 
-# 📌 7️⃣ Executar ETL da Silver
-def main():
-    df_bronze = extract_from_bronze()
-    df_transformed = transform_data(df_bronze)
-    if df_transformed is not None:
-        load_to_silver(df_transformed)
+# 🔹 Entradas da etapa para a memorização do main.py: partições da Bronze (a Silver só guarda ids,
+#    então a descrição que a etapa de dimensões completa não muda o resultado)
+def fingerprint_inputs(conn, full_refresh=False, mode=None, load_mode=None, cdc=None):
+    return {"bronze": table_inputs(conn, "bronze.socios", "data_ingestao"), "cdc": CDC_ENABLED if cdc is None else cdc}
+
+# 📌 1️⃣3️⃣ Executar ETL da Silver
+def main(full_refresh=False, mode=None, load_mode=None, cdc=None):
+    cdc = CDC_ENABLED if cdc is None else cdc
+    if (mode or SILVER_MODE) == "sql":
+        # 🔹 Leitura e transformação acontecem dentro do Postgres: tudo conta como banco
+        with metrics.phase("banco"):
+            run_pushdown(full_refresh, load_mode, cdc)
+        return
+
+    if SILVER_STREAMING:
+        # 🔹 Um bloco por vez da Bronze até a Silver: memória constante, qualquer que seja o volume
+        chunks = metrics.timed_iter(stream_from_bronze(full_refresh, cdc), "leitura", rows="lidos")
+    else:
+        with metrics.phase("leitura"):
+            df_bronze = extract_from_bronze(full_refresh, cdc)
+        metrics.add_rows("lidos", len(df_bronze))
+        chunks = [df_bronze]
+    load_to_silver(chunks, load_mode, cdc)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="ETL da Silver (socios)")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Ignora o watermark e reprocessa todo o histórico da Bronze")
+    parser.add_argument("--mode", choices=["python", "sql"], default=None,
+                        help="python: transforma no pandas; sql: INSERT ... SELECT no Postgres")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="Compara a saída dos modos python e sql sem gravar nada")
+    parser.add_argument("--cdc", action="store_true", default=None,
+                        help="Grava só inserções, alterações e exclusões em relação ao que a Silver já tem")
+    parser.add_argument("--load-mode", choices=["insert", "staging"], default=None,
+                        help="insert: grava na partição viva; staging: carrega sem índices e anexa a partição no fim")
+    args = parser.parse_args()
+
+    if args.check_parity:
+        sys.exit(0 if check_parity() else 1)
+    main(full_refresh=args.full_refresh, mode=args.mode, load_mode=args.load_mode, cdc=args.cdc)
@@ -1,40 +1,179 @@
 import os
 import sys
+import time
+import argparse
+import importlib
+import traceback
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-# 📌 1️⃣ Executando os scripts de ingestão em sequência
-if __name__ == "__main__":
+import metrics
+import diagnostics
+import fingerprints
+
+# 🔹 Etapas do pipeline: módulo, dependências e quais opções da CLI cada uma recebe
+STAGES = {
+    "bronze_empresas": {"module": "ingestion_bronze_empresas", "depends_on": [], "options": ["load_mode", "cdc"]},
+    "bronze_socios": {"module": "ingestion_bronze_socios", "depends_on": [], "options": ["load_mode", "cdc"]},
+    "dimensoes": {"module": "dimensions", "depends_on": [], "options": []},
+    "silver_empresas": {"module": "ingestion_silver_empresas", "depends_on": ["bronze_empresas", "dimensoes"],
+                        "options": ["full_refresh", "mode", "load_mode", "cdc"]},
+    "silver_socios": {"module": "ingestion_silver_socios", "depends_on": ["bronze_socios", "dimensoes"],
+                      "options": ["full_refresh", "mode", "load_mode", "cdc"]},
+    "gold": {"module": "ingestion_gold", "depends_on": ["silver_empresas", "silver_socios"],
+             "options": ["full_refresh", "load_mode", "cdc"]},
+}
+
+# 📌 1️⃣ Executar uma etapa num processo separado e devolver as métricas dela
+def run_stage(module_name, kwargs, diagnose=False, memo=None):
+    """
+    Com `memo` ({"etapa": nome, "forcar": bool}) a etapa compara o fingerprint
+    das entradas com o da última execução bem-sucedida: se for igual (e não
+    forçada), não executa e volta como sucesso reaproveitado.
+    """
+    start = time.perf_counter()
+    metrics.start()
+    diagnosis, error, state = {}, None, None
     try:
-        print("🚀 Iniciando ingestão de dados...")
+        module = importlib.import_module(module_name)
+        state = fingerprints.check(memo["etapa"], module, kwargs) if memo else None
+        previous = state["anterior"] if state else None
+        if previous and previous[0] == state["fingerprint"] and not memo["forcar"]:
+            print(f"♻️ Etapa {memo['etapa']}: entradas iguais às da execução de {previous[2]:%Y-%m-%d %H:%M:%S}")
+            report = metrics.stage_report(time.perf_counter() - start)
+            report.update(reaproveitada=True, segundos_economizados=round(max(previous[1] - report["segundos"], 0), 3))
+            return report
+        with diagnostics.capture(module_name, module, kwargs) if diagnose else nullcontext(diagnosis) as diagnosis:
+            module.main(**kwargs)
+    except Exception as e:
+        # 🔹 A falha volta como relatório: os números até o erro não se perdem
+        traceback.print_exception(e)
+        error = e
+    report = metrics.stage_report(time.perf_counter() - start, error=error)
+    if diagnosis:
+        report["diagnostico"] = diagnosis
+    if state and error is None:
+        fingerprints.save(memo["etapa"], state, report["segundos"])
+    return report
 
-        # Ingestão Bronze Empresas
-        print("📥 Iniciando ingestão de empresas (bronze)...")
-        import ingestion_bronze_empresas  
-        ingestion_bronze_empresas.main() 
+# 🔹 Etapa e todas as que dependem dela, direta ou indiretamente (STAGES já está em ordem topológica)
+def downstream_stages(stage):
+    stages = {stage}
+    for name, config in STAGES.items():
+        if any(dep in stages for dep in config["depends_on"]):
+            stages.add(name)
+    return stages
 
-        # Ingestão Bronze Sócios
-        print("📥 Iniciando ingestão de sócios (bronze)...")
-        import ingestion_bronze_socios  
-        ingestion_bronze_socios.main()  
+# 📌 2️⃣ Executar as etapas respeitando as dependências (DAG)
+def run_pipeline(options, max_workers=2, diagnose=False, memoize=fingerprints.MEMO_ENABLED, forced=()):
+    status = {name: "pendente" for name in STAGES}
+    reports = {}
+    running = {}
 
-        # Ingestão Silver Empresas
-        print("📥 Iniciando ingestão de empresas (silver)...")
-        import ingestion_silver_empresas  
-        ingestion_silver_empresas.main()  
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # 🔹 Etapas cujas dependências falharam não são executadas
+            for name, stage in STAGES.items():
+                if status[name] == "pendente" and any(status[dep] in ("falhou", "ignorada") for dep in stage["depends_on"]):
+                    status[name] = "ignorada"
+                    print(f"⏭️ Etapa {name} ignorada: dependência falhou.")
 
-        # Ingestão Silver Sócios
-        print("📥 Iniciando ingestão de sócios (silver)...")
-        import ingestion_silver_socios 
-        ingestion_silver_socios.main() 
+            # 🔹 Dispara tudo que já tem as dependências concluídas
+            for name, stage in STAGES.items():
+                if status[name] == "pendente" and all(status[dep] == "sucesso" for dep in stage["depends_on"]):
+                    kwargs = {key: options[key] for key in stage["options"]}
+                    memo = {"etapa": name, "forcar": name in forced} if memoize else None
+                    print(f"📥 Iniciando etapa {name}...")
+                    running[executor.submit(run_stage, stage["module"], kwargs, diagnose, memo)] = name
+                    status[name] = "executando"
 
-        # Ingestão Gold
-        print("📥 Iniciando ingestão de dados (gold)...")
-        import ingestion_gold 
-        ingestion_gold.main()  
+            if not running:
+                break
 
-        print("✅ Ingestão concluída com sucesso!")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    reports[name] = future.result()
+                except Exception as e:
+                    # 🔹 Processo da etapa morreu (ex.: falta de memória) antes de devolver o relatório
+                    reports[name] = {"status": "falhou", "erro": f"{type(e).__name__}: {e}"}
+                    traceback.print_exception(e)
 
-    except Exception as e:
-        print(f"❌ Erro durante a ingestão de dados: {e}")
+                status[name] = reports[name]["status"]
+                if reports[name].get("reaproveitada"):
+                    print(f"♻️ Etapa {name} reaproveitada (~{reports[name]['segundos_economizados']:.1f}s economizados)")
+                elif status[name] == "sucesso":
+                    print(f"✅ Etapa {name} concluída em {reports[name]['segundos']:.1f}s")
+                else:
+                    print(f"❌ Etapa {name} falhou: {reports[name]['erro']}")
+
+    return status, reports
+
+# 📌 3️⃣ Resumo final por etapa
+def print_summary(status, reports, elapsed):
+    print("📊 Resumo da execução:")
+    print(f"   {'etapa':<16} {'status':<10} {'tempo':>8} {'lidos':>10} {'gravados':>10} {'rejeitados':>10} "
+          f"{'reg/s':>10} {'memória':>9}")
+    for name in STAGES:
+        report = reports.get(name, {})
+        if "registros" not in report:
+            print(f"   {name:<16} {status[name]:<10} {'-':>8}")
+            continue
+        rows = report["registros"]
+        label = "reaprov." if report.get("reaproveitada") else status[name]
+        print(f"   {name:<16} {label:<10} {report['segundos']:>7.1f}s {rows['lidos']:>10} "
+              f"{rows['gravados']:>10} {rows['rejeitados']:>10} {report['registros_por_segundo']:>10,.0f} "
+              f"{report['pico_memoria_mb']:>6.0f} MB")
+    reused = [name for name in STAGES if reports.get(name, {}).get("reaproveitada")]
+    if reused:
+        saved = sum(reports[name]["segundos_economizados"] for name in reused)
+        print(f"♻️ {len(reused)} etapa(s) reaproveitada(s) ({', '.join(reused)}): ~{saved:.1f}s economizados "
+              f"(tempo da última execução de cada uma)")
+    print(f"⏱️ Tempo total: {elapsed:.1f}s")
+
+# 📌 4️⃣ Executando os scripts de ingestão como um DAG
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline de ingestão Bronze -> Silver -> Gold")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Ignora os watermarks: a Silver relê toda a Bronze e a Gold reagrega todos os CNPJs")
+    parser.add_argument("--silver-mode", choices=["python", "sql"], default=None,
+                        help="python: transforma no pandas; sql: INSERT ... SELECT dentro do Postgres")
+    parser.add_argument("--load-mode", choices=["insert", "staging"], default=None,
+                        help="insert: grava nas partições vivas; staging: carrega sem índices e anexa a partição no fim")
+    parser.add_argument("--cdc", action="store_true", default=None,
+                        help="Bronze e Silver gravam só inserções, alterações e exclusões entre snapshots")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('PIPELINE_WORKERS', '2')),
+                        help="Quantidade de etapas independentes executadas em paralelo")
+    parser.add_argument("--diagnostics", action="store_true", default=diagnostics.DIAGNOSTICS,
+                        help="EXPLAIN das consultas pesadas e deltas de pg_stat_statements/pg_stat_user_tables por etapa")
+    parser.add_argument("--force", action="append", choices=list(STAGES), default=[], metavar="ETAPA",
+                        help="Executa a etapa mesmo com as entradas iguais às da última execução (pode repetir)")
+    parser.add_argument("--from", dest="start_from", choices=list(STAGES), default=None, metavar="ETAPA",
+                        help="Executa a etapa e todas as que dependem dela; as anteriores seguem o fingerprint")
+    args = parser.parse_args()
+    if args.diagnostics and args.workers > 1:
+        # 🔹 As estatísticas do Postgres são do banco inteiro: uma etapa por vez para atribuir cada consulta
+        print("🩺 Diagnóstico ligado: etapas executadas uma por vez.")
+        args.workers = 1
+
+    print("🚀 Iniciando ingestão de dados...")
+    start = time.perf_counter()
+    options = {"full_refresh": args.full_refresh, "mode": args.silver_mode, "load_mode": args.load_mode, "cdc": args.cdc}
+    forced = set(args.force) | (downstream_stages(args.start_from) if args.start_from else set())
+    if args.full_refresh:
+        # 🔹 Reprocessar tudo é pedido explícito: as etapas que recebem a opção executam sempre
+        forced |= {name for name, stage in STAGES.items() if "full_refresh" in stage["options"]}
+    status, reports = run_pipeline(options, max_workers=args.workers, diagnose=args.diagnostics, forced=forced)
+    elapsed = time.perf_counter() - start
+    print_summary(status, reports, elapsed)
+    metrics.write_run_report(reports, status, elapsed, options)
+
+    if all(state == "sucesso" for state in status.values()):
+        print("✅ Ingestão concluída com sucesso!")
+    else:
+        print("❌ Ingestão concluída com falhas.")
+        sys.exit(1)
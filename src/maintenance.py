@@ -0,0 +1,215 @@
+import argparse
+import gzip
+import json
+import os
+import re
+import time
+from datetime import datetime
+import pandas as pd
+from database import connect_db, release_db, ensure_watermark_table, get_watermark
+from history import SILVER_TABLES, history_table, watermark_key, compact_silver
+from ingestion_gold import GOLD_SOURCE, WATERMARK_EMPRESAS, WATERMARK_SOCIOS, get_snapshots, silver_query
+
+# 🔹 Meses mantidos por tabela (o mês corrente conta); partições mais antigas saem
+RETENTION_MONTHS = int(os.getenv('RETENTION_MONTHS', '3'))
+# 🔹 Vazio: as partições antigas são apagadas; com diretório, viram CSV gzip antes de sair
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', '')
+
+# 🔹 Tabelas com retenção e os watermarks de quem as consome: só sai o que todos já leram
+RETENTION_TABLES = {
+    "bronze": [("bronze.empresas", ["silver.empresas"]),
+               ("bronze.socios", ["silver.socios"])],
+    "silver": [("silver.empresas", [watermark_key("silver.empresas"), WATERMARK_EMPRESAS]),
+               ("silver.socios", [watermark_key("silver.socios"), WATERMARK_SOCIOS])],
+}
+
+def size_mb(size):
+    return round(size / 1024 / 1024, 1)
+
+# 📌 1️⃣ Espaço ocupado por uma tabela particionada (todas as partições e índices)
+def table_size(cursor, table):
+    cursor.execute("SELECT to_regclass(%s);", (table,))
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute("""
+        SELECT CASE WHEN c.relkind = 'p'
+                    THEN (SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM pg_partition_tree(c.oid))
+                    ELSE pg_total_relation_size(c.oid) END
+        FROM pg_class c WHERE c.oid = %s::regclass;
+    """, (table,))
+    return int(cursor.fetchone()[0])
+
+# 📌 2️⃣ Partições de uma tabela com o limite superior e o tamanho de cada uma
+def list_partitions(cursor, table):
+    cursor.execute("""
+        SELECT c.oid::regclass::text, pg_get_expr(c.relpartbound, c.oid), pg_total_relation_size(c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY 1;
+    """, (table,))
+    partitions = []
+    for name, bound, size in cursor.fetchall():
+        match = re.search(r"TO \('([^']+)'\)", bound or "")
+        if match is None:
+            continue  # 🔹 Partição DEFAULT: sem limite, nunca sai pela retenção
+        partitions.append({"particao": name, "ate": pd.Timestamp(match.group(1)).to_pydatetime(), "bytes": int(size)})
+    return partitions
+
+# 📌 3️⃣ Copiar uma partição para CSV gzip (tmp + rename: arquivo pela metade nunca fica no lugar)
+def archive_partition(cursor, partition, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{partition}.csv.gz")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        cursor.copy_expert(f"COPY {partition} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    os.replace(tmp_path, path)
+    return path
+
+# 📌 4️⃣ Retenção: apagar (ou arquivar e apagar) as partições antigas já consumidas
+def apply_retention(conn, layers, months=RETENTION_MONTHS, archive_dir=RETENTION_ARCHIVE_DIR, dry_run=False):
+    """
+    Sai a partição que termina antes do corte (primeiro dia do mês corrente menos
+    `months - 1` meses) e até o menor watermark de quem lê a tabela. A partição
+    do último snapshot consumido termina depois dele e fica sempre.
+    """
+    ensure_watermark_table(conn)
+    cutoff = (pd.Timestamp(datetime.now()).normalize().replace(day=1) - pd.DateOffset(months=months - 1)).to_pydatetime()
+    print(f"🗓️ Retenção de {months} mês(es): partições que terminam até {cutoff:%Y-%m-%d}"
+          f"{' (simulação)' if dry_run else ''}")
+
+    removed = []
+    cursor = conn.cursor()
+    try:
+        for layer in layers:
+            if layer == "silver" and GOLD_SOURCE != "historico":
+                # 🔹 Com a Gold lendo a Silver (no CDC, a versão atual pode estar num mês antigo)
+                print("⏭️ Silver: retenção só com GOLD_SOURCE=historico")
+                continue
+            for table, consumers in RETENTION_TABLES[layer]:
+                cursor.execute("SELECT to_regclass(%s);", (table,))
+                if cursor.fetchone()[0] is None:
+                    continue
+                watermarks = [get_watermark(conn, consumer) for consumer in consumers]
+                if any(watermark is None for watermark in watermarks):
+                    print(f"⏭️ {table}: ainda não consumida por {', '.join(consumers)}, nada a remover")
+                    continue
+                limit = min([cutoff] + watermarks)
+
+                for partition in list_partitions(cursor, table):
+                    if partition["ate"] > limit:
+                        continue
+                    action = "arquivada e removida" if archive_dir else "removida"
+                    if not dry_run:
+                        if archive_dir:
+                            partition["arquivo"] = archive_partition(cursor, partition["particao"], archive_dir)
+                        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition['particao']};"
+                                       f"DROP TABLE {partition['particao']};")
+                        conn.commit()  # 🔹 Uma partição por vez: uma falha não desfaz as anteriores
+                    removed.append(dict(partition, tabela=table))
+                    print(f"🧹 {partition['particao']} {action if not dry_run else 'seria ' + action} "
+                          f"({size_mb(partition['bytes'])} MB)")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    reclaimed = sum(partition["bytes"] for partition in removed)
+    print(f"✅ {len(removed)} partição(ões), {size_mb(reclaimed)} MB {'a liberar' if dry_run else 'liberados'}")
+    return {"particoes": [partition["particao"] for partition in removed], "bytes_liberados": reclaimed}
+
+# 📌 5️⃣ Tempo da consulta da Gold (reagregação completa), pela Silver e pelo histórico
+def time_query(cursor, query, params, repeats):
+    best = None
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        cursor.execute(f"SELECT COUNT(*) FROM ({query.strip().rstrip(';')}) consulta;", params)
+        rows = cursor.fetchone()[0]
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+def measure_gold_query(conn, repeats=3):
+    snapshots = get_snapshots(conn, full_refresh=True)
+    if snapshots["empresas_atual"] is None:
+        print("⚠️ Silver vazia: nada a medir.")
+        return None
+
+    cursor = conn.cursor()
+    try:
+        # 🔹 Silver com linhas de CDC: a Gold usaria a consulta do CDC
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM silver.empresas WHERE operacao IS NOT NULL);")
+        cdc = cursor.fetchone()[0]
+        silver_seconds, silver_rows = time_query(cursor, silver_query(cdc, "silver"), snapshots, repeats)
+        history_seconds, history_rows = time_query(cursor, silver_query(cdc, "historico"), snapshots, repeats)
+    finally:
+        cursor.close()
+        conn.rollback()
+
+    result = {
+        "consulta_silver": "cdc" if cdc else "snapshot",
+        "silver_ms": round(silver_seconds * 1000, 1),
+        "historico_ms": round(history_seconds * 1000, 1),
+        "aceleracao": round(silver_seconds / history_seconds, 2) if history_seconds > 0 else None,
+        "cnpjs": {"silver": silver_rows, "historico": history_rows},
+    }
+    print(f"⏱️ Consulta da Gold (todos os CNPJs): Silver {result['silver_ms']} ms, "
+          f"histórico {result['historico_ms']} ms ({result['aceleracao']}x)")
+    if silver_rows != history_rows:
+        print(f"⚠️ Quantidade de CNPJs diferente: Silver {silver_rows}, histórico {history_rows}")
+    return result
+
+# 📌 6️⃣ Compactação: snapshots novos da Silver viram versões no histórico
+def compact(conn, measure=False):
+    results = compact_silver(conn)
+    cursor = conn.cursor()
+    try:
+        sizes = {}
+        for table, _, _ in SILVER_TABLES:
+            sizes[table] = {"silver_mb": size_mb(table_size(cursor, table)),
+                            "historico_mb": size_mb(table_size(cursor, history_table(table)))}
+            print(f"📦 {table}: {sizes[table]['silver_mb']} MB na Silver, "
+                  f"{sizes[table]['historico_mb']} MB em {history_table(table)}")
+    finally:
+        cursor.close()
+        conn.rollback()
+
+    report = {"compactacao": results, "tamanhos": sizes}
+    if measure:
+        report["consulta_gold"] = measure_gold_query(conn)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção: histórico SCD2 da Silver e retenção de partições")
+    parser.add_argument("command", choices=["compact", "retention", "all"],
+                        help="compact: Silver -> histórico; retention: remove partições antigas; all: os dois")
+    parser.add_argument("--months", type=int, default=RETENTION_MONTHS, help="Meses mantidos (o corrente conta)")
+    parser.add_argument("--layers", default="bronze",
+                        help="Camadas com retenção, separadas por vírgula (bronze, silver)")
+    parser.add_argument("--archive-dir", default=RETENTION_ARCHIVE_DIR,
+                        help="Arquiva as partições em CSV gzip antes de removê-las")
+    parser.add_argument("--dry-run", action="store_true", help="Só lista o que a retenção removeria")
+    parser.add_argument("--measure", action="store_true",
+                        help="Mede a consulta da Gold pela Silver e pelo histórico depois da compactação")
+    parser.add_argument("--output", help="Arquivo JSON Lines para acrescentar o relatório")
+    args = parser.parse_args()
+
+    layers = [layer.strip() for layer in args.layers.split(",") if layer.strip()]
+    unknown = set(layers) - set(RETENTION_TABLES)
+    if unknown:
+        parser.error(f"camada(s) sem retenção: {', '.join(sorted(unknown))}")
+
+    conn = connect_db(bulk=True)
+    try:
+        report = {"executado_em": datetime.now().isoformat(timespec="seconds"), "comando": args.command}
+        if args.command in ("compact", "all"):
+            report.update(compact(conn, measure=args.measure))
+        if args.command in ("retention", "all"):
+            report["retencao"] = apply_retention(conn, layers, args.months, args.archive_dir, args.dry_run)
+    finally:
+        release_db(conn)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report, default=str) + "\n")
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# 🔹 Onde ficam o relatório JSON de cada execução e o textfile lido pelo node_exporter
+METRICS_DIR = os.getenv('METRICS_DIR', '/app/stone/data/metrics')
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE', os.path.join(METRICS_DIR, 'stone.prom'))
+
+PHASES = ["leitura", "transformacao", "deduplicacao", "banco"]
+ROW_KINDS = ["lidos", "gravados", "rejeitados"]
+
+_current = None
+_lock = threading.Lock()  # 🔹 Writers paralelos (src/writers.py) somam nas mesmas métricas
+
+# 📌 1️⃣ Métricas vazias de uma etapa (ou de um shard, no processo worker)
+def new_metrics():
+    return {
+        "registros": dict.fromkeys(ROW_KINDS, 0),
+        "segundos": dict.fromkeys(PHASES, 0.0),
+        "lotes": [],  # 🔹 Latência (s) de cada lote enviado ao banco
+        "escritores": [],  # 🔹 Registros, blocos e segundos de cada writer paralelo
+        "fila": {"amostras": 0, "soma": 0, "maxima": 0},  # 🔹 Profundidade da fila dos writers
+        "particoes": [],  # 🔹 Registros e duplicatas de cada partição da deduplicação em disco
+        "pico_memoria_mb": 0.0,
+    }
+
+def current():
+    global _current
+    if _current is None:
+        _current = new_metrics()
+    return _current
+
+# 📌 2️⃣ Pico de memória do processo (VmHWM), zerável entre etapas no mesmo worker
+def reset_peak_memory():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass  # 🔹 Fora do Linux (ou sem permissão) fica o pico desde o início do processo
+
+def peak_memory_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# 📌 3️⃣ Começar a medir uma etapa (ou um shard) neste processo
+def start():
+    global _current
+    _current = new_metrics()
+    reset_peak_memory()
+    return _current
+
+# 📌 4️⃣ Contar registros lidos, gravados ou rejeitados
+def add_rows(kind, count):
+    with _lock:
+        current()["registros"][kind] += int(count)
+
+# 📌 5️⃣ Acumular o tempo de um trecho numa fase (leitura, transformação, banco)
+@contextmanager
+def phase(name):
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            current()["segundos"][name] += time.perf_counter() - begin
+
+# 📌 6️⃣ Medir cada next() de um iterador de blocos, contando as linhas lidas
+def timed_iter(iterable, name, rows=None):
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        if rows is not None:
+            add_rows(rows, len(item))
+        yield item
+
+# 📌 7️⃣ Registrar a latência de um lote enviado ao banco
+def record_batch(seconds):
+    with _lock:
+        current()["lotes"].append(round(seconds, 6))
+
+# 🔹 Profundidade da fila de um writer no momento em que um bloco é enfileirado
+def record_queue_depth(depth):
+    with _lock:
+        queue_stats = current()["fila"]
+        queue_stats["amostras"] += 1
+        queue_stats["soma"] += depth
+        queue_stats["maxima"] = max(queue_stats["maxima"], depth)
+
+def record_writer(rows, chunks, seconds):
+    with _lock:
+        current()["escritores"].append({"registros": rows, "blocos": chunks, "segundos": round(seconds, 3)})
+
+def record_partition(name, rows, duplicates):
+    with _lock:
+        current()["particoes"].append({"particao": name, "registros": int(rows), "duplicadas": int(duplicates)})
+
+# 📌 8️⃣ Copiar as métricas do processo (para devolver do worker ao processo da etapa)
+def snapshot():
+    data = current()
+    data["pico_memoria_mb"] = max(data["pico_memoria_mb"], peak_memory_mb())
+    return json.loads(json.dumps(data))
+
+# 📌 9️⃣ Somar as métricas de um shard às da etapa
+def merge(data):
+    target = current()
+    for kind, count in data["registros"].items():
+        target["registros"][kind] = target["registros"].get(kind, 0) + count
+    for name, seconds in data["segundos"].items():
+        target["segundos"][name] = target["segundos"].get(name, 0.0) + seconds
+    target["lotes"].extend(data["lotes"])
+    target["escritores"].extend(data["escritores"])
+    target["particoes"].extend(data["particoes"])
+    for key in ("amostras", "soma"):
+        target["fila"][key] += data["fila"][key]
+    target["fila"]["maxima"] = max(target["fila"]["maxima"], data["fila"]["maxima"])
+    # 🔹 Pico do maior processo: os shards rodam em processos próprios
+    target["pico_memoria_mb"] = max(target["pico_memoria_mb"], data["pico_memoria_mb"])
+
+# 📌 🔟 Percentis das latências dos lotes
+def latency_summary(latencies):
+    if not latencies:
+        return {"quantidade": 0, "p50": None, "p95": None, "max": None}
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"quantidade": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "max": ordered[-1]}
+
+# 📌 1️⃣1️⃣ Relatório final de uma etapa
+def stage_report(seconds, error=None):
+    data = snapshot()
+    written = data["registros"]["gravados"]
+    return {
+        "status": "falhou" if error is not None else "sucesso",
+        "erro": f"{type(error).__name__}: {error}" if error is not None else None,
+        "segundos": round(seconds, 3),
+        "registros": data["registros"],
+        "registros_por_segundo": round(written / seconds, 1) if seconds > 0 else 0.0,
+        "segundos_por_fase": {name: round(value, 3) for name, value in data["segundos"].items()},
+        "pico_memoria_mb": round(data["pico_memoria_mb"], 1),
+        "latencia_lotes": latency_summary(data["lotes"]),
+        "escritores": [dict(writer, registros_por_segundo=round(writer["registros"] / writer["segundos"], 1)
+                            if writer["segundos"] > 0 else 0.0) for writer in data["escritores"]],
+        "fila": {"media": round(data["fila"]["soma"] / data["fila"]["amostras"], 2) if data["fila"]["amostras"] else None,
+                 "maxima": data["fila"]["maxima"]},
+        "particoes": sorted(data["particoes"], key=lambda partition: partition["particao"]),
+    }
+
+# 📌 1️⃣2️⃣ Gravar um arquivo de uma vez (tmp + rename), sem leitor ver arquivo pela metade
+def write_atomic(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+# 📌 1️⃣3️⃣ Métricas no formato texto do Prometheus (coletor textfile do node_exporter)
+def prometheus_text(run):
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    stages = run["etapas"].items()
+    metric("stone_run_success", "1 se todas as etapas da última execução terminaram com sucesso",
+           [({}, int(run["status"] == "sucesso"))])
+    metric("stone_run_duration_seconds", "Duração total da última execução", [({}, run["segundos"])])
+    metric("stone_run_timestamp_seconds", "Fim da última execução (epoch)", [({}, run["terminado_em_epoch"])])
+    metric("stone_stage_success", "1 se a etapa terminou com sucesso",
+           [({"stage": name}, int(report["status"] == "sucesso")) for name, report in stages])
+    metric("stone_stage_duration_seconds", "Duração da etapa",
+           [({"stage": name}, report["segundos"]) for name, report in stages])
+    metric("stone_stage_rows", "Registros da etapa por tipo (lidos, gravados, rejeitados)",
+           [({"stage": name, "kind": kind}, count)
+            for name, report in stages for kind, count in report["registros"].items()])
+    metric("stone_stage_rows_per_second", "Registros gravados por segundo",
+           [({"stage": name}, report["registros_por_segundo"]) for name, report in stages])
+    metric("stone_stage_phase_seconds", "Tempo da etapa por fase (somado entre shards)",
+           [({"stage": name, "phase": phase_name}, seconds)
+            for name, report in stages for phase_name, seconds in report["segundos_por_fase"].items()])
+    metric("stone_stage_peak_memory_bytes", "Pico de RSS do maior processo da etapa",
+           [({"stage": name}, int(report["pico_memoria_mb"] * 1024 * 1024)) for name, report in stages])
+    metric("stone_stage_batch_latency_seconds", "Latência dos lotes enviados ao banco",
+           [({"stage": name, "quantile": quantile}, report["latencia_lotes"][key])
+            for name, report in stages
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("1", "max"))
+            if report["latencia_lotes"][key] is not None])
+    metric("stone_stage_batches", "Lotes enviados ao banco",
+           [({"stage": name}, report["latencia_lotes"]["quantidade"]) for name, report in stages])
+    metric("stone_stage_writer_rows_per_second", "Registros por segundo de cada writer paralelo (tempo ocupado)",
+           [({"stage": name, "writer": str(index)}, writer["registros_por_segundo"])
+            for name, report in stages for index, writer in enumerate(report.get("escritores", []))])
+    metric("stone_stage_queue_depth", "Profundidade da fila dos writers ao enfileirar um bloco",
+           [({"stage": name, "stat": stat}, report["fila"][stat])
+            for name, report in stages for stat in ("media", "maxima")
+            if report.get("fila", {}).get("media") is not None])
+    metric("stone_stage_partition_duplicates", "Duplicatas removidas por partição na deduplicação em disco",
+           [({"stage": name, "partition": partition["particao"]}, partition["duplicadas"])
+            for name, report in stages for partition in report.get("particoes", [])])
+    metric("stone_stage_memoized", "1 se a etapa foi reaproveitada (entradas iguais às da última execução)",
+           [({"stage": name}, int(report.get("reaproveitada", False))) for name, report in stages])
+    metric("stone_run_saved_seconds", "Tempo economizado pelas etapas reaproveitadas (última execução de cada uma)",
+           [({}, sum(report.get("segundos_economizados", 0) for _, report in stages))])
+    metric("stone_stage_db_seconds", "Tempo das consultas da etapa no Postgres (pg_stat_statements, modo de diagnóstico)",
+           [({"stage": name}, report["diagnostico"]["segundos_banco"]) for name, report in stages
+            if (report.get("diagnostico") or {}).get("segundos_banco") is not None])
+    return "\n".join(lines) + "\n"
+
+# 📌 1️⃣4️⃣ Gravar o relatório JSON da execução e o textfile do Prometheus
+def write_run_report(reports, status, seconds, options=None):
+    finished = datetime.now()
+    run = {
+        "status": "sucesso" if all(state == "sucesso" for state in status.values()) else "falhou",
+        "terminado_em": finished.isoformat(timespec="seconds"),
+        "terminado_em_epoch": int(finished.timestamp()),
+        "segundos": round(seconds, 3),
+        "opcoes": options or {},
+        "etapas": {name: reports.get(name, {"status": state}) for name, state in status.items()},
+    }
+    # 🔹 Etapas ignoradas ou que nem chegaram a rodar não têm números: ficam só no JSON
+    measured = {name: report for name, report in run["etapas"].items() if "registros" in report}
+
+    report_path = os.path.join(METRICS_DIR, f"run_{finished.strftime('%Y%m%d_%H%M%S')}.json")
+    try:
+        write_atomic(report_path, json.dumps(run, indent=2, ensure_ascii=False, default=str))
+        write_atomic(METRICS_TEXTFILE, prometheus_text(dict(run, etapas=measured)))
+        print(f"📝 Relatório da execução em {report_path}; métricas em {METRICS_TEXTFILE}")
+    except OSError as e:
+        # 🔹 Falha ao gravar métricas não pode mascarar o resultado da carga
+        print(f"⚠️ Não foi possível gravar as métricas: {e}")
+    return run
@@ -0,0 +1,156 @@
+import io
+import mmap
+import os
+import shutil
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import metrics
+from cache import to_table
+from transform import STRING_DTYPE
+
+# 🔹 Processos de parse por membro: com mais de 1, o CSV é dividido em faixas de bytes
+#    lidas em paralelo (com um membro grande só, use BRONZE_WORKERS=1 e um processo por núcleo)
+PARSE_WORKERS = int(os.getenv('BRONZE_PARSE_WORKERS', '1'))
+EXTRACT_PATH = os.getenv('EXTRACT_PATH', '/app/stone/temp')
+# 🔹 '1': o CSV extraído fica para a próxima carga do mesmo ZIP; '0': removido no fim
+KEEP_EXTRACTED = os.getenv('BRONZE_KEEP_EXTRACTED', '1') == '1'
+SAMPLE_BYTES = 4 * 1024 * 1024  # 🔹 Início do arquivo usado para estimar os bytes por linha
+SCAN_BYTES = 64 * 1024 * 1024  # 🔹 Bloco da contagem de aspas até cada divisa
+
+# 📌 1️⃣ Descompactar o membro uma vez (ou reaproveitar a extração de uma carga anterior)
+def extract_member(zip_path, member, extract_dir=None):
+    extract_dir = extract_dir or EXTRACT_PATH
+    zip_name = os.path.splitext(os.path.basename(zip_path))[0]
+    path = os.path.join(extract_dir, zip_name, os.path.basename(member))
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        info = zip_ref.getinfo(member)
+        if (os.path.exists(path) and os.path.getsize(path) == info.file_size
+                and os.path.getmtime(path) >= os.path.getmtime(zip_path)):
+            print(f"♻️ Reaproveitando a extração de {os.path.basename(zip_path)}/{member}")
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"  # 🔹 Extração pela metade nunca fica no lugar
+        try:
+            with zip_ref.open(info) as source, open(tmp_path, "wb") as target:
+                shutil.copyfileobj(source, target, 16 * 1024 * 1024)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return path
+
+# 📌 2️⃣ Levar cada divisa para o início de um registro (fora de campo entre aspas)
+def count_quotes(mm, start, end):
+    total = 0
+    for position in range(start, end, SCAN_BYTES):
+        total += mm[position:min(position + SCAN_BYTES, end)].count(b'"')
+    return total
+
+def align_to_records(mm, targets):
+    """
+    Um '\\n' só separa registros quando a quantidade de aspas antes dele é par
+    (aspas escapadas como "" não mudam a paridade): ';' e quebras de linha dentro
+    de um campo entre aspas nunca viram divisa. Retorna o início de cada faixa
+    depois da primeira.
+    """
+    boundaries = []
+    position, inside = 0, False
+    for target in targets:
+        if target <= position:
+            continue  # 🔹 Registro maior que uma faixa: a divisa anterior já passou deste ponto
+        inside ^= count_quotes(mm, position, target) % 2 == 1
+        position = target
+        while True:
+            newline = mm.find(b"\n", position)
+            if newline == -1:
+                return boundaries
+            inside ^= mm[position:newline].count(b'"') % 2 == 1
+            position = newline + 1
+            if not inside:
+                boundaries.append(position)
+                break
+    return boundaries
+
+# 📌 3️⃣ Faixas de bytes com ~chunk_size linhas cada
+def plan_ranges(path, chunk_size):
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        sample = mm[:SAMPLE_BYTES]
+        step = max(1, len(sample) // max(sample.count(b"\n"), 1) * chunk_size)
+        starts = [0] + [start for start in align_to_records(mm, range(step, size, step)) if start < size]
+    return list(zip(starts, starts[1:] + [size]))
+
+# 📌 4️⃣ No processo de parse: ler e tratar uma faixa, gravando o resultado em Arrow IPC
+def parse_range(path, start, end, read_options, transform, out_path):
+    metrics.start()
+    with metrics.phase("leitura"):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            df = pd.read_csv(io.BytesIO(mm[start:end]), **read_options)
+    with metrics.phase("transformacao"):
+        df = transform(df)
+        table = to_table(df)
+    with pa.OSFile(out_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return len(df), metrics.snapshot()
+
+# 🔹 No processo do shard: a faixa volta por memory map, com o texto direto em Arrow
+def read_part(out_path):
+    with pa.memory_map(out_path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(types_mapper={pa.string(): STRING_DTYPE}.get)
+
+# 📌 5️⃣ Blocos de um membro lidos e tratados em paralelo, na ordem do arquivo
+def parse_parallel(zip_path, member, chunk_size, read_options, transform, workers=PARSE_WORKERS, skip_rows=0):
+    """
+    Mesmos blocos (em conteúdo e ordem) que a leitura sequencial com o mesmo
+    `transform`; só o tamanho de cada bloco varia um pouco, já que a faixa é
+    medida em bytes. No máximo 2 faixas por processo ficam em andamento.
+    """
+    with metrics.phase("leitura"):
+        path = extract_member(zip_path, member)
+        ranges = plan_ranges(path, chunk_size)
+    parts_dir = f"{path}.faixas.{os.getpid()}"
+    os.makedirs(parts_dir, exist_ok=True)
+    print(f"🧩 {os.path.basename(zip_path)}/{member}: {len(ranges)} faixa(s) lidas por {workers} processo(s)")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            queued = iter(enumerate(ranges))
+
+            def submit_next():
+                for index, (start, end) in queued:
+                    out_path = os.path.join(parts_dir, f"{index:06d}.arrow")
+                    pending.append((out_path, executor.submit(parse_range, path, start, end, read_options,
+                                                              transform, out_path)))
+                    return
+
+            for _ in range(workers * 2):
+                submit_next()
+            while pending:
+                out_path, future = pending.popleft()
+                _, worker_metrics = future.result()
+                metrics.merge(worker_metrics)  # 🔹 Tempo de leitura e tratamento dos processos de parse
+                submit_next()
+                with metrics.phase("leitura"):
+                    df = read_part(out_path)
+                os.remove(out_path)
+
+                # 🔹 Retomada de uma carga interrompida: linhas já gravadas ficam de fora
+                if skip_rows >= len(df):
+                    skip_rows -= len(df)
+                    continue
+                if skip_rows:
+                    df, skip_rows = df.iloc[skip_rows:].reset_index(drop=True), 0
+                metrics.add_rows("lidos", len(df))
+                yield df
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        if not KEEP_EXTRACTED and os.path.exists(path):
+            os.remove(path)
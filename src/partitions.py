@@ -0,0 +1,103 @@
+import os
+import time
+import pandas as pd
+import metrics
+
+# 🔹 'insert': grava direto na partição viva; 'staging': carrega numa tabela sem índices e anexa no fim
+LOAD_MODE = os.getenv('LOAD_MODE', 'insert')
+
+# 📌 1️⃣ Nome e limites da partição mensal que contém a data
+def month_partition(table, data):
+    schema, name = table.split(".")
+    start = data.strftime('%Y-%m-01')
+    end = (data.replace(day=1) + pd.DateOffset(months=1)).strftime('%Y-%m-01')
+    return f"{name}_{data.strftime('%Y_%m')}", schema, start, end
+
+# 📌 2️⃣ Localizar a partição atual do mês, qualquer que seja o nome dela
+def find_month_partition(cursor, table, start, end):
+    cursor.execute("""
+        SELECT c.oid::regclass::text
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+          AND pg_get_expr(c.relpartbound, c.oid) = %s;
+    """, (table, f"FOR VALUES FROM ('{start} 00:00:00') TO ('{end} 00:00:00')"))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# 📌 3️⃣ Criar a tabela de staging UNLOGGED, sem PK nem índices (sem commit)
+def staging_table_name(table, data):
+    partition_name, schema, _, _ = month_partition(table, data)
+    return f"{schema}.{partition_name}_staging"
+
+def create_staging_table(conn, table, data):
+    partition_name, schema, start, end = month_partition(table, data)
+    staging = staging_table_name(table, data)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            DROP TABLE IF EXISTS {staging};
+            CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS);
+        """)
+
+        # 🔹 As linhas que o mês já tinha entram primeiro: na deduplicação elas prevalecem,
+        #    como no ON CONFLICT DO NOTHING da partição viva
+        current = find_month_partition(cursor, table, start, end)
+        if current is not None:
+            cursor.execute(f"INSERT INTO {staging} SELECT * FROM {current};")
+            print(f"📋 {cursor.rowcount} registros de {current} copiados para a staging.")
+    finally:
+        cursor.close()
+    print(f"🧱 Tabela de staging {staging} criada.")
+    return staging
+
+# 📌 4️⃣ Indexar a staging e trocá-la pela partição do mês (sem commit: a troca é atômica)
+def attach_staging_table(conn, table, staging, partition_key, primary_key, data, dedupe=False):
+    partition_name, schema, start, end = month_partition(table, data)
+    pk_columns = ", ".join(primary_key)
+    cursor = conn.cursor()
+    begin = time.perf_counter()
+
+    try:
+        if dedupe:
+            # 🔹 Mesma semântica do ON CONFLICT DO NOTHING: fica a primeira linha gravada
+            cursor.execute(f"""
+                DELETE FROM {staging} s
+                USING (
+                    SELECT ctid FROM (
+                        SELECT ctid, ROW_NUMBER() OVER (PARTITION BY {pk_columns} ORDER BY ctid) AS ordem
+                        FROM {staging}
+                    ) r WHERE ordem > 1
+                ) duplicadas
+                WHERE s.ctid = duplicadas.ctid;
+            """)
+            print(f"🧹 {cursor.rowcount} duplicadas removidas da staging.")
+            # 🔹 Contadas como gravadas no COPY, mas descartadas aqui
+            metrics.add_rows("gravados", -cursor.rowcount)
+            metrics.add_rows("rejeitados", cursor.rowcount)
+
+        # 🔹 Índices e CHECK construídos uma vez só, depois da carga
+        cursor.execute(f"""
+            ALTER TABLE {staging} SET LOGGED;
+            ALTER TABLE {staging} ADD CONSTRAINT {partition_name}_stg_pkey PRIMARY KEY ({pk_columns});
+            ALTER TABLE {staging} ADD CONSTRAINT {partition_name}_bounds
+                CHECK ({partition_key} IS NOT NULL AND {partition_key} >= '{start}' AND {partition_key} < '{end}');
+        """)
+
+        # 🔹 Troca atômica: sai a partição antiga do mês, entra a staging
+        current = find_month_partition(cursor, table, start, end)
+        if current is not None:
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {current}; DROP TABLE {current};")
+            print(f"♻️ Partição {current} substituída.")
+
+        cursor.execute(f"""
+            ALTER TABLE {staging} RENAME TO {partition_name};
+            ALTER INDEX {schema}.{partition_name}_stg_pkey RENAME TO {partition_name}_pkey;
+            ALTER TABLE {table} ATTACH PARTITION {schema}.{partition_name}
+                FOR VALUES FROM ('{start}') TO ('{end}');
+            ALTER TABLE {schema}.{partition_name} DROP CONSTRAINT {partition_name}_bounds;
+        """)
+    finally:
+        cursor.close()
+
+    print(f"📎 {schema}.{partition_name} anexada a {table} em {time.perf_counter() - begin:.1f}s")
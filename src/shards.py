@@ -0,0 +1,58 @@
+import os
+import re
+import glob
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 📌 1️⃣ Descobrir todos os ZIPs e membros CSV que casam com os padrões
+def discover_shards(zip_pattern, member_pattern):
+    regex = re.compile(member_pattern)
+    shards = []
+
+    for zip_path in sorted(glob.glob(zip_pattern)):
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            members = [name for name in zip_ref.namelist() if regex.match(os.path.basename(name))]
+        shards.extend((zip_path, member) for member in sorted(members))
+
+    if not shards:
+        raise FileNotFoundError(f"❌ Nenhum arquivo encontrado para {zip_pattern} com membros {member_pattern}.")
+
+    print(f"🗂️ {len(shards)} shard(s) encontrado(s) em {zip_pattern}")
+    return shards
+
+# 📌 2️⃣ Ingerir os shards em paralelo, um processo (e uma conexão) por shard
+def run_shards(worker, shards, max_workers, *args):
+    start = time.perf_counter()
+    results = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(worker, zip_path, member, *args): (zip_path, member)
+                   for zip_path, member in shards}
+        for future in as_completed(futures):
+            zip_path, member = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"❌ Falha no shard {os.path.basename(zip_path)}/{member}: {e}")
+                failures.append((zip_path, member, e))
+
+    print_report(results, failures, time.perf_counter() - start)
+    if failures:
+        raise RuntimeError(f"❌ {len(failures)} de {len(shards)} shard(s) falharam.")
+    return results
+
+# 📌 3️⃣ Relatório consolidado da ingestão
+def print_report(results, failures, elapsed):
+    total = sum(result["registros"] for result in results)
+    print("📊 Relatório da ingestão por shard:")
+    for result in sorted(results, key=lambda r: (r["arquivo"], r["membro"])):
+        rate = result["registros"] / result["segundos"] if result["segundos"] > 0 else 0
+        print(f"   {os.path.basename(result['arquivo'])}/{result['membro']}: "
+              f"{result['registros']} registros em {result['segundos']:.1f}s ({rate:,.0f} registros/s)")
+    for zip_path, member, e in failures:
+        print(f"   {os.path.basename(zip_path)}/{member}: falhou ({e})")
+
+    rate = total / elapsed if elapsed > 0 else 0
+    print(f"✅ {total} registros de {len(results)} shard(s) em {elapsed:.1f}s ({rate:,.0f} registros/s)")
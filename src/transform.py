@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# 🔹 Tabela de tradução que remove os caracteres de controle ASCII (\x00-\x1F e \x7F)
+CONTROL_CHARS = {code: None for code in list(range(0x00, 0x20)) + [0x7F]}
+
+# 🔹 Todos os caracteres que str.strip() considera espaço em branco
+WHITESPACE = "".join(chr(code) for code in range(0x110000) if chr(code).isspace())
+
+# 🔹 Texto guardado em buffers Arrow, sem um objeto str do Python por célula
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+# 📌 1️⃣ Aplicar a limpeza apenas nos valores texto, preservando os demais
+def keep_non_text(cleaned, original):
+    # 🔹 Valores nulos ou que não são str voltam exatamente como estavam
+    return cleaned.where(cleaned.notna(), original)
+
+# 📌 2️⃣ Converter uma coluna de textos para Arrow (None se houver valores não-texto)
+def to_arrow_strings(series):
+    try:
+        # 🔹 Coluna string[pyarrow] ignora o `type` pedido e volta com offsets int32
+        array = pa.array(series, type=pa.large_string(), from_pandas=True)
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        return array.cast(pa.large_string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError, UnicodeEncodeError):
+        return None
+
+# 📌 3️⃣ Voltar de Arrow para uma coluna pandas com o mesmo índice
+def from_arrow_strings(array, series):
+    if series.dtype == STRING_DTYPE:
+        # 🔹 Coluna já em Arrow: devolve o buffer limpo sem passar por objetos Python
+        cleaned = pd.arrays.ArrowStringArray(array.cast(pa.string()))
+        return pd.Series(cleaned, index=series.index, name=series.name)
+
+    cleaned = pd.Series(array.to_numpy(zero_copy_only=False), index=series.index, name=series.name)
+    return keep_non_text(cleaned, series)
+
+# 📌 4️⃣ Remover bytes direto no buffer Arrow, sem chamar Python por célula
+def drop_bytes(array, keep_byte):
+    validity, offsets, data = array.buffers()
+    if data is None:
+        return array
+
+    offsets = np.frombuffer(offsets, dtype=np.int64)[:array.offset + len(array) + 1]
+    data = np.frombuffer(data, dtype=np.uint8)
+    keep = keep_byte(data)
+
+    # 🔹 Novo offset de cada célula = quantidade de bytes mantidos antes dela
+    kept_before = np.concatenate(([0], np.cumsum(keep, dtype=np.int64)))
+    return pa.LargeStringArray.from_buffers(len(array), pa.py_buffer(kept_before[offsets]),
+                                            pa.py_buffer(data[keep]), validity,
+                                            array.null_count, array.offset)
+
+# 📌 5️⃣ Equivalente vetorizado de value.encode('utf-8', 'ignore').decode('utf-8').strip()
+def clean_utf8_strip(series):
+    array = to_arrow_strings(series)
+
+    # 🔹 Se o Arrow aceitou a coluna não há surrogates: o encode/decode não muda nada
+    if array is not None:
+        return from_arrow_strings(pc.utf8_trim(array, characters=WHITESPACE), series)
+
+    cleaned = series.str.encode('utf-8', 'ignore').str.decode('utf-8').str.strip()
+    return keep_non_text(cleaned, series)
+
+# 📌 6️⃣ Equivalente vetorizado de re.sub(r'[^\x20-\x7E]', '', value).strip()
+def clean_printable_ascii(series, remove_chars=""):
+    removed = np.frombuffer(remove_chars.encode('ascii'), dtype=np.uint8)
+    array = to_arrow_strings(series)
+
+    if array is not None:
+        # 🔹 Em UTF-8 todo caractere fora do ASCII só tem bytes >= 0x80,
+        #    então descartar bytes fora de 0x20-0x7E remove o caractere inteiro
+        array = drop_bytes(array, lambda data: (data >= 0x20) & (data < 0x7F) & ~np.isin(data, removed))
+        # 🔹 Depois da limpeza o único espaço em branco possível é ' '
+        return from_arrow_strings(pc.utf8_trim(array, characters=' '), series)
+
+    table = dict(CONTROL_CHARS)
+    table.update({ord(char): None for char in remove_chars})
+    cleaned = (series.str.encode('ascii', 'ignore')
+                     .str.decode('ascii')
+                     .str.translate(table)
+                     .str.strip())
+    return keep_non_text(cleaned, series)
+
+# 📌 7️⃣ Limpar uma coluna categórica limpando só as categorias
+def clean_categorical(series, cleaner):
+    categories = cleaner(pd.Series(series.cat.categories, dtype=object))
+    # 🔹 Categorias que ficam iguais depois da limpeza passam a ser uma só
+    merged = pd.Categorical(categories)
+    # 🔹 Código -1 (nulo) pega o -1 acrescentado no fim e continua nulo
+    new_codes = np.append(merged.codes, -1)[series.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(new_codes, merged.categories),
+                     index=series.index, name=series.name)
+
+# 📌 8️⃣ Colunas de texto: object, texto Arrow ou categorias
+def is_text_column(series):
+    return series.dtype == object or series.dtype == STRING_DTYPE or isinstance(series.dtype, pd.CategoricalDtype)
+
+# 📌 9️⃣ Aplicar uma função de limpeza coluna a coluna no DataFrame
+def clean_text_columns(df, cleaner, columns=None):
+    if columns is None:
+        columns = [col for col in df.columns if is_text_column(df[col])]
+
+    for col in columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = clean_categorical(df[col], cleaner)
+        else:
+            df[col] = cleaner(df[col])
+    return df
+
+# 📌 🔟 Comparar duas saídas de transformação ignorando a ordem das linhas
+def compare_frames(df_left, df_right, columns, numeric_columns=()):
+    def normalize(df):
+        df = pd.DataFrame(columns=columns) if df is None else df[columns].copy()
+        for col in numeric_columns:
+            df[col] = df[col].astype(float)  # 🔹 NUMERIC do Postgres chega como Decimal
+        return df.sort_values(columns).reset_index(drop=True)
+
+    left, right = normalize(df_left), normalize(df_right)
+    try:
+        pd.testing.assert_frame_equal(left, right, check_dtype=False)
+    except AssertionError as e:
+        print(f"❌ Divergência entre os modos: {e}")
+        return False
+
+    print(f"✅ Modos equivalentes: {len(left)} registros idênticos.")
+    return True
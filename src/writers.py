@@ -0,0 +1,140 @@
+import os
+import queue
+import threading
+import time
+import pandas as pd
+from database import DB_POOL_SIZE, connect_db, release_db
+import metrics
+
+# 🔹 Partes enfileiradas por writer: com a fila cheia o produtor espera (backpressure)
+WRITER_QUEUE_SIZE = int(os.getenv('WRITER_QUEUE_SIZE', '2'))
+
+# 📌 1️⃣ Dividir um bloco em N partes pelo hash da chave: um CNPJ sempre no mesmo writer
+def split_by_key(df, key, parts):
+    if parts == 1:
+        return [df]
+    bucket = pd.util.hash_pandas_object(df[key], index=False).to_numpy() % parts
+    return [df[bucket == index] for index in range(parts)]
+
+# 📌 2️⃣ Produtor/consumidor: quem chama lê e trata os blocos; N threads gravam, cada uma na sua conexão
+class ParallelWriter:
+    """
+    Cada bloco enviado por `submit` vira uma rodada: as partes vão para as filas dos
+    writers e, quando todos terminam a sua parte, a rodada fecha (commit de todas as
+    conexões se `commit_rounds`, e depois `on_round(gravados)`). Como as chaves são
+    disjuntas entre writers, não há espera por locks entre eles, e a ordem dos blocos
+    de uma mesma chave é preservada.
+    """
+
+    def __init__(self, load, writers, key="cnpj", queue_size=WRITER_QUEUE_SIZE,
+                 commit_rounds=False, on_round=None, name="writer"):
+        if writers + 1 > DB_POOL_SIZE:
+            # 🔹 Os writers e a conexão de quem chama saem do mesmo pool do processo
+            raise ValueError(f"❌ {writers} writers precisam de DB_POOL_SIZE >= {writers + 1} (atual: {DB_POOL_SIZE}).")
+
+        self.load = load
+        self.key = key
+        self.commit_rounds = commit_rounds
+        self.on_round = on_round
+        self.error = None
+        self.submitted = 0
+        self.total = 0
+        self.round_rows = [0] * writers
+        self.stats = [{"registros": 0, "blocos": 0, "segundos": 0.0} for _ in range(writers)]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(writers)]
+        self.connections = [connect_db(bulk=True) for _ in range(writers)]
+        self.barrier = threading.Barrier(writers, action=self.finish_round)
+        self.threads = [threading.Thread(target=self.run, args=(index,), name=f"{name}-{index}", daemon=True)
+                        for index in range(writers)]
+        for thread in self.threads:
+            thread.start()
+
+    # 🔹 Rodada fechada: roda numa das threads, com todos os writers parados na barreira
+    def finish_round(self):
+        written = sum(self.round_rows)
+        self.total += written
+        if self.commit_rounds:
+            for conn in self.connections:
+                conn.commit()
+        if self.on_round is not None:
+            self.on_round(written)
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.barrier.abort()
+
+    def run(self, index):
+        conn = self.connections[index]
+        stats = self.stats[index]
+        while True:
+            item = self.queues[index].get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # 🔹 Só esvazia a fila: o produtor vê o erro no próximo submit
+            try:
+                begin = time.perf_counter()
+                written = self.load(conn, item) if len(item) else 0
+                stats["segundos"] += time.perf_counter() - begin
+                stats["registros"] += written
+                stats["blocos"] += 1
+                self.round_rows[index] = written
+                self.barrier.wait()
+            except threading.BrokenBarrierError:
+                pass  # 🔹 Outro writer falhou e já registrou o erro
+            except Exception as e:
+                self.fail(e)
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    # 📌 3️⃣ Enfileirar um bloco já tratado (bloqueia enquanto a fila do writer estiver cheia)
+    def submit(self, df):
+        self.check()
+        for target, part in zip(self.queues, split_by_key(df, self.key, len(self.queues))):
+            metrics.record_queue_depth(target.qsize())
+            while True:
+                try:
+                    target.put(part, timeout=1)
+                    break
+                except queue.Full:
+                    self.check()
+        self.submitted += 1
+
+    # 📌 4️⃣ Esperar os writers terminarem tudo o que foi enfileirado
+    def join(self):
+        for target in self.queues:
+            target.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.check()
+        return self.total
+
+    def commit(self):
+        for conn in self.connections:
+            conn.commit()
+
+    # 📌 5️⃣ Devolver as conexões (rollback do que não foi confirmado) e publicar as métricas
+    def close(self):
+        if any(thread.is_alive() for thread in self.threads):
+            self.fail(RuntimeError("❌ Carga paralela interrompida."))
+            for target in self.queues:
+                target.put(None)
+            for thread in self.threads:
+                thread.join()
+        for conn in self.connections:
+            release_db(conn)
+        for stats in self.stats:
+            metrics.record_writer(stats["registros"], stats["blocos"], stats["segundos"])
+        if len(self.stats) > 1:
+            rates = ", ".join(f"{s['registros'] / s['segundos']:,.0f}" if s["segundos"] > 0 else "0" for s in self.stats)
+            print(f"✍️ {len(self.stats)} writers: {self.total} registros em {self.submitted} bloco(s) ({rates} registros/s)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False